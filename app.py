@@ -3,6 +3,7 @@ import requests
 import os
 from dotenv import load_dotenv
 import uuid
+import json
 import random
 
 load_dotenv()
@@ -36,6 +37,25 @@ def generate_meditation_suggestion(user_input, ai_response):
     
     return None
 
+class ReplyInterrupted(Exception):
+    """The backend ended the stream with an error event"""
+
+def iter_reply_deltas(response):
+    """Yield text deltas from the backend's server-sent event stream"""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+            continue
+        if not line or not line.startswith("data: "):
+            continue
+        data = json.loads(line[len("data: "):])
+        if event == "error":
+            raise ReplyInterrupted(data.get("detail", "The reply was interrupted, please try again"))
+        event = None
+        if "delta" in data:
+            yield data["delta"]
+
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -121,7 +141,7 @@ if prompt := st.chat_input("How are you feeling today?"):
         st.markdown(prompt)
     
     # Prepare API request
-    url = f"{BACKEND_URL.rstrip('/')}/api/v1/chat"
+    url = f"{BACKEND_URL.rstrip('/')}/api/v1/chat/stream"
     headers = {
         "Content-Type": "application/json",
         "x-api-key": OPENAI_API_KEY
@@ -136,59 +156,64 @@ if prompt := st.chat_input("How are you feeling today?"):
     # Display assistant response
     with st.chat_message("assistant", avatar="🐼"):
         message_placeholder = st.empty()
-        with st.spinner("Chill Panda is thinking..."):
-            try:
-                response = requests.post(
-                    url,
-                    json=payload,
-                    headers=headers,
-                    timeout=60
-                )
+        try:
+            response = requests.post(
+                url,
+                json=payload,
+                headers=headers,
+                stream=True,
+                timeout=60
+            )
+            
+            if response.status_code == 200:
+                # Render tokens as they arrive
+                ai_reply = message_placeholder.write_stream(iter_reply_deltas(response))
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    ai_reply = result.get("reply", "")
-                    
-                    # Display response
-                    message_placeholder.markdown(ai_reply)
-                    
-                    # Add meditation suggestion if enabled
-                    if show_meditation:
-                        meditation_suggestion = generate_meditation_suggestion(prompt, ai_reply)
-                        if meditation_suggestion:
-                            with st.expander("🧘 Suggested Practice"):
-                                st.write(meditation_suggestion)
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": ai_reply,
-                                "meditation_suggestion": meditation_suggestion
-                            })
-                        else:
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": ai_reply
-                            })
+                # Add meditation suggestion if enabled
+                if show_meditation:
+                    meditation_suggestion = generate_meditation_suggestion(prompt, ai_reply)
+                    if meditation_suggestion:
+                        with st.expander("🧘 Suggested Practice"):
+                            st.write(meditation_suggestion)
+                        st.session_state.messages.append({
+                            "role": "assistant",
+                            "content": ai_reply,
+                            "meditation_suggestion": meditation_suggestion
+                        })
                     else:
                         st.session_state.messages.append({
                             "role": "assistant",
                             "content": ai_reply
                         })
-                        
                 else:
-                    error_msg = f"Error: Backend returned status {response.status_code}"
-                    message_placeholder.error(error_msg)
                     st.session_state.messages.append({
                         "role": "assistant",
-                        "content": error_msg
+                        "content": ai_reply
                     })
                     
-            except requests.exceptions.RequestException as e:
-                error_msg = f"Connection error: {str(e)}"
+            else:
+                error_msg = f"Error: Backend returned status {response.status_code}"
                 message_placeholder.error(error_msg)
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content": error_msg
                 })
+                
+        except ReplyInterrupted as e:
+            error_msg = f"Error: {e}"
+            message_placeholder.error(error_msg)
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": error_msg
+            })
+                
+        except requests.exceptions.RequestException as e:
+            error_msg = f"Connection error: {str(e)}"
+            message_placeholder.error(error_msg)
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": error_msg
+            })
 
 # Conversation history in sidebar
 if show_history and st.session_state.messages:
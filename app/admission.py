@@ -0,0 +1,208 @@
+import math
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from .config import (
+    CACHE_BACKEND,
+    RATE_LIMIT_ENABLED,
+    USER_RATE_PER_MINUTE,
+    USER_BURST,
+    KEY_RATE_PER_MINUTE,
+    KEY_BURST,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT_MS,
+    LLM_RETRY_AFTER_SECONDS,
+)
+from .cache import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+class RateLimited(Exception):
+    """A token bucket is empty; retry_after is when it next holds a token"""
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"{scope} rate limit exceeded")
+        self.scope = scope
+        self.retry_after = retry_after
+
+class Saturated(Exception):
+    """Every LLM slot is busy and the wait queue is full or timed out"""
+    def __init__(self, retry_after: float):
+        super().__init__("LLM capacity saturated")
+        self.retry_after = retry_after
+
+class MemoryRateLimiter:
+    """Token buckets in process memory, least recently used evicted past max_buckets"""
+    def __init__(self, max_buckets: int = 100000):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate_per_second: float, burst: int) -> float:
+        """Take one token; returns 0 when allowed, else the seconds until a token is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate_per_second)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate_per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return wait
+
+# Refill and take atomically on the Redis clock, so every worker and node shares one bucket
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisRateLimiter:
+    """Token buckets in Redis, shared by every worker"""
+    def __init__(self, client=None):
+        self.client = client or get_redis_client()
+        self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, rate_per_second: float, burst: int) -> float:
+        wait = await self._script(keys=[f"chillpanda:ratelimit:{key}"], args=[rate_per_second, burst])
+        return float(wait)
+
+def get_rate_limiter():
+    """Build the rate limiter for the configured cache backend ('memory' or 'redis')"""
+    if CACHE_BACKEND == "redis":
+        return RedisRateLimiter()
+    return MemoryRateLimiter()
+
+class RequestLimits:
+    """Per API key and per user_id token buckets in front of the chat endpoints"""
+    def __init__(self, limiter=None, user_rate_per_minute: float = USER_RATE_PER_MINUTE, user_burst: int = USER_BURST,
+                 key_rate_per_minute: float = KEY_RATE_PER_MINUTE, key_burst: int = KEY_BURST):
+        self.limiter = limiter or get_rate_limiter()
+        self.user_rate = user_rate_per_minute / 60
+        self.user_burst = user_burst
+        self.key_rate = key_rate_per_minute / 60
+        self.key_burst = key_burst
+        self.allowed = 0
+        self.limited: Dict[str, int] = {"key": 0, "user": 0}
+
+    async def check(self, api_key: Optional[str], user_id: str):
+        """Raise RateLimited if either bucket is empty; a failing limiter lets requests through"""
+        # Keys are hashed so they never show up in Redis
+        key_id = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        buckets = [
+            ("key", f"key:{key_id}", self.key_rate, self.key_burst),
+            ("user", f"user:{user_id}", self.user_rate, self.user_burst),
+        ]
+        for scope, bucket, rate, burst in buckets:
+            try:
+                wait = await self.limiter.take(bucket, rate, burst)
+            except Exception as e:
+                logger.warning("Rate limiter unavailable, not limiting: %r", e)
+                wait = 0.0
+            if wait > 0:
+                self.limited[scope] += 1
+                raise RateLimited(scope, wait)
+        self.allowed += 1
+
+    def stats(self) -> Dict:
+        return {"allowed": self.allowed, "limited_key": self.limited["key"], "limited_user": self.limited["user"]}
+
+class LLMSlot:
+    """One admitted LLM call; release() is idempotent"""
+    def __init__(self, admission: "LLMAdmission"):
+        self._admission = admission
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._admission._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+class LLMAdmission:
+    """Caps in-flight LLM calls in this worker, with a bounded wait queue
+
+    At most `max_concurrency` calls run at once and at most `max_queue`
+    more wait for a slot, each for `queue_timeout_ms` or until its request
+    budget runs out. Anything beyond that is shed straight away, so a spike
+    gets fast 503s instead of a pile of timeouts.
+    """
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout_ms: float = LLM_QUEUE_TIMEOUT_MS, retry_after_seconds: float = LLM_RETRY_AFTER_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.retry_after = retry_after_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    async def acquire(self, deadline: Optional[float] = None) -> LLMSlot:
+        """Wait for a slot; raises Saturated when the queue is full or the wait runs out"""
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                raise Saturated(self.retry_after)
+            timeout = self.queue_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.perf_counter())
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise Saturated(self.retry_after)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+        return LLMSlot(self)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+request_limits = RequestLimits() if RATE_LIMIT_ENABLED else None
+llm_admission = LLMAdmission()
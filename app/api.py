@@ -1,67 +1,395 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import time
+import base64
+import asyncio
+import logging
+from datetime import datetime
+from bson import ObjectId
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from .auth import verify_key
-from .schemas import ChatRequest, ChatResponse, ConversationHistory, SessionInfo
-from .chat import generate_ai_reply
+from .admission import LLMSlot, RateLimited, Saturated, llm_admission, request_limits, retry_after_header
+from .session_lock import SessionBusy, SessionGuard, session_locks
+from .idempotency import idempotency_store
+from .schemas import ChatRequest, ChatResponse, ConversationHistory, SessionPage
+from .chat import RAGChat, FALLBACK_REPLY, StreamInterrupted, get_rag_chat
+from .response_cache import response_cache
+from .summarizer import conversation_summarizer
+from .config import SUMMARY_ENABLED
+from .timing import StageTimer
 from .mongodb_manager import mongodb_manager
-from typing import List
+from typing import List, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1")
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest, _=Depends(verify_key)):
-    # Get conversation history
-    history = mongodb_manager.get_conversation_history(req.session_id, limit=10)
+async def chat_service() -> RAGChat:
+    """The RAG chat instance; 503 while it cannot be built (e.g. the vector store is unreachable)"""
+    try:
+        return await get_rag_chat()
+    except Exception as e:
+        logger.warning("RAG chat is not available: %r", e)
+        raise HTTPException(status_code=503, detail="Chat is starting up, try again shortly", headers={"Retry-After": "5"})
+
+async def persist_turn(req: ChatRequest, user_msg_id: ObjectId, user_ts: datetime, ai_msg_id: ObjectId,
+                       ai_reply: str, ai_ts: datetime, timer: StageTimer, route: str, guard: SessionGuard):
+    """Write the user/assistant pair after the response has been sent, then let the session's next turn in"""
+    turn = [
+        {
+            "role": "user",
+            "content": req.input_text,
+            "metadata": {"language": req.language},
+            "message_id": user_msg_id,
+            "timestamp": user_ts
+        },
+        {
+            "role": "assistant",
+            "content": ai_reply,
+            "metadata": {"language": req.language},
+            "message_id": ai_msg_id,
+            "timestamp": ai_ts
+        }
+    ]
     
-    # Generate AI reply with context
-    ai_reply = generate_ai_reply(
-        user_message=req.input_text,
-        language=req.language,
-        conversation_history=history
-    )
+    try:
+        await timer.measure("persist", mongodb_manager.save_turn(req.session_id, req.user_id, turn))
+    finally:
+        await guard.release()
+    timer.log(route)
     
-    # Save user message
-    user_msg_id = mongodb_manager.save_message(
-        session_id=req.session_id,
-        user_id=req.user_id,
-        role="user",
-        content=req.input_text,
-        metadata={"language": req.language}
+    if SUMMARY_ENABLED:
+        await conversation_summarizer.maybe_update(req.session_id)
+
+async def rate_limit(req: ChatRequest, x_api_key: str = Header(None)):
+    """429 once the caller's key or user_id has used up its token bucket"""
+    if request_limits is None:
+        return
+    try:
+        await request_limits.check(x_api_key, req.user_id)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429, detail=f"Too many requests for this {e.scope}", headers=retry_after_header(e.retry_after)
+        )
+
+async def admit_llm_call(timer: StageTimer) -> LLMSlot:
+    """Wait for an LLM slot; 503 when this worker is saturated"""
+    try:
+        return await timer.measure("queue", llm_admission.acquire(timer.deadline))
+    except Saturated as e:
+        raise HTTPException(
+            status_code=503, detail="Chill Panda is very busy, try again shortly", headers=retry_after_header(e.retry_after)
+        )
+
+async def hold_session(req: ChatRequest, timer: StageTimer) -> SessionGuard:
+    """Wait for the session's earlier turns to be persisted; 409 if one is still running after the wait"""
+    try:
+        return await timer.measure("session_lock", session_locks.hold(req.session_id))
+    except SessionBusy:
+        raise HTTPException(
+            status_code=409, detail="An earlier message of this session is still being answered",
+            headers=retry_after_header(1)
+        )
+
+async def remember_result(req: ChatRequest, result: Dict):
+    """Keep the reply for retries of an idempotent submission; failures are not kept, so a retry tries again"""
+    if result["reply"] != FALLBACK_REPLY:
+        await idempotency_store.put(req.session_id, req.idempotency_key, result)
+
+class TurnStreamingResponse(StreamingResponse):
+    """StreamingResponse that frees its LLM slot and session lock however sending ends, even if the body never starts"""
+    def __init__(self, *args, slot: Optional[LLMSlot], guard: SessionGuard, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slot = slot
+        self.guard = guard
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+            await self.guard.release()
+
+def cache_scope(req: ChatRequest) -> str:
+    """Response cache partition: language plus any retrieval filters"""
+    return "|".join([req.language, ",".join(sorted(req.sources or [])), ",".join(sorted(req.sections or []))])
+
+async def read_history(req: ChatRequest, limit: int) -> Tuple[List[Dict], Dict]:
+    """The session record, then the history it allows: its purge marker hides messages a delete left behind"""
+    if SUMMARY_ENABLED:
+        session = await mongodb_manager.get_session_summary(req.session_id)
+    else:
+        session = await mongodb_manager.get_session_state(req.session_id)
+    history = await mongodb_manager.get_conversation_history(
+        req.session_id, limit=limit, purged_until=session.get("purge_before")
     )
-    
-    # Save AI reply
-    ai_msg_id = mongodb_manager.save_message(
-        session_id=req.session_id,
-        user_id=req.user_id,
-        role="assistant",
-        content=ai_reply,
-        metadata={"language": req.language}
+    return history, session
+
+async def prepare_turn(req: ChatRequest, rag_chat: RAGChat, timer: StageTimer) -> Dict:
+    """Fetch history and summary and embed the message concurrently, then
+    serve the reply from the response cache or retrieve book context"""
+    history_limit = conversation_summarizer.window if SUMMARY_ENABLED else 10
+    (history, session), embedding = await asyncio.gather(
+        timer.measure("history", read_history(req, history_limit)),
+        timer.measure("embed", rag_chat.embed_query(req.input_text, timer.deadline))
     )
+    turn = {"history": history, "embedding": embedding, "context": [], "messages": None, "cached_reply": None}
+    
+    if response_cache is not None and embedding is not None:
+        hit = await response_cache.lookup(embedding, cache_scope(req), history)
+        if hit is not None:
+            turn["cached_reply"] = hit["reply"]
+            turn["context"] = hit["context"]
+            return turn
+    
+    if embedding is not None:
+        turn["context"] = await timer.measure(
+            "vector_search", rag_chat.get_relevant_context(
+                req.input_text, embedding=embedding, language=req.language,
+                sources=req.sources, sections=req.sections, deadline=timer.deadline
+            )
+        )
+    if SUMMARY_ENABLED:
+        # Everything the summary does not cover yet goes in verbatim
+        recent = conversation_summarizer.unsummarized(session, history)
+        turn["messages"], tokens = rag_chat.build_messages(
+            req.input_text, turn["context"], recent, session.get("summary", ""), history_limit=len(recent)
+        )
+    else:
+        turn["messages"], tokens = rag_chat.build_messages(req.input_text, turn["context"], history)
+    timer.tokens.update(tokens)
+    return turn
+
+async def remember_reply(req: ChatRequest, turn: Dict, ai_reply: str):
+    """Offer a freshly generated reply to the response cache"""
+    if response_cache is None or turn["embedding"] is None or ai_reply == FALLBACK_REPLY:
+        return
+    await response_cache.store(turn["embedding"], cache_scope(req), turn["history"], ai_reply, turn["context"])
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest, response: Response, background_tasks: BackgroundTasks,
+               _=Depends(verify_key), __=Depends(rate_limit), rag_chat: RAGChat = Depends(chat_service)):
+    timer = StageTimer()
+    guard = await hold_session(req, timer)
+    try:
+        replay = await idempotency_store.get(req.session_id, req.idempotency_key)
+        if replay is not None:
+            await guard.release()
+            response.headers["Idempotent-Replayed"] = "true"
+            return ChatResponse(session_id=req.session_id, **replay)
+        
+        user_ts = datetime.utcnow()
+        turn = await prepare_turn(req, rag_chat, timer)
+        
+        if turn["cached_reply"] is not None:
+            ai_reply = turn["cached_reply"]
+        else:
+            # Generate AI reply with context
+            async with await admit_llm_call(timer):
+                ai_reply = await timer.measure("llm", rag_chat.complete(turn["messages"], timer.deadline))
+            await remember_reply(req, turn, ai_reply)
+        
+        # Ids are allocated up front so the writes can happen after responding
+        user_msg_id, ai_msg_id = ObjectId(), ObjectId()
+        result = {
+            "reply": ai_reply,
+            "message_id": str(ai_msg_id),
+            "used_rag": bool(turn["context"]),
+            "cached": turn["cached_reply"] is not None
+        }
+        await remember_result(req, result)
+        background_tasks.add_task(
+            persist_turn, req, user_msg_id, user_ts, ai_msg_id, ai_reply, datetime.utcnow(), timer, "chat", guard
+        )
+    except BaseException:
+        await guard.release()
+        raise
+    
+    response.headers["Server-Timing"] = timer.server_timing()
+    if timer.tokens:
+        response.headers["X-Prompt-Tokens"] = str(timer.tokens["total"])
+    return ChatResponse(session_id=req.session_id, **result)
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format a server-sent event frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+async def replay_stream(req: ChatRequest, replay: Dict):
+    """The stored reply of an earlier submission, as one delta"""
+    yield sse_event({"delta": replay["reply"]})
+    yield sse_event({
+        "session_id": req.session_id,
+        "message_id": replay["message_id"],
+        "used_rag": replay["used_rag"],
+        "cached": replay["cached"]
+    }, event="done")
+
+@router.post("/chat/stream")
+async def chat_stream(req: ChatRequest, _=Depends(verify_key), __=Depends(rate_limit),
+                      rag_chat: RAGChat = Depends(chat_service)):
+    timer = StageTimer()
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    guard = await hold_session(req, timer)
+    slot = None
+    try:
+        replay = await idempotency_store.get(req.session_id, req.idempotency_key)
+        if replay is not None:
+            await guard.release()
+            headers["Idempotent-Replayed"] = "true"
+            return StreamingResponse(replay_stream(req, replay), media_type="text/event-stream", headers=headers)
+        
+        # History and context are ready, and an LLM slot is held, before the stream starts
+        user_ts = datetime.utcnow()
+        turn = await prepare_turn(req, rag_chat, timer)
+        slot = await admit_llm_call(timer) if turn["cached_reply"] is None else None
+    except BaseException:
+        if slot is not None:
+            slot.release()
+        await guard.release()
+        raise
+    
+    user_msg_id, ai_msg_id = ObjectId(), ObjectId()
+    parts = []
+    if timer.tokens:
+        headers["X-Prompt-Tokens"] = str(timer.tokens["total"])
     
-    return ChatResponse(
-        reply=ai_reply,
-        session_id=req.session_id,
-        message_id=ai_msg_id
+    async def event_stream():
+        interrupted = False
+        if turn["cached_reply"] is not None:
+            parts.append(turn["cached_reply"])
+            yield sse_event({"delta": turn["cached_reply"]})
+        else:
+            started = time.perf_counter()
+            try:
+                async for delta in rag_chat.stream_completion(turn["messages"], timer.deadline):
+                    if not parts:
+                        timer.stages["first_token"] = (time.perf_counter() - started) * 1000
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+            except StreamInterrupted:
+                interrupted = True
+            finally:
+                slot.release()
+            timer.stages["llm"] = (time.perf_counter() - started) * 1000
+            # A truncated reply must not be served to other users
+            if not interrupted:
+                await remember_reply(req, turn, "".join(parts).strip())
+        
+        result = {
+            "reply": "".join(parts).strip(),
+            "message_id": str(ai_msg_id),
+            "used_rag": bool(turn["context"]),
+            "cached": turn["cached_reply"] is not None
+        }
+        if interrupted:
+            # Not kept for retries, like a fallback reply: a retry tries again
+            yield sse_event({
+                "session_id": req.session_id,
+                "message_id": result["message_id"],
+                "detail": "The reply was interrupted, please try again"
+            }, event="error")
+            return
+        await remember_result(req, result)
+        yield sse_event({
+            "session_id": req.session_id,
+            "message_id": result["message_id"],
+            "used_rag": result["used_rag"],
+            "cached": result["cached"]
+        }, event="done")
+    
+    async def persist_streamed_turn():
+        # Runs once the stream is fully sent; an interrupted reply is saved as far as the client saw it
+        await persist_turn(
+            req, user_msg_id, user_ts, ai_msg_id, "".join(parts).strip(), datetime.utcnow(), timer, "chat_stream", guard
+        )
+    
+    return TurnStreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=headers,
+        background=BackgroundTask(persist_streamed_turn),
+        slot=slot,
+        guard=guard
     )
 
 @router.get("/conversation/{session_id}", response_model=ConversationHistory)
-async def get_conversation(session_id: str, _=Depends(verify_key)):
-    messages = mongodb_manager.get_conversation_history(session_id, limit=50)
+async def get_conversation(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    # message_id of the boundary message, so messages sharing its timestamp are paged exactly
+    before_id: Optional[str] = None,
+    after_id: Optional[str] = None,
+    _=Depends(verify_key)
+):
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    if (before_id is not None and before is None) or (after_id is not None and after is None):
+        raise HTTPException(status_code=400, detail="'before_id' and 'after_id' need 'before' or 'after'")
+    if any(value is not None and not ObjectId.is_valid(value) for value in (before_id, after_id)):
+        raise HTTPException(status_code=400, detail="Invalid message id")
+    
+    # The session record carries the purge marker the page read needs
+    session = await mongodb_manager.get_session_state(session_id)
+    page = await mongodb_manager.get_conversation_page(
+        session_id, limit=limit, before=before, after=after,
+        before_id=ObjectId(before_id) if before_id else None, after_id=ObjectId(after_id) if after_id else None,
+        purged_until=session.get("purge_before")
+    )
     
     return ConversationHistory(
         session_id=session_id,
-        messages=messages,
-        total_messages=len(messages)
+        messages=page["messages"],
+        total_messages=session.get("message_count", 0),
+        has_more=page["has_more"]
     )
 
-@router.get("/sessions/{user_id}", response_model=List[SessionInfo])
-async def get_user_sessions(user_id: str, _=Depends(verify_key)):
-    sessions = mongodb_manager.get_user_sessions(user_id)
-    return sessions
+def encode_session_cursor(key: Optional[Tuple[datetime, str]]) -> Optional[str]:
+    """Opaque cursor for the (last_activity, session_id) a page of sessions ends at"""
+    if key is None:
+        return None
+    last_activity, session_id = key
+    raw = json.dumps([last_activity.isoformat(), session_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_session_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_activity, session_id = json.loads(raw)
+        return datetime.fromisoformat(last_activity), str(session_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/sessions/{user_id}", response_model=SessionPage, response_model_exclude_none=True)
+async def get_user_sessions(
+    user_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    _=Depends(verify_key)
+):
+    after = decode_session_cursor(cursor) if cursor else None
+    # The total is a maintained counter, never a count over the user's sessions
+    if include_total:
+        page, total = await asyncio.gather(
+            mongodb_manager.get_user_sessions(user_id, limit=limit, after=after),
+            mongodb_manager.get_session_total(user_id)
+        )
+    else:
+        page, total = await mongodb_manager.get_user_sessions(user_id, limit=limit, after=after), None
+    
+    return {"sessions": page["sessions"], "next_cursor": encode_session_cursor(page["next"]), "total": total}
 
 @router.delete("/session/{session_id}")
-async def delete_session(session_id: str, _=Depends(verify_key)):
-    success = mongodb_manager.delete_session(session_id)
+async def delete_session(session_id: str, background_tasks: BackgroundTasks, _=Depends(verify_key)):
+    # The session is gone for readers at once; its messages are removed in batches after responding
+    success = await mongodb_manager.delete_session(session_id)
     if success:
+        background_tasks.add_task(mongodb_manager.purge_session, session_id)
         return {"message": "Session deleted successfully"}
     else:
         raise HTTPException(status_code=500, detail="Failed to delete session")
\ No newline at end of file
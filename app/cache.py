@@ -0,0 +1,107 @@
+import json
+import time
+import base64
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+from .config import CACHE_BACKEND, REDIS_URL
+
+_redis_client = None
+
+def get_redis_client():
+    """The process-wide Redis client, built on first use
+
+    Caches, rate limits and session locks share it, and with it one
+    connection pool.
+    """
+    global _redis_client
+    if _redis_client is None:
+        # Imported here so redis is only needed when a shared backend is selected
+        import redis.asyncio as redis
+
+        _redis_client = redis.Redis.from_url(REDIS_URL)
+    return _redis_client
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"{type(value).__name__} is not cacheable")
+
+def _decode(value: Dict):
+    if set(value) == {"$date"}:
+        return datetime.fromisoformat(value["$date"])
+    if set(value) == {"$bytes"}:
+        return base64.b64decode(value["$bytes"])
+    return value
+
+class MemoryCacheBackend:
+    """Process-local LRU store with a per-entry TTL"""
+    def __init__(self, namespace: str, max_entries: int = 10000, ttl_seconds: float = 1800):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (ttl_seconds or self.ttl_seconds), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+class RedisCacheBackend:
+    """Redis store shared by every worker; eviction is left to Redis' maxmemory policy
+
+    Values are stored as JSON, with datetimes and bytes tagged, so reading
+    one never runs code from whoever could write to Redis.
+    """
+    def __init__(self, namespace: str, ttl_seconds: float = 1800, client=None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.client = client or get_redis_client()
+
+    def _key(self, key: str) -> str:
+        return f"chillpanda:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(self._key(key))
+        return json.loads(raw, object_hook=_decode) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        ttl_ms = int((ttl_seconds or self.ttl_seconds) * 1000)
+        await self.client.set(self._key(key), json.dumps(value, default=_encode), px=ttl_ms)
+
+    async def delete(self, key: str):
+        await self.client.delete(self._key(key))
+
+    def size(self) -> int:
+        # Not tracked locally for a shared store
+        return -1
+
+def get_cache_backend(namespace: str, max_entries: int, ttl_seconds: float):
+    """Build the configured cache backend ('memory' or 'redis') for a namespace
+
+    A shared backend can be unreachable; its users treat a failed read as a
+    miss and a failed write as a no-op, so the request goes on without it.
+    """
+    if CACHE_BACKEND == "redis":
+        return RedisCacheBackend(namespace, ttl_seconds=ttl_seconds)
+    return MemoryCacheBackend(namespace, max_entries=max_entries, ttl_seconds=ttl_seconds)
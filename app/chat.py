@@ -1,14 +1,35 @@
 import os
-from typing import List, Dict
-from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from .pinecone_setup import get_pinecone_index
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, AsyncIterator, Optional, Tuple
+from .config import (
+    EMBEDDING_CACHE_ENABLED,
+    RAG_FILTER_BY_LANGUAGE,
+    RAG_INDEX_UNTAGGED,
+    CORPUS_FALLBACK_LANGUAGE,
+    HYBRID_RETRIEVAL_ENABLED,
+    HYBRID_CANDIDATES,
+    STARTUP_RETRY_SECONDS,
+)
+from .corpus import build_filter
+from .prompt import PromptBuilder
+from .upstream import openai_client, chat_upstream, embedding_upstream, vector_upstream
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+client = openai_client
+
+# The Pinecone query API is blocking; run it on a dedicated pool so retrieval
+# never stalls the event loop and is not capped by the default executor size
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RETRIEVAL_THREADS", "64")),
+    thread_name_prefix="retrieval"
+)
 
 SYSTEM_PROMPT = """
 You are Chill Panda 🐼 — a calm, empathetic mental health companion based on the book "The Chill Panda".
@@ -18,76 +39,196 @@ If user expresses distress, respond with empathy and encouragement.
 Always maintain the persona of a wise, compassionate panda.
 """
 
+FALLBACK_REPLY = "I apologize, but I'm having trouble accessing my wisdom right now. Please try again, and remember to breathe deeply and stay calm. 🐼"
+
+class StreamInterrupted(Exception):
+    """The reply stream failed after part of it was sent, so it cannot be replaced by the fallback"""
+
 class RAGChat:
     def __init__(self):
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            model=os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
-        )
-        self.index = get_pinecone_index()
-        self.vectorstore = PineconeVectorStore(index=self.index, embedding=self.embeddings, text_key="text")
+        # LangChain, the vector store client and local models load here, not at import
+        from .vector_store import get_vector_store
+        from .retrieval import HybridRetriever
+        from .embedding_cache import CachedEmbeddings, EmbeddingCache
+        from .embeddings import embedding_model_name, get_embeddings
+        
+        self.embeddings = get_embeddings()
+        if EMBEDDING_CACHE_ENABLED:
+            self.embeddings = CachedEmbeddings(self.embeddings, embedding_model_name(), EmbeddingCache())
+        self.vectorstore = get_vector_store(self.embeddings)
         self.similarity_threshold = float(os.getenv("RAG_SIMILARITY_THRESHOLD", 0.7))
+        self.retriever = HybridRetriever.from_config() if HYBRID_RETRIEVAL_ENABLED else None
+        self.prompt_builder = PromptBuilder(SYSTEM_PROMPT, os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
     
-    def get_relevant_context(self, query: str, k: int = 3) -> str:
-        """Retrieve relevant context from Pinecone"""
+    def warm_up(self):
+        """Load local models before the first request arrives"""
+        from .embeddings import warm_up_embeddings
+        
+        warm_up_embeddings(self.embeddings)
+        self.prompt_builder.warm_up()
+        if self.retriever is not None:
+            self.retriever.warm_up()
+    
+    async def embed_query(self, query: str, deadline: Optional[float] = None) -> Optional[List[float]]:
+        """Embed the user message once for retrieval and the response cache"""
         try:
-            docs = self.vectorstore.similarity_search_with_score(query, k=k)
+            return await embedding_upstream.call(lambda: self.embeddings.aembed_query(query), deadline)
+        except Exception as e:
+            logger.warning("Query embedding failed, answering without retrieval: %r", e)
+            return None
+    
+    async def search(self, query: str, embedding: List[float], k: int, filter: Optional[Dict] = None,
+                     deadline: Optional[float] = None) -> List[str]:
+        """Relevant chunk texts for a query, best first"""
+        # Hybrid retrieval draws a wider vector candidate set for fusion
+        candidates = HYBRID_CANDIDATES if self.retriever is not None else k
+        if getattr(self.vectorstore, "runs_in_process", False):
+            docs = self.vectorstore.similarity_search_by_vector_with_score(embedding, k=candidates, filter=filter)
+        else:
+            loop = asyncio.get_running_loop()
+            docs = await vector_upstream.call(
+                lambda: loop.run_in_executor(
+                    retrieval_executor,
+                    lambda: self.vectorstore.similarity_search_by_vector_with_score(embedding, k=candidates, filter=filter)
+                ),
+                deadline
+            )
+        
+        # Filter by similarity threshold
+        vector_hits = [doc.page_content for doc, score in docs if score >= self.similarity_threshold]
+        if self.retriever is None:
+            return vector_hits
+        return await self.retriever.fuse(query, vector_hits, k, filter)
+    
+    async def get_relevant_context(self, query: str, k: int = 3, embedding: Optional[List[float]] = None,
+                                   language: Optional[str] = None, sources: Optional[List[str]] = None,
+                                   sections: Optional[List[str]] = None, deadline: Optional[float] = None) -> List[str]:
+        """Retrieve relevant chunks from the vector store, preferring the user's language"""
+        try:
+            if embedding is None:
+                embedding = await embedding_upstream.call(lambda: self.embeddings.aembed_query(query), deadline)
             
-            # Filter by similarity threshold
-            relevant_docs = []
-            for doc, score in docs:
-                if score >= self.similarity_threshold:
-                    relevant_docs.append(doc.page_content)
+            search_language = language if RAG_FILTER_BY_LANGUAGE else None
+            relevant_docs = await self.search(
+                query, embedding, k, build_filter(search_language, sources, sections), deadline
+            )
             
-            if relevant_docs:
-                context = "\n\n---\n\n".join(relevant_docs)
-                return f"Relevant wisdom from The Chill Panda book:\n\n{context}"
-            else:
-                return ""
+            # Fall back to the default edition when the user's language has nothing relevant
+            if not relevant_docs and search_language and search_language != CORPUS_FALLBACK_LANGUAGE:
+                relevant_docs = await self.search(
+                    query, embedding, k, build_filter(CORPUS_FALLBACK_LANGUAGE, sources, sections), deadline
+                )
+            
+            # Chunks ingested before language tags existed match no language filter
+            if not relevant_docs and search_language and RAG_INDEX_UNTAGGED:
+                relevant_docs = await self.search(query, embedding, k, build_filter(None, sources, sections), deadline)
+            
+            return relevant_docs
         except Exception as e:
-            return ""
+            # The reply can still be generated without book context
+            logger.warning("Retrieval failed, answering without context: %r", e)
+            return []
     
-    def generate_response(self, user_message: str, conversation_history: List[Dict] = None) -> str:
-        """Generate response using RAG when relevant, otherwise use general knowledge"""
-        
-        # Get relevant context from the book
-        context = self.get_relevant_context(user_message)
-        
-        # Prepare messages for OpenAI
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT}
-        ]
-        
-        # Add conversation history if available
-        if conversation_history:
-            for msg in conversation_history[-6:]:  # Last 6 messages for context
-                messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # Add context if found
-        if context:
-            context_message = f"{context}\n\nBased on the above wisdom from The Chill Panda book, and as the Chill Panda, respond to: {user_message}"
-            messages.append({"role": "user", "content": context_message})
-        else:
-            # If no relevant context, use general response
-            messages.append({"role": "user", "content": user_message})
+    def build_messages(self, user_message: str, context: List[str], conversation_history: List[Dict] = None,
+                       summary: str = "", history_limit: Optional[int] = None):
+        """Prepare the OpenAI message list within the prompt token budget
         
+        The session summary stands in for history older than the messages
+        passed in. Returns the messages and the token count of each prompt part.
+        """
+        return self.prompt_builder.build(user_message, context, conversation_history, summary, history_limit)
+    
+    async def complete(self, messages: List[Dict], deadline: Optional[float] = None) -> str:
+        """Run the chat completion for a prepared message list"""
         try:
-            response = client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500,
+            response = await chat_upstream.call(
+                lambda: client.chat.completions.create(
+                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=500,
+                ),
+                deadline
             )
             
             return response.choices[0].message.content.strip()
         
         except Exception as e:
             # Fallback response
-            return "I apologize, but I'm having trouble accessing my wisdom right now. Please try again, and remember to breathe deeply and stay calm. 🐼"
+            logger.warning("Chat completion failed, sending fallback reply: %r", e)
+            return FALLBACK_REPLY
+    
+    async def stream_completion(self, messages: List[Dict], deadline: Optional[float] = None) -> AsyncIterator[str]:
+        """Yield reply text deltas as OpenAI produces them
+        
+        The deadline and retries cover opening the stream; once deltas flow
+        the client's read timeout bounds each chunk. A failure before the
+        first delta yields the fallback reply; after it, raises StreamInterrupted.
+        """
+        streamed_any = False
+        try:
+            stream = await chat_upstream.call(
+                lambda: client.chat.completions.create(
+                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=500,
+                    stream=True,
+                ),
+                deadline
+            )
+            
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    streamed_any = True
+                    yield delta
+        
+        except Exception as e:
+            logger.warning("Chat completion stream failed: %r", e)
+            if streamed_any:
+                chat_upstream.count("stream_interrupted")
+                raise StreamInterrupted() from e
+            # Nothing reached the client yet
+            yield FALLBACK_REPLY
+    
+    async def generate_response(self, user_message: str, conversation_history: List[Dict] = None) -> str:
+        """Generate response using RAG when relevant, otherwise use general knowledge"""
+        
+        # Get relevant context from the book
+        context = await self.get_relevant_context(user_message)
+        messages, _ = self.build_messages(user_message, context, conversation_history)
+        return await self.complete(messages)
 
-# Initialize RAG chat instance
-rag_chat = RAGChat()
+# Shared RAG chat instance, built on first use
+_rag_chat: Optional[RAGChat] = None
+_rag_chat_lock = asyncio.Lock()
+# (monotonic time, error) of the last failed build
+_rag_chat_failure: Optional[Tuple[float, Exception]] = None
+
+async def get_rag_chat() -> RAGChat:
+    """The shared RAG chat instance
+    
+    The first call builds it on a worker thread, so the event loop keeps
+    serving meanwhile. A failed build raises; calls within
+    STARTUP_RETRY_SECONDS re-raise its error instead of building again.
+    """
+    global _rag_chat, _rag_chat_failure
+    if _rag_chat is None:
+        async with _rag_chat_lock:
+            if _rag_chat is None:
+                if _rag_chat_failure and time.monotonic() - _rag_chat_failure[0] < STARTUP_RETRY_SECONDS:
+                    raise _rag_chat_failure[1]
+                try:
+                    _rag_chat = await asyncio.to_thread(RAGChat)
+                except Exception as e:
+                    _rag_chat_failure = (time.monotonic(), e)
+                    raise
+    return _rag_chat
 
-def generate_ai_reply(user_message: str, language: str, conversation_history: List[Dict] = None) -> str:
+async def generate_ai_reply(user_message: str, language: str, conversation_history: List[Dict] = None) -> str:
     """Generate AI reply using RAG system"""
-    return rag_chat.generate_response(user_message, conversation_history)
\ No newline at end of file
+    rag_chat = await get_rag_chat()
+    return await rag_chat.generate_response(user_message, conversation_history)
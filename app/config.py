@@ -29,4 +29,166 @@ CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:8501').split(',')
 # RAG Configuration
 RAG_SIMILARITY_THRESHOLD = float(os.getenv('RAG_SIMILARITY_THRESHOLD', '0.7'))
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
-OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
\ No newline at end of file
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+
+# Cache Configuration
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # "memory" (per worker) or "redis" (shared)
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+HISTORY_CACHE_ENABLED = os.getenv('HISTORY_CACHE_ENABLED', 'true').lower() == 'true'
+HISTORY_CACHE_MAX_MESSAGES = int(os.getenv('HISTORY_CACHE_MAX_MESSAGES', '20'))
+HISTORY_CACHE_MAX_SESSIONS = int(os.getenv('HISTORY_CACHE_MAX_SESSIONS', '10000'))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv('HISTORY_CACHE_TTL_SECONDS', '1800'))
+# How long a deleted session stays uncacheable, covering requests that were in flight
+HISTORY_CACHE_TOMBSTONE_SECONDS = float(os.getenv('HISTORY_CACHE_TOMBSTONE_SECONDS', '300'))
+
+# Embedding Cache Configuration
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.db')  # empty disables the disk tier
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MEMORY_ENTRIES', '5000'))
+# How long a disk lookup or write waits on another worker's lock before it counts as a miss
+EMBEDDING_CACHE_BUSY_TIMEOUT_MS = int(os.getenv('EMBEDDING_CACHE_BUSY_TIMEOUT_MS', '100'))
+# Shared tier, used with CACHE_BACKEND=redis
+EMBEDDING_CACHE_SHARED_TTL_SECONDS = float(os.getenv('EMBEDDING_CACHE_SHARED_TTL_SECONDS', str(30 * 86400)))
+
+# Vector Store Configuration
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'pinecone')  # "pinecone" or "faiss"
+FAISS_INDEX_PATH = os.getenv('FAISS_INDEX_PATH', 'faiss_index')
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')  # "flat" (exact) or "hnsw"
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', '32'))
+FAISS_HNSW_EF_SEARCH = int(os.getenv('FAISS_HNSW_EF_SEARCH', '64'))
+
+# Embedding Provider Configuration
+# Switching provider changes the vector dimension: rebuild the index and retune RAG_SIMILARITY_THRESHOLD
+EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'openai')  # "openai" or "local"
+EMBEDDING_DIMENSION = int(os.getenv('EMBEDDING_DIMENSION', '1536'))
+LOCAL_EMBEDDING_MODEL = os.getenv('LOCAL_EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+LOCAL_EMBEDDING_BACKEND = os.getenv('LOCAL_EMBEDDING_BACKEND', 'torch')  # "torch", "onnx" or "openvino"
+LOCAL_EMBEDDING_MODEL_FILE = os.getenv('LOCAL_EMBEDDING_MODEL_FILE', '')
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv('LOCAL_EMBEDDING_BATCH_SIZE', '32'))
+LOCAL_EMBEDDING_MAX_WAIT_MS = float(os.getenv('LOCAL_EMBEDDING_MAX_WAIT_MS', '5'))
+
+# Semantic Response Cache Configuration
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+# Cosine similarity needed to reuse a reply; model specific (ada-002 scores unrelated text around 0.7-0.8)
+RESPONSE_CACHE_THRESHOLD = float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.97'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '86400'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '5000'))
+RESPONSE_CACHE_HISTORY_MESSAGES = int(os.getenv('RESPONSE_CACHE_HISTORY_MESSAGES', '2'))
+# With CACHE_BACKEND=redis: newest replies kept per (scope, history) partition
+RESPONSE_CACHE_PARTITION_ENTRIES = int(os.getenv('RESPONSE_CACHE_PARTITION_ENTRIES', '32'))
+
+# Ingestion Configuration
+INGEST_CHECKPOINT_PATH = os.getenv('INGEST_CHECKPOINT_PATH', 'ingest_checkpoint.json')
+INGEST_EXTRACT_WORKERS = int(os.getenv('INGEST_EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv('INGEST_EMBED_BATCH_SIZE', '100'))
+INGEST_EMBED_CONCURRENCY = int(os.getenv('INGEST_EMBED_CONCURRENCY', '4'))
+INGEST_UPSERT_CONCURRENCY = int(os.getenv('INGEST_UPSERT_CONCURRENCY', '2'))
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', '5'))
+
+# Corpus Configuration
+CORPUS_REGISTRY_PATH = os.getenv('CORPUS_REGISTRY_PATH', os.path.join(os.path.dirname(__file__), 'data', 'corpus.json'))
+RAG_FILTER_BY_LANGUAGE = os.getenv('RAG_FILTER_BY_LANGUAGE', 'true').lower() == 'true'
+# Set while the index still holds chunks ingested without language tags: a search
+# that finds nothing in either language then runs once more without the language
+RAG_INDEX_UNTAGGED = os.getenv('RAG_INDEX_UNTAGGED', 'false').lower() == 'true'
+CORPUS_FALLBACK_LANGUAGE = os.getenv('CORPUS_FALLBACK_LANGUAGE', 'en')
+
+# Hybrid Retrieval Configuration
+HYBRID_RETRIEVAL_ENABLED = os.getenv('HYBRID_RETRIEVAL_ENABLED', 'false').lower() == 'true'
+CHUNK_STORE_PATH = os.getenv('CHUNK_STORE_PATH', 'chunk_store.json')
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '10'))
+BM25_K1 = float(os.getenv('BM25_K1', '1.5'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+BM25_MIN_SCORE = float(os.getenv('BM25_MIN_SCORE', '1.0'))
+RRF_K = int(os.getenv('RRF_K', '60'))
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() == 'true'
+RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '80'))
+RERANK_MIN_SCORE = float(os.getenv('RERANK_MIN_SCORE', '-5.0'))
+
+# Prompt Configuration
+# Token budget for the whole prompt (system, message, context and history); the reply is extra
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+PROMPT_MAX_MESSAGE_TOKENS = int(os.getenv('PROMPT_MAX_MESSAGE_TOKENS', '1000'))
+PROMPT_MAX_HISTORY_MESSAGES = int(os.getenv('PROMPT_MAX_HISTORY_MESSAGES', '6'))
+# Smallest truncated chunk or history message still worth sending
+PROMPT_MIN_FRAGMENT_TOKENS = int(os.getenv('PROMPT_MIN_FRAGMENT_TOKENS', '64'))
+
+# Conversation Summary Configuration
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', 'true').lower() == 'true'
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', os.getenv('OPENAI_MODEL', 'gpt-4o-mini'))
+# Messages that leave the recent-history window are folded in once this many have piled up
+SUMMARY_EVERY_MESSAGES = int(os.getenv('SUMMARY_EVERY_MESSAGES', '10'))
+SUMMARY_BATCH_MESSAGES = int(os.getenv('SUMMARY_BATCH_MESSAGES', '40'))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '250'))
+SUMMARY_BACKFILL_CONCURRENCY = int(os.getenv('SUMMARY_BACKFILL_CONCURRENCY', '4'))
+
+# Upstream Client Configuration
+# Wall-clock budget of one chat request; upstream calls get whatever is left of it
+REQUEST_BUDGET_MS = float(os.getenv('REQUEST_BUDGET_MS', '25000'))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TIMEOUT_SECONDS', '20'))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv('OPENAI_CONNECT_TIMEOUT_SECONDS', '3'))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '200'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '50'))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY_SECONDS', '60'))
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv('EMBEDDING_TIMEOUT_SECONDS', '5'))
+PINECONE_TIMEOUT_SECONDS = float(os.getenv('PINECONE_TIMEOUT_SECONDS', '3'))
+PINECONE_POOL_MAXSIZE = int(os.getenv('PINECONE_POOL_MAXSIZE', os.getenv('RETRIEVAL_THREADS', '64')))
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+UPSTREAM_BACKOFF_BASE_MS = float(os.getenv('UPSTREAM_BACKOFF_BASE_MS', '100'))
+UPSTREAM_BACKOFF_MAX_MS = float(os.getenv('UPSTREAM_BACKOFF_MAX_MS', '2000'))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', '30'))
+# Send a second embedding / vector query if the first has not answered by then; 0 disables hedging
+HEDGE_AFTER_MS = float(os.getenv('HEDGE_AFTER_MS', '0'))
+
+# Startup Configuration
+# Wait between attempts to build the chat pipeline when a dependency is down at boot
+STARTUP_RETRY_SECONDS = float(os.getenv('STARTUP_RETRY_SECONDS', '5'))
+READINESS_TIMEOUT_MS = float(os.getenv('READINESS_TIMEOUT_MS', '1000'))
+
+# Admission Control Configuration
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+# Token buckets: sustained requests per minute and burst size; shared by all workers with CACHE_BACKEND=redis
+USER_RATE_PER_MINUTE = float(os.getenv('USER_RATE_PER_MINUTE', '20'))
+USER_BURST = int(os.getenv('USER_BURST', '10'))
+KEY_RATE_PER_MINUTE = float(os.getenv('KEY_RATE_PER_MINUTE', '1200'))
+KEY_BURST = int(os.getenv('KEY_BURST', '200'))
+# Per worker: LLM calls in flight, requests allowed to wait for one, and how long they wait
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '64'))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '128'))
+LLM_QUEUE_TIMEOUT_MS = float(os.getenv('LLM_QUEUE_TIMEOUT_MS', '2000'))
+LLM_RETRY_AFTER_SECONDS = float(os.getenv('LLM_RETRY_AFTER_SECONDS', '2'))
+
+# Session Turn Configuration
+# Chat turns of one session run one at a time; the distributed lock orders them across workers
+SESSION_LOCK_DISTRIBUTED = os.getenv('SESSION_LOCK_DISTRIBUTED', str(CACHE_BACKEND == 'redis')).lower() == 'true'
+# A turn may wait out a whole earlier turn, so a retry gets the first reply instead of a 409
+SESSION_LOCK_WAIT_MS = float(os.getenv('SESSION_LOCK_WAIT_MS', str(REQUEST_BUDGET_MS + 5000)))
+# A lock whose request died is freed after this long
+SESSION_LOCK_LEASE_MS = float(os.getenv('SESSION_LOCK_LEASE_MS', '60000'))
+# Replies to requests carrying an idempotency_key are kept this long for retries
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+
+# Retention Configuration
+# MongoDB TTL indexes delete messages and idle sessions older than this; 0 keeps them forever
+CHAT_RETENTION_DAYS = float(os.getenv('CHAT_RETENTION_DAYS', '0'))
+# Sessions idle this long are moved to gzip JSONL files under ARCHIVE_PATH; 0 disables archiving
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+ARCHIVE_PATH = os.getenv('ARCHIVE_PATH', 'archive')
+# Sessions per archive file
+ARCHIVE_BATCH_SESSIONS = int(os.getenv('ARCHIVE_BATCH_SESSIONS', '500'))
+# A claim older than this belongs to an archiver that died mid-batch; keep it a few times one batch's duration
+ARCHIVE_CLAIM_TIMEOUT_SECONDS = float(os.getenv('ARCHIVE_CLAIM_TIMEOUT_SECONDS', '300'))
+# Run the archiver inside the API every N seconds; 0 leaves it to `python -m app.retention`
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '0'))
+# Messages are deleted this many at a time, with a pause in between
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', '1000'))
+DELETE_BATCH_PAUSE_MS = float(os.getenv('DELETE_BATCH_PAUSE_MS', '10'))
+
+# Message Layout Configuration
+# 'documents': one chat_history document per message; 'buckets': chat_buckets documents of up to MESSAGE_BUCKET_SIZE messages
+MESSAGE_LAYOUT = os.getenv('MESSAGE_LAYOUT', 'documents')
+MESSAGE_BUCKET_SIZE = int(os.getenv('MESSAGE_BUCKET_SIZE', '50'))
+# Characters of the latest message copied onto the session record for listings
+SESSION_PREVIEW_CHARS = int(os.getenv('SESSION_PREVIEW_CHARS', '160'))
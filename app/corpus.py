@@ -0,0 +1,57 @@
+import os
+import json
+from typing import List, Dict, Any, Optional
+from .config import CORPUS_REGISTRY_PATH
+
+class CorpusRegistry:
+    """Documents that make up the retrieval corpus
+
+    Each entry in the registry file names a document and the metadata every
+    chunk of it is tagged with:
+
+        {"source": "chill-panda-book", "title": "The Chill Panda",
+         "path": "The Chill Panda B+.pdf", "language": "en", "kind": "book",
+         "sections": [{"name": "breathing", "start_page": 10, "end_page": 14}]}
+
+    `path` is relative to the registry file; `sections` (1-based, inclusive
+    page ranges) are optional and let retrieval be narrowed to part of a document.
+    """
+    def __init__(self, path: str = CORPUS_REGISTRY_PATH):
+        self.path = path
+        with open(path, "r", encoding="utf-8") as file:
+            self.documents: List[Dict[str, Any]] = json.load(file)["documents"]
+
+    def get(self, source: str) -> Optional[Dict[str, Any]]:
+        for document in self.documents:
+            if document["source"] == source:
+                return document
+        return None
+
+    def document_path(self, document: Dict[str, Any]) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), document["path"])
+
+    def languages(self) -> List[str]:
+        return sorted({document.get("language", "en") for document in self.documents})
+
+def build_filter(language: Optional[str] = None, sources: Optional[List[str]] = None,
+                 sections: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Metadata filter in Pinecone's syntax, also understood by the FAISS store"""
+    conditions = {}
+    if language:
+        conditions["language"] = {"$eq": language}
+    if sources:
+        conditions["source"] = {"$in": list(sources)}
+    if sections:
+        conditions["section"] = {"$in": list(sections)}
+    return conditions or None
+
+def metadata_matches(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    """Evaluate a filter from build_filter against one chunk's metadata"""
+    for field, condition in filter.items():
+        if isinstance(condition, dict):
+            values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+        else:
+            values = [condition]
+        if metadata.get(field) not in values:
+            return False
+    return True
@@ -1,32 +1,105 @@
 import os
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
 import PyPDF2
-from typing import List, Dict, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from pinecone_setup import get_pinecone_index
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Set
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from .config import (
+    VECTOR_STORE_BACKEND,
+    FAISS_INDEX_PATH,
+    EMBEDDING_CACHE_ENABLED,
+    INGEST_CHECKPOINT_PATH,
+    INGEST_EXTRACT_WORKERS,
+    INGEST_EMBED_BATCH_SIZE,
+    INGEST_EMBED_CONCURRENCY,
+    INGEST_UPSERT_CONCURRENCY,
+    INGEST_MAX_RETRIES,
+)
+from .vector_store import FaissVectorStore
+from .corpus import CorpusRegistry
+from .upstream import is_retryable, retry_after
+from .retrieval import ChunkStore
+from .embeddings import embedding_model_name, get_embeddings
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Chunk tags that describe its content, as opposed to where it sits in the document
+CONTENT_TAGS = ("language", "section", "kind")
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end); runs inside a worker process"""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[page_num].extract_text() or "" for page_num in range(start, end)]
+
+class IngestCheckpoint:
+    """Ids of the chunks already stored in the vector index, per source
+
+    Written after every upsert batch, so an interrupted run resumes where it
+    stopped and a re-run only embeds chunks that are new or changed.
+    """
+    def __init__(self, path: str = INGEST_CHECKPOINT_PATH):
+        self.path = path
+        self.sources: Dict[str, List[str]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.sources = json.load(file)
+
+    def done(self, source: str) -> Set[str]:
+        return set(self.sources.get(source, []))
+
+    def mark(self, source: str, chunk_ids: List[str]):
+        stored = self.sources.setdefault(source, [])
+        stored.extend(chunk_ids)
+        self._save()
+
+    def forget(self, source: str, chunk_ids: Set[str]):
+        self.sources[source] = [chunk_id for chunk_id in self.sources.get(source, []) if chunk_id not in chunk_ids]
+        self._save()
+
+    def _save(self):
+        # Write then rename so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.sources, file)
+        os.replace(tmp_path, self.path)
+
 class DocumentProcessor:
     def __init__(self):
-        self.embeddings = OpenAIEmbeddings(
-            openai_api_key=os.getenv("OPENAI_API_KEY"),
-            model=os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
-        )
-        self.index = get_pinecone_index()
-        
+        self.embeddings = get_embeddings()
+        if EMBEDDING_CACHE_ENABLED:
+            # Unchanged chunks are answered from the cache instead of re-embedded
+            self.embeddings = CachedEmbeddings(self.embeddings, embedding_model_name(), EmbeddingCache())
+        self.checkpoint = IngestCheckpoint()
+
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Extract text from PDF file"""
-        text = ""
+        return "".join(self.extract_pages(pdf_path))
+
+    def extract_pages(self, pdf_path: str, workers: int = INGEST_EXTRACT_WORKERS) -> List[str]:
+        """Extract page texts, spreading page ranges over a process pool"""
         with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text()
-        return text
-    
+            page_count = len(PyPDF2.PdfReader(file).pages)
+
+        workers = max(1, min(workers, page_count))
+        if workers == 1:
+            return extract_page_range(pdf_path, 0, page_count)
+
+        step = -(-page_count // workers)
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(extract_page_range, [pdf_path] * len(ranges), *zip(*ranges))
+            return [page for part in parts for page in part]
+
     def chunk_document(self, text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
         """Split document into chunks"""
         text_splitter = RecursiveCharacterTextSplitter(
@@ -36,29 +109,193 @@ class DocumentProcessor:
             separators=["\n\n", "\n", " ", ""]
         )
         return text_splitter.split_text(text)
-    
-    def embed_and_store(self, chunks: List[str], metadata: List[Dict[str, Any]] = None):
-        """Embed chunks and store in Pinecone"""
+
+    @staticmethod
+    def chunk_id(source: str, text: str, metadata: Dict[str, Any] = None) -> str:
+        """Content-addressed id, stable across runs for unchanged chunks
+        
+        The content tags are part of the hash, so re-tagging a chunk (e.g. a
+        new section) re-upserts it instead of leaving stale metadata in the
+        index. Its position is not: an edit early in a document must not
+        change the id of every chunk after it.
+        """
+        content_tags = {key: value for key, value in (metadata or {}).items() if key in CONTENT_TAGS}
+        tags = json.dumps(content_tags, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{source}\0{tags}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def embed_and_store(self, chunks: List[str], metadata: List[Dict[str, Any]] = None, source: str = "chill-panda-book"):
+        """Embed chunks and store them in the configured vector store"""
         if metadata is None:
-            metadata = [{"source": "chill-panda-book", "chunk_id": i} for i in range(len(chunks))]
+            metadata = [{"source": source, "language": "en", "chunk_id": i} for i in range(len(chunks))]
+
+        if VECTOR_STORE_BACKEND == "faiss":
+            return asyncio.run(self.build_faiss_index(chunks, metadata))
+
+        return asyncio.run(self.ingest_to_pinecone(chunks, metadata, source))
+
+    async def _with_retries(self, make_call, what: str):
+        """Retry a transient upstream failure after its Retry-After, or with jittered exponential backoff"""
+        for attempt in range(INGEST_MAX_RETRIES + 1):
+            try:
+                return await make_call()
+            except Exception as e:
+                if attempt == INGEST_MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(30.0, 2 ** attempt) * (0.5 + random.random())
+                logger.warning("%s failed (%s), retrying in %.1fs", what, e, delay)
+                await asyncio.sleep(delay)
+
+    async def embed_batches(self, chunks: List[str], positions: List[int], on_batch):
+        """Embed chunks[positions] in concurrent batches, handing each finished batch to on_batch"""
+        semaphore = asyncio.Semaphore(INGEST_EMBED_CONCURRENCY)
+        batches = [positions[i:i + INGEST_EMBED_BATCH_SIZE] for i in range(0, len(positions), INGEST_EMBED_BATCH_SIZE)]
+
+        async def embed_batch(batch: List[int]):
+            async with semaphore:
+                vectors = await self._with_retries(
+                    lambda: self.embeddings.aembed_documents([chunks[i] for i in batch]), "embedding batch"
+                )
+            await on_batch(batch, vectors)
+
+        await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+    async def ingest_to_pinecone(self, chunks: List[str], metadata: List[Dict[str, Any]], source: str):
+        """Embed new chunks and upsert them to Pinecone while later batches are still embedding"""
+        from .pinecone_setup import get_pinecone_index
+
+        index = get_pinecone_index()
+        ids = [self.chunk_id(source, chunk, tags) for chunk, tags in zip(chunks, metadata)]
+        done = self.checkpoint.done(source)
+        pending = [i for i, chunk_id in enumerate(ids) if chunk_id not in done]
+        logger.info("%s: %d chunks, %d already stored", source, len(chunks), len(chunks) - len(pending))
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_UPSERT_CONCURRENCY * 2)
+
+        async def upsert_worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                batch, vectors = item
+                records = [
+                    {"id": ids[i], "values": vector, "metadata": {**metadata[i], "text": chunks[i]}}
+                    for i, vector in zip(batch, vectors)
+                ]
+                await self._with_retries(
+                    lambda: loop.run_in_executor(None, lambda: index.upsert(vectors=records)), "upsert batch"
+                )
+                self.checkpoint.mark(source, [ids[i] for i in batch])
+
+        async def enqueue(batch, vectors):
+            await queue.put((batch, vectors))
+
+        async def produce():
+            await self.embed_batches(chunks, pending, enqueue)
+            for _ in range(INGEST_UPSERT_CONCURRENCY):
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(upsert_worker()) for _ in range(INGEST_UPSERT_CONCURRENCY)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # A failed batch stops the run; the checkpoint keeps what was stored
+            for task in tasks:
+                task.cancel()
+
+        # Chunks that disappeared from the document are removed from the index
+        stale = done - set(ids)
+        if stale:
+            await loop.run_in_executor(None, lambda: index.delete(ids=list(stale)))
+            self.checkpoint.forget(source, stale)
         
-        # Create vector store
-        vectorstore = PineconeVectorStore.from_texts(
-            texts=chunks,
-            embedding=self.embeddings,
-            metadatas=metadata,
-            index_name=os.getenv("PINECONE_INDEX_NAME")
-        )
+        # Keep the lexical (BM25) side of hybrid retrieval in step with the index
+        store = ChunkStore()
+        store.remove(stale)
+        for chunk_id, chunk, tags in zip(ids, chunks, metadata):
+            store.put(chunk_id, chunk, tags)
+        store.save()
+
+    async def build_faiss_index(self, chunks: List[str], metadata: List[Dict[str, Any]], path: str = FAISS_INDEX_PATH):
+        """Embed chunks and write a local FAISS index to disk"""
+        vectors: List[List[float]] = [None] * len(chunks)
+
+        async def collect(batch, batch_vectors):
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+
+        await self.embed_batches(chunks, list(range(len(chunks))), collect)
+        vectorstore = FaissVectorStore.from_embeddings(chunks, vectors, metadata, embedding=self.embeddings)
+        vectorstore.save(path)
         
+        store = ChunkStore()
+        store.replace_all({
+            self.chunk_id(tags.get("source", ""), chunk, tags): {"text": chunk, "metadata": tags}
+            for chunk, tags in zip(chunks, metadata)
+        })
+        store.save()
         return vectorstore
+
+    def chunk_corpus_document(self, registry: CorpusRegistry, document: Dict[str, Any]):
+        """Chunk one registered document, tagging each chunk with its corpus metadata"""
+        pages = self.extract_pages(registry.document_path(document))
+        tags = {
+            "source": document["source"],
+            "title": document.get("title", document["source"]),
+            "language": document.get("language", "en"),
+            "kind": document.get("kind", "book"),
+        }
+        
+        # Sections are 1-based inclusive page ranges; without them the document is one part
+        parts = [
+            (section["name"], pages[section["start_page"] - 1:section["end_page"]])
+            for section in document.get("sections") or []
+        ] or [(None, pages)]
+        
+        chunks, metadata = [], []
+        for section, section_pages in parts:
+            for chunk in self.chunk_document("".join(section_pages)):
+                chunk_tags = dict(tags, chunk_id=len(chunks))
+                if section:
+                    chunk_tags["section"] = section
+                chunks.append(chunk)
+                metadata.append(chunk_tags)
+        return chunks, metadata
     
-    def process_pdf(self, pdf_path: str):
-        """Process PDF and store in Pinecone"""
+    def process_corpus(self, registry: CorpusRegistry = None, sources: List[str] = None):
+        """Ingest the registered documents (all of them, or just `sources`)"""
+        registry = registry or CorpusRegistry()
+        documents = [doc for doc in registry.documents if not sources or doc["source"] in sources]
+        
+        if VECTOR_STORE_BACKEND == "faiss":
+            # The local index holds the whole corpus, so it is rebuilt from every document
+            all_chunks, all_metadata = [], []
+            for document in registry.documents:
+                chunks, metadata = self.chunk_corpus_document(registry, document)
+                all_chunks += chunks
+                all_metadata += metadata
+            return asyncio.run(self.build_faiss_index(all_chunks, all_metadata))
+        
+        for document in documents:
+            chunks, metadata = self.chunk_corpus_document(registry, document)
+            asyncio.run(self.ingest_to_pinecone(chunks, metadata, document["source"]))
+
+    def process_pdf(self, pdf_path: str, source: str = "chill-panda-book"):
+        """Process PDF and store it in the vector store"""
         text = self.extract_text_from_pdf(pdf_path)
         chunks = self.chunk_document(text)
-        self.embed_and_store(chunks)
+        self.embed_and_store(chunks, source=source)
 
-# Run this once to process the PDF
+# Ingest the corpus registry: python -m app.document_processor [--source NAME ...]
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    parser = argparse.ArgumentParser(description="Ingest the registered corpus into the vector store")
+    parser.add_argument("--source", action="append", help="only ingest these registered sources")
+    args = parser.parse_args()
+
     processor = DocumentProcessor()
-    processor.process_pdf("./data/The Chill Panda B+.pdf")
\ No newline at end of file
+    processor.process_corpus(sources=args.source)
@@ -0,0 +1,212 @@
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .cache import get_cache_backend
+from .config import (
+    CACHE_BACKEND,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_BUSY_TIMEOUT_MS,
+    EMBEDDING_CACHE_MEMORY_ENTRIES,
+    EMBEDDING_CACHE_SHARED_TTL_SECONDS,
+)
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFKC, case-folded, single-spaced"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+class EmbeddingCache:
+    """Embedding vectors keyed by model and normalized text
+
+    A bounded LRU serves the hot set from memory; an SQLite file keeps every
+    vector across restarts and is shared by the workers on one host; async
+    callers reach it from a worker thread, and a locked or failing file
+    counts as a miss. With CACHE_BACKEND=redis (or an explicit `shared` backend) async lookups fall
+    through to a store shared by every node.
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+                 shared=None, busy_timeout_ms: int = EMBEDDING_CACHE_BUSY_TIMEOUT_MS):
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # The connection is used from worker threads; the memory tier must not wait on it
+        self._db_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        if shared is None and CACHE_BACKEND == "redis":
+            shared = get_cache_backend("embeddings", max_entries=max_memory_entries,
+                                       ttl_seconds=EMBEDDING_CACHE_SHARED_TTL_SECONDS)
+        self.shared = shared
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _memory_lookup(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return vector
+
+    def _disk_lookup(self, key: str) -> Optional[List[float]]:
+        if self._conn is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            return None
+        if row is None:
+            return None
+
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, vector)
+        return vector
+
+    def _disk_write(self, key: str, model: str, vector: List[float]):
+        if self._conn is None:
+            return
+        try:
+            with self._db_lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                    (key, model, np.asarray(vector, dtype=np.float32).tobytes())
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            # The memory tier still has it; the next process to embed the text writes it again
+            pass
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        key = self.make_key(text, model)
+        vector = self._memory_lookup(key)
+        if vector is None:
+            vector = self._disk_lookup(key)
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+        return vector
+
+    async def aget(self, text: str, model: str) -> Optional[List[float]]:
+        """get() without blocking the event loop on disk, falling through to the shared tier"""
+        key = self.make_key(text, model)
+        vector = self._memory_lookup(key)
+        if vector is None and self._conn is not None:
+            vector = await asyncio.to_thread(self._disk_lookup, key)
+        if vector is None and self.shared is not None:
+            try:
+                raw = await self.shared.get(key)
+            except Exception as e:
+                raw = None
+            if raw is not None:
+                vector = np.frombuffer(raw, dtype=np.float32).tolist()
+                with self._lock:
+                    self.shared_hits += 1
+                    self._remember(key, vector)
+                return vector
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+        return vector
+
+    def put(self, text: str, model: str, vector: List[float]):
+        key = self.make_key(text, model)
+        with self._lock:
+            self._remember(key, vector)
+        self._disk_write(key, model, vector)
+
+    async def aput(self, text: str, model: str, vector: List[float]):
+        """put() without blocking the event loop on disk, writing through to the shared tier"""
+        key = self.make_key(text, model)
+        with self._lock:
+            self._remember(key, vector)
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_write, key, model, vector)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(key, np.asarray(vector, dtype=np.float32).tobytes())
+        except Exception as e:
+            pass
+
+    def _remember(self, key: str, vector: List[float]):
+        """Insert into the memory tier, evicting the least recently used entry"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict:
+        hits = self.memory_hits + self.disk_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that answers repeated texts from an EmbeddingCache"""
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(text, self.model)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(text, self.model, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = await self.cache.aget(text, self.model)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await self.cache.aput(text, self.model, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [self.cache.get(text, self.model) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                self.cache.put(texts[i], self.model, vector)
+                vectors[i] = vector
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = list(await asyncio.gather(*(self.cache.aget(text, self.model) for text in texts)))
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = await self.embeddings.aembed_documents([texts[i] for i in missing])
+            await asyncio.gather(*(self.cache.aput(texts[i], self.model, vector) for i, vector in zip(missing, embedded)))
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return vectors
@@ -0,0 +1,151 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from langchain_core.embeddings import Embeddings
+from .config import (
+    EMBEDDING_PROVIDER,
+    EMBEDDING_MODEL,
+    EMBEDDING_TIMEOUT_SECONDS,
+    LOCAL_EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_BACKEND,
+    LOCAL_EMBEDDING_MODEL_FILE,
+    LOCAL_EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_MAX_WAIT_MS,
+)
+
+class MicroBatcher:
+    """Coalesces concurrent single-text embedding requests into one model call
+
+    The first request of a batch waits at most `max_wait_ms` for others to
+    join; a full batch is flushed immediately. Batches run one at a time on a
+    dedicated thread, so requests arriving during an encode queue up for the
+    next batch instead of competing for CPU.
+    """
+    def __init__(self, encode: Callable[[List[str]], List[List[float]]],
+                 max_batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE, max_wait_ms: float = LOCAL_EMBEDDING_MAX_WAIT_MS):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle = None
+        # The loop only keeps weak references to tasks; hold in-flight batches here
+        self._tasks = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+
+    async def submit(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    async def submit_batch(self, texts: List[str]) -> List[List[float]]:
+        """Encode texts as one batch, in turn with the coalesced ones"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.encode, texts)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            vectors = await self.submit_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers model run on the local CPU
+
+    LOCAL_EMBEDDING_BACKEND selects torch, onnx or openvino; pointing
+    LOCAL_EMBEDDING_MODEL_FILE at a quantized export (for example
+    onnx/model_qint8_avx512.onnx) loads that file instead of the default.
+    """
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, backend: str = LOCAL_EMBEDDING_BACKEND,
+                 model_file: str = LOCAL_EMBEDDING_MODEL_FILE, batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        self.backend = backend
+        self.model_file = model_file
+        self.batch_size = batch_size
+        self._model = None
+        self._batcher = MicroBatcher(self._encode, max_batch_size=batch_size)
+
+    @property
+    def model(self):
+        if self._model is None:
+            # Deferred so importing this module does not pull in torch
+            from sentence_transformers import SentenceTransformer
+
+            kwargs = {"device": "cpu"}
+            if self.backend != "torch":
+                kwargs["backend"] = self.backend
+            if self.model_file:
+                kwargs["model_kwargs"] = {"file_name": self.model_file}
+            self._model = SentenceTransformer(self.model_name, **kwargs)
+        return self._model
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+        return vectors.tolist()
+
+    def warm_up(self):
+        """Load the model and run one encode so the first request pays no setup cost"""
+        self._encode(["warm up"])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self._batcher.submit(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._batcher.submit_batch(texts)
+
+def embedding_model_name(provider: str = EMBEDDING_PROVIDER) -> str:
+    """Name of the model behind the configured provider, used in cache keys"""
+    return LOCAL_EMBEDDING_MODEL if provider == "local" else EMBEDDING_MODEL
+
+def get_embeddings(provider: str = EMBEDDING_PROVIDER) -> Embeddings:
+    """Build the configured embedding provider ("openai" or "local")"""
+    if provider == "local":
+        return LocalEmbeddings()
+
+    from langchain_openai import OpenAIEmbeddings
+    from .upstream import openai_http_client
+
+    # Shares the pooled connections; retries are left to the callers
+    return OpenAIEmbeddings(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        model=EMBEDDING_MODEL,
+        http_async_client=openai_http_client,
+        request_timeout=EMBEDDING_TIMEOUT_SECONDS,
+        max_retries=0
+    )
+
+def warm_up_embeddings(embeddings: Embeddings):
+    """Warm up a local model, looking through cache wrappers"""
+    inner = getattr(embeddings, "embeddings", embeddings)
+    if hasattr(inner, "warm_up"):
+        inner.warm_up()
@@ -0,0 +1,92 @@
+from typing import List, Dict, Optional
+from .cache import get_cache_backend
+from .config import (
+    HISTORY_CACHE_MAX_MESSAGES,
+    HISTORY_CACHE_MAX_SESSIONS,
+    HISTORY_CACHE_TTL_SECONDS,
+    HISTORY_CACHE_TOMBSTONE_SECONDS,
+)
+
+class HistoryCache:
+    """Recent messages per session, kept in front of the chat_history collection
+
+    Each entry holds the last `max_messages` messages of a session (or all of
+    them for shorter sessions), oldest first, so any read of up to
+    `max_messages` can be answered from the entry alone.
+
+    Deleting a session leaves a short-lived tombstone in the same backend,
+    so a worker that read the session just before the delete cannot put it
+    back into a shared cache.
+    """
+    def __init__(self, max_messages: int = HISTORY_CACHE_MAX_MESSAGES,
+                 max_sessions: int = HISTORY_CACHE_MAX_SESSIONS,
+                 ttl_seconds: float = HISTORY_CACHE_TTL_SECONDS):
+        self.max_messages = max_messages
+        self.backend = get_cache_backend("history", max_entries=max_sessions, ttl_seconds=ttl_seconds)
+        self.deleted = get_cache_backend(
+            "history_deleted", max_entries=max_sessions, ttl_seconds=HISTORY_CACHE_TOMBSTONE_SECONDS
+        )
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, session_id: str, limit: int) -> Optional[List[Dict]]:
+        """Return the last `limit` messages, or None on a miss"""
+        if limit > self.max_messages:
+            return None
+        try:
+            messages = await self.backend.get(session_id)
+        except Exception as e:
+            messages = None
+        if messages is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return messages[-limit:]
+
+    async def fill(self, session_id: str, messages: List[Dict]):
+        """Store the session tail read from MongoDB"""
+        try:
+            await self.backend.set(session_id, messages[-self.max_messages:])
+            await self._drop_if_deleted(session_id)
+        except Exception as e:
+            pass
+
+    async def append(self, session_id: str, messages: List[Dict]):
+        """Write-through newly saved messages to a cached session"""
+        try:
+            cached = await self.backend.get(session_id)
+            if cached is None:
+                # The next read fills the entry from MongoDB
+                return
+            await self.backend.set(session_id, (cached + messages)[-self.max_messages:])
+            await self._drop_if_deleted(session_id)
+        except Exception as e:
+            # Drop the entry rather than leave it missing these messages
+            await self.invalidate(session_id)
+
+    async def _drop_if_deleted(self, session_id: str):
+        """Undo a write that raced with a session delete
+        
+        The delete writes its tombstone before removing the entry, so
+        checking after our own write catches every interleaving.
+        """
+        if await self.deleted.get(session_id) is not None:
+            await self.backend.delete(session_id)
+
+    async def invalidate(self, session_id: str, deleted: bool = False):
+        """Drop a session's entry; `deleted` also blocks re-caching it for a while"""
+        try:
+            if deleted:
+                await self.deleted.set(session_id, True)
+            await self.backend.delete(session_id)
+        except Exception as e:
+            pass
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "sessions": self.backend.size(),
+        }
@@ -0,0 +1,42 @@
+from typing import Dict, Optional
+from .cache import get_cache_backend
+from .config import IDEMPOTENCY_TTL_SECONDS
+
+class IdempotencyStore:
+    """Results of chat turns sent with an idempotency_key, for answering retries
+
+    Entries are written while the turn still holds its session lock, so a
+    duplicate that waited on the lock always finds the first one's result.
+    """
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = 100000):
+        self.backend = get_cache_backend("idempotency", max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.replays = 0
+
+    @staticmethod
+    def _key(session_id: str, idempotency_key: str) -> str:
+        return f"{session_id}:{idempotency_key}"
+
+    async def get(self, session_id: str, idempotency_key: Optional[str]) -> Optional[Dict]:
+        if not idempotency_key:
+            return None
+        try:
+            result = await self.backend.get(self._key(session_id, idempotency_key))
+        except Exception as e:
+            # An unavailable store means the retry is answered afresh
+            return None
+        if result is not None:
+            self.replays += 1
+        return result
+
+    async def put(self, session_id: str, idempotency_key: Optional[str], result: Dict):
+        if not idempotency_key:
+            return
+        try:
+            await self.backend.set(self._key(session_id, idempotency_key), result)
+        except Exception as e:
+            pass
+
+    def stats(self) -> Dict:
+        return {"replays": self.replays, "entries": self.backend.size()}
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,215 @@
+import os
+import time
+import logging
+from contextlib import nullcontext
+from typing import Callable, Dict, Optional
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Spans are no-ops until an OpenTelemetry SDK and exporter are configured
+    from opentelemetry import trace
+
+    tracer = trace.get_tracer("chillpanda")
+except ImportError:
+    tracer = None
+
+def span(name: str):
+    """Context manager for a tracing span, or a no-op without OpenTelemetry"""
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+REQUEST_LATENCY = Histogram(
+    "chillpanda_request_duration_seconds",
+    "Time until the response starts, by route (stream bodies are timed by the llm stage)",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "chillpanda_stage_duration_seconds",
+    "Duration of chat pipeline stages",
+    ["route", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "chillpanda_prompt_tokens",
+    "Prompt tokens per request, by prompt part",
+    ["part"],
+    buckets=(0, 25, 50, 100, 250, 500, 1000, 2000, 3000, 4000, 8000, 16000),
+)
+PROMPT_ITEMS = Histogram(
+    "chillpanda_prompt_items",
+    "Retrieved chunks and history messages kept in the prompt",
+    ["item"],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12),
+)
+
+# Counts of chunks / messages rather than tokens
+PROMPT_ITEM_KEYS = {"chunks", "history_messages"}
+
+def record_stages(route: str, stages: Dict[str, float], tokens: Dict[str, int]):
+    """Feed one request's StageTimer into the histograms"""
+    for stage, duration_ms in stages.items():
+        STAGE_LATENCY.labels(route, stage).observe(duration_ms / 1000)
+    for part, count in tokens.items():
+        if part in PROMPT_ITEM_KEYS:
+            PROMPT_ITEMS.labels(part).observe(count)
+        else:
+            PROMPT_TOKENS.labels(part).observe(count)
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request until its response starts, inside a root span"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # The router stores the matched route in the scope; use its template to bound label cardinality
+                route = scope.get("route")
+                REQUEST_LATENCY.labels(
+                    scope["method"], getattr(route, "path", "unmatched"), str(message["status"])
+                ).observe(time.perf_counter() - started)
+            await send(message)
+
+        with span(f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send_wrapper)
+
+# name -> stats() of a cache or retriever, read at scrape time
+stats_sources: Dict[str, Callable[[], Dict]] = {}
+
+def register_stats(name: str, source: Callable[[], Dict]):
+    stats_sources[name] = source
+
+# Upstream name -> {"state", "outcomes"}; registered by the app rather than
+# imported, so scripts that only touch MongoDB need no OpenAI client
+upstream_stats_source: Optional[Callable[[], Dict[str, Dict]]] = None
+
+def register_upstream_stats(source: Callable[[], Dict[str, Dict]]):
+    global upstream_stats_source
+    upstream_stats_source = source
+
+class StatsCollector:
+    """Exposes component stats() (hit ratios, sizes) and upstream outcome counters
+
+    These are read from the process answering the scrape; under gunicorn
+    that is one worker's view.
+    """
+    def collect(self):
+        component = GaugeMetricFamily(
+            "chillpanda_component_stat", "Numeric stats of caches and retrievers", labels=["component", "stat"]
+        )
+        for name, source in stats_sources.items():
+            try:
+                stats = source()
+            except Exception as e:
+                logger.warning("stats() of %s failed: %r", name, e)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    component.add_metric([name, key], value)
+        yield component
+
+        if upstream_stats_source is None:
+            return
+        calls = CounterMetricFamily(
+            "chillpanda_upstream_calls", "Upstream call outcomes", labels=["upstream", "outcome"]
+        )
+        circuit = GaugeMetricFamily(
+            "chillpanda_upstream_circuit_open", "1 while the upstream's circuit breaker is not closed", labels=["upstream"]
+        )
+        for name, stats in upstream_stats_source().items():
+            for outcome, count in stats["outcomes"].items():
+                calls.add_metric([name, outcome], count)
+            circuit.add_metric([name], 0 if stats["state"] == "closed" else 1)
+        yield calls
+        yield circuit
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+def scrape() -> bytes:
+    """Metrics in the Prometheus text format
+    
+    With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py does) the histograms,
+    counters and gauges are summed over every worker.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY)
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(stats_collector)
+    return generate_latest(registry)
+
+# Summed over live workers in multiprocess mode
+MONGO_CONNECTIONS = Gauge(
+    "chillpanda_mongo_pool_connections", "Open MongoDB connections", ["address"], multiprocess_mode="livesum"
+)
+MONGO_CHECKED_OUT = Gauge(
+    "chillpanda_mongo_pool_checked_out", "MongoDB connections in use", ["address"], multiprocess_mode="livesum"
+)
+MONGO_CHECKOUT_WAIT = Histogram(
+    "chillpanda_mongo_pool_checkout_seconds",
+    "Time spent waiting for a pooled MongoDB connection",
+    ["address"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "chillpanda_mongo_pool_checkout_failures", "Failed MongoDB connection checkouts", ["address", "reason"]
+)
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """pymongo pool events turned into gauges; pass to the client's event_listeners"""
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        MONGO_CONNECTIONS.labels(_address(event)).set(0)
+        MONGO_CHECKED_OUT.labels(_address(event)).set(0)
+
+    def connection_created(self, event):
+        MONGO_CONNECTIONS.labels(_address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_CONNECTIONS.labels(_address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_CHECKOUT_FAILURES.labels(_address(event), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        MONGO_CHECKED_OUT.labels(_address(event)).inc()
+        MONGO_CHECKOUT_WAIT.labels(_address(event)).observe(event.duration)
+
+    def connection_checked_in(self, event):
+        MONGO_CHECKED_OUT.labels(_address(event)).dec()
+
+mongo_pool_metrics = MongoPoolMetrics()
@@ -0,0 +1,151 @@
+import os
+import asyncio
+import logging
+import argparse
+from typing import Dict, List, Tuple
+from .config import CHAT_RETENTION_DAYS
+from .mongodb_manager import BucketedMongoDBManager, MongoDBManager, mongodb_manager
+
+logger = logging.getLogger(__name__)
+
+# collection attribute of MongoDBManager -> (keys, options) of each index.
+# Collections the manager does not have (buckets outside MESSAGE_LAYOUT=buckets)
+# are skipped. mongo_init.js creates the same indexes when a fresh container
+# starts; keep the two in step.
+INDEXES: Dict[str, List[Tuple[List[Tuple[str, int]], Dict]]] = {
+    "chats_collection": [
+        ([("session_id", 1), ("timestamp", -1), ("_id", -1)], {}),
+        ([("user_id", 1)], {}),
+    ],
+    "sessions_collection": [
+        ([("session_id", 1)], {"unique": True}),
+        # Keyset pages of a user's sessions, most recent first
+        ([("user_id", 1), ("last_activity", -1), ("session_id", -1)], {}),
+        ([("last_activity", -1)], {}),
+        # Deleted sessions whose messages are still being purged
+        ([("purge_before", 1)], {"sparse": True}),
+    ],
+    "buckets_collection": [
+        ([("session_id", 1), ("seq", 1)], {"unique": True}),
+    ],
+    "user_stats_collection": [
+        ([("user_id", 1)], {"unique": True}),
+    ],
+}
+
+# TTL index per collection for CHAT_RETENTION_DAYS: messages expire by
+# timestamp, sessions by last activity. Only applied here, not by mongo_init.js.
+RETENTION_INDEXES: Dict[str, Tuple[str, List[Tuple[str, int]]]] = {
+    "chats_collection": ("timestamp_1", [("timestamp", 1)]),
+    "sessions_collection": ("last_activity_-1", [("last_activity", -1)]),
+    # A bucket expires with its newest message
+    "buckets_collection": ("last_ts_1", [("last_ts", 1)]),
+}
+
+async def migrate(manager: MongoDBManager = mongodb_manager, retention_days: float = CHAT_RETENTION_DAYS) -> List[str]:
+    """Create any missing indexes, backfill empty session totals and set the retention TTLs; other existing indexes are left alone. Returns the index names."""
+    await manager.ping()
+    names = []
+    for attribute, indexes in INDEXES.items():
+        collection = getattr(manager, attribute, None)
+        if collection is None:
+            continue
+        existing = await collection.index_information()
+        for keys, options in indexes:
+            # Matched on keys, so an index that has since become a TTL index is not re-created
+            name = next((name for name, info in existing.items() if list(info["key"]) == keys), None)
+            if name is None:
+                name = await collection.create_index(keys, **options)
+            logger.info("%s.%s ready", collection.name, name)
+            names.append(name)
+    # The totals are only maintained from here on: count what exists on the first run
+    stats = getattr(manager, "user_stats_collection", None)
+    if stats is not None and await stats.find_one({}) is None:
+        await recount_sessions(manager)
+    await apply_retention(manager, retention_days)
+    return names
+
+async def apply_retention(manager: MongoDBManager, retention_days: float):
+    """Create, change or remove the TTL indexes so MongoDB expires data after `retention_days` (0 keeps it)"""
+    seconds = int(retention_days * 86400)
+    for attribute, (name, keys) in RETENTION_INDEXES.items():
+        collection = getattr(manager, attribute, None)
+        if collection is None:
+            continue
+        info = (await collection.index_information()).get(name)
+        current = info.get("expireAfterSeconds") if info else None
+        if seconds and info is None:
+            await collection.create_index(keys, expireAfterSeconds=seconds)
+        elif seconds and current != seconds:
+            # collMod turns an index into a TTL index or changes its TTL without rebuilding it
+            await manager.db.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds})
+        elif not seconds and current is not None:
+            # A TTL cannot be removed in place: rebuild the index without it
+            await collection.drop_index(name)
+            if any(index_keys == keys for index_keys, _ in INDEXES[attribute]):
+                await collection.create_index(keys)
+        logger.info("%s.%s retention: %s", collection.name, name, f"{seconds}s" if seconds else "off")
+
+async def migrate_to_buckets(manager: BucketedMongoDBManager) -> Dict[str, int]:
+    """Copy chat_history into chat_buckets, session by session
+    
+    chat_history is left as it is. Each run copies only what the buckets do
+    not hold yet: run it once live, then again with writes paused right
+    before switching MESSAGE_LAYOUT to buckets.
+    """
+    await migrate(manager)
+    sessions = 0
+    messages = 0
+    cursor = manager.sessions_collection.find(
+        {"purge_before": {"$exists": False}}, {"_id": 0, "session_id": 1, "user_id": 1}
+    )
+    async for session in cursor:
+        copied = await manager.migrate_session(session["session_id"], session["user_id"])
+        if copied:
+            sessions += 1
+            messages += copied
+            if sessions % 1000 == 0:
+                logger.info("%d sessions, %d messages copied so far", sessions, messages)
+    logger.info("Copied %d messages of %d sessions into %s", messages, sessions, manager.buckets_collection.name)
+    return {"sessions": sessions, "messages": messages}
+
+async def recount_sessions(manager: MongoDBManager = mongodb_manager) -> int:
+    """Rebuild every user's maintained session total from user_sessions; returns the users counted
+    
+    The totals follow creates, deletes, archiving and restores, but not
+    sessions removed by the retention TTL, so run this now and then when
+    CHAT_RETENTION_DAYS is set.
+    """
+    counted = set()
+    cursor = manager.sessions_collection.aggregate([
+        {"$match": {"deleted_at": {"$exists": False}}},
+        {"$group": {"_id": "$user_id", "sessions": {"$sum": 1}}}
+    ])
+    async for user in cursor:
+        await manager.user_stats_collection.update_one(
+            {"user_id": user["_id"]}, {"$set": {"session_count": user["sessions"]}}, upsert=True
+        )
+        counted.add(user["_id"])
+    async for stats in manager.user_stats_collection.find({"session_count": {"$ne": 0}}, {"_id": 0, "user_id": 1}):
+        if stats["user_id"] not in counted:
+            await manager.user_stats_collection.update_one({"user_id": stats["user_id"]}, {"$set": {"session_count": 0}})
+    logger.info("Recounted sessions of %d users", len(counted))
+    return len(counted)
+
+# Apply the MongoDB indexes once per deployment: python -m app.migrate
+# Copy messages into the bucketed layout: python -m app.migrate buckets
+# Rebuild the per-user session totals: python -m app.migrate counters
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    parser = argparse.ArgumentParser(description="MongoDB indexes and data migrations")
+    parser.add_argument("command", nargs="?", choices=["indexes", "buckets", "counters"], default="indexes")
+    args = parser.parse_args()
+
+    if args.command == "buckets":
+        target = mongodb_manager if isinstance(mongodb_manager, BucketedMongoDBManager) else BucketedMongoDBManager()
+        asyncio.run(migrate_to_buckets(target))
+    elif args.command == "counters":
+        asyncio.run(recount_sessions())
+    else:
+        asyncio.run(migrate())
@@ -1,140 +1,816 @@
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import asyncio
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
 from dotenv import load_dotenv
+from .config import (
+    HISTORY_CACHE_ENABLED,
+    DELETE_BATCH_SIZE,
+    DELETE_BATCH_PAUSE_MS,
+    MESSAGE_LAYOUT,
+    MESSAGE_BUCKET_SIZE,
+    SESSION_PREVIEW_CHARS,
+)
+from .history_cache import HistoryCache
+from .metrics import mongo_pool_metrics
 
 load_dotenv()
 
+def _keyset(op: str, timestamp: datetime, message_id: Optional[ObjectId]) -> Dict:
+    """Messages strictly past a (timestamp, _id) position; _id orders messages saved in the same millisecond"""
+    if message_id is None:
+        return {"timestamp": {op: timestamp}}
+    return {"$or": [{"timestamp": {op: timestamp}}, {"timestamp": timestamp, "_id": {op: message_id}}]}
+
+def _bson_datetime(value: datetime) -> datetime:
+    """`value` as MongoDB stores it (milliseconds), so a stored copy matches it exactly"""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def _page_message(msg: Dict) -> Dict:
+    return {
+        "message_id": str(msg["_id"]) if "_id" in msg else None,
+        "role": msg["role"],
+        "content": msg["content"],
+        "timestamp": msg["timestamp"]
+    }
+
 class MongoDBManager:
     def __init__(self):
         self.client = None
         self.db = None
         self.chats_collection = None
         self.sessions_collection = None
+        self.user_stats_collection = None
+        self.history_cache = HistoryCache() if HISTORY_CACHE_ENABLED else None
         self.connect()
     
     def connect(self):
-        """Connect to MongoDB"""
-        try:
-            self.client = MongoClient(
-                os.getenv("MONGODB_URI", "mongodb://localhost:27017"),
-                serverSelectionTimeoutMS=5000
-            )
-            # Test connection
-            self.client.admin.command('ping')
-            
-            db_name = os.getenv("MONGODB_DATABASE", "chillpanda_db")
-            self.db = self.client[db_name]
-            
-            self.chats_collection = self.db[os.getenv("MONGODB_CHATS_COLLECTION", "chat_history")]
-            self.sessions_collection = self.db[os.getenv("MONGODB_SESSIONS_COLLECTION", "user_sessions")]
-            
-            # Create indexes
-            self.chats_collection.create_index([("session_id", 1), ("timestamp", -1)])
-            self.sessions_collection.create_index([("session_id", 1)], unique=True)
-            self.sessions_collection.create_index([("user_id", 1)])
-            self.sessions_collection.create_index([("last_activity", -1)])
-            
-            
-        except ConnectionFailure as e:
-            raise
+        """Create the async MongoDB client (Motor connects lazily on first use)"""
+        self.client = AsyncIOMotorClient(
+            os.getenv("MONGODB_URI", "mongodb://localhost:27017"),
+            serverSelectionTimeoutMS=5000,
+            # Per process; gunicorn.conf.py splits the default between workers
+            maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+            minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+            event_listeners=[mongo_pool_metrics]
+        )
+        
+        db_name = os.getenv("MONGODB_DATABASE", "chillpanda_db")
+        self.db = self.client[db_name]
+        
+        self.chats_collection = self.db[os.getenv("MONGODB_CHATS_COLLECTION", "chat_history")]
+        self.sessions_collection = self.db[os.getenv("MONGODB_SESSIONS_COLLECTION", "user_sessions")]
+        self.user_stats_collection = self.db[os.getenv("MONGODB_USER_STATS_COLLECTION", "user_stats")]
+    
+    async def ping(self):
+        """Round-trip to the server, raises if MongoDB is unreachable"""
+        await self.client.admin.command('ping')
     
-    def save_message(self, session_id: str, user_id: str, role: str, content: str, metadata: Dict = None) -> str:
+    async def save_message(self, session_id: str, user_id: str, role: str, content: str, metadata: Dict = None,
+                           message_id: Optional[ObjectId] = None, timestamp: Optional[datetime] = None) -> str:
         """Save a single message to chat history"""
         try:
-            message = {
-                "session_id": session_id,
-                "user_id": user_id,
+            message = self._message_document(session_id, user_id, {
                 "role": role,  # "user" or "assistant"
                 "content": content,
-                "timestamp": datetime.utcnow(),
-                "metadata": metadata or {}
-            }
+                "metadata": metadata,
+                # Callers that persist after responding pre-allocate the id
+                "message_id": message_id
+            }, timestamp or datetime.utcnow())
             
-            result = self.chats_collection.insert_one(message)
+            result = await self.chats_collection.insert_one(message)
             
             # Update session activity
-            self.update_session_activity(session_id, user_id)
+            await self.update_session_activity(session_id, user_id, last_message=message)
+            await self._cache_append(session_id, [message])
             
             return str(result.inserted_id)
             
         except Exception as e:
             return ""
     
-    def get_conversation_history(self, session_id: str, limit: int = 20) -> List[Dict]:
-        """Get conversation history for a session"""
+    async def save_turn(self, session_id: str, user_id: str, messages: List[Dict]) -> List[str]:
+        """Save several messages of one turn with one insert and one session upsert"""
         try:
-            messages = list(self.chats_collection.find(
-                {"session_id": session_id},
-                {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
-            ).sort("timestamp", 1).limit(limit))
+            documents = self._turn_documents(session_id, user_id, messages)
+            
+            result = await self.chats_collection.insert_many(documents)
+            await self.update_session_activity(session_id, user_id, message_count=len(documents), last_message=documents[-1])
+            await self._cache_append(session_id, documents)
             
-            return messages
+            return [str(inserted_id) for inserted_id in result.inserted_ids]
             
         except Exception as e:
             return []
     
-    def update_session_activity(self, session_id: str, user_id: str):
-        """Update or create session record"""
+    def _turn_documents(self, session_id: str, user_id: str, messages: List[Dict]) -> List[Dict]:
+        now = datetime.utcnow()
+        # Offset by position so messages of one turn never share a timestamp
+        return [
+            self._message_document(session_id, user_id, msg, msg.get("timestamp") or now + timedelta(milliseconds=position))
+            for position, msg in enumerate(messages)
+        ]
+    
+    @staticmethod
+    def _message_document(session_id: str, user_id: str, msg: Dict, timestamp: datetime) -> Dict:
+        document = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "role": msg["role"],
+            "content": msg["content"],
+            "timestamp": timestamp,
+            "metadata": msg.get("metadata") or {}
+        }
+        if msg.get("message_id") is not None:
+            document["_id"] = msg["message_id"]
+        return document
+    
+    @staticmethod
+    def _preview(document: Dict) -> Dict:
+        """The session record's copy of its latest message, for listings"""
+        return {
+            "role": document["role"],
+            "content": document["content"][:SESSION_PREVIEW_CHARS],
+            "timestamp": document["timestamp"]
+        }
+    
+    async def import_messages(self, messages: Iterable[Dict], batch_size: int = 1000) -> int:
+        """Bulk-load messages (e.g. replayed conversations) with unordered writes
+        
+        Each message needs session_id, user_id, role, content and timestamp.
+        Returns the number of messages inserted.
+        """
+        inserted = 0
+        batch = []
+        for msg in messages:
+            batch.append(msg)
+            if len(batch) >= batch_size:
+                inserted += await self._import_batch(batch)
+                batch = []
+        if batch:
+            inserted += await self._import_batch(batch)
+        return inserted
+    
+    async def _import_batch(self, batch: List[Dict]) -> int:
+        """Insert one import batch and fold its sessions into one bulk upsert"""
+        documents = [
+            self._message_document(msg["session_id"], msg["user_id"], msg, msg["timestamp"])
+            for msg in batch
+        ]
+        
         try:
-            self.sessions_collection.update_one(
+            result = await self.chats_collection.insert_many(documents, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Unordered mode keeps going past failures; count what landed
+            inserted = e.details.get("nInserted", 0)
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            documents = [doc for position, doc in enumerate(documents) if position not in failed]
+        
+        sessions = {}
+        for doc in documents:
+            session = sessions.setdefault(doc["session_id"], {
+                "user_id": doc["user_id"],
+                "count": 0,
+                "first": doc["timestamp"],
+                "last": doc
+            })
+            session["count"] += 1
+            session["first"] = min(session["first"], doc["timestamp"])
+            if doc["timestamp"] >= session["last"]["timestamp"]:
+                session["last"] = doc
+        
+        operations = [
+            UpdateOne(
                 {"session_id": session_id},
                 {
+                    # Batches are expected in time order, so the batch's latest message is the session's
                     "$set": {
-                        "user_id": user_id,
-                        "last_activity": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
+                        "user_id": session["user_id"],
+                        "updated_at": datetime.utcnow(),
+                        "last_message": self._preview(session["last"])
                     },
-                    "$setOnInsert": {
-                        "created_at": datetime.utcnow(),
-                        "message_count": 0
-                    }
+                    "$min": {"created_at": session["first"]},
+                    "$max": {"last_activity": session["last"]["timestamp"]},
+                    "$inc": {"message_count": session["count"], "message_seq": session["count"]}
                 },
                 upsert=True
             )
+            for session_id, session in sessions.items()
+        ]
+        if not operations:
+            return inserted
+        result = await self.sessions_collection.bulk_write(operations, ordered=False)
+        users = [session["user_id"] for session in sessions.values()]
+        for position in result.upserted_ids:
+            await self._count_sessions(users[position], 1)
+        
+        return inserted
+    
+    async def _cache_append(self, session_id: str, documents: List[Dict]):
+        """Write saved messages through to the history cache"""
+        if self.history_cache is None:
+            return
+        await self.history_cache.append(session_id, [
+            {"role": doc["role"], "content": doc["content"], "timestamp": doc["timestamp"]}
+            for doc in documents
+        ])
+    
+    async def get_conversation_history(self, session_id: str, limit: int = 20,
+                                       purged_until: Optional[datetime] = None) -> List[Dict]:
+        """Get the most recent messages of a session, oldest first"""
+        if self.history_cache is None or limit > self.history_cache.max_messages:
+            page = await self.get_conversation_page(session_id, limit=limit, purged_until=purged_until)
+            return page["messages"]
+        
+        cached = await self.history_cache.get(session_id, limit)
+        if cached is not None:
+            return cached
+        
+        try:
+            # Fill the whole cached window so later reads of any size up to it hit
+            page = await self._find_page(session_id, self.history_cache.max_messages, purged_until=purged_until)
+        except Exception as e:
+            return []
+        
+        await self.history_cache.fill(session_id, page["messages"])
+        return page["messages"][-limit:]
+    
+    async def get_conversation_page(self, session_id: str, limit: int = 50,
+                                    before: Optional[datetime] = None, after: Optional[datetime] = None,
+                                    before_id: Optional[ObjectId] = None, after_id: Optional[ObjectId] = None,
+                                    purged_until: Optional[datetime] = None) -> Dict:
+        """Get one page of a conversation, oldest first
+        
+        Without a cursor this is the tail of the session. `before` pages
+        towards older messages and `after` towards newer ones; with the
+        boundary message's id as well, messages sharing its timestamp are
+        neither skipped nor repeated. Both walk the (session_id, timestamp,
+        _id) index, so the cost depends on the page size and not on the
+        session length.
+        
+        `purged_until` is the session's purge_before, read by the caller
+        with the session record: messages a delete left for the background
+        purge are gone as far as readers are concerned, even when the
+        session_id has been used again since.
+        """
+        try:
+            return await self._find_page(session_id, limit, before, after, before_id, after_id, purged_until)
+            
+        except Exception as e:
+            return {"messages": [], "has_more": False}
+    
+    async def _find_page(self, session_id: str, limit: int,
+                         before: Optional[datetime] = None, after: Optional[datetime] = None,
+                         before_id: Optional[ObjectId] = None, after_id: Optional[ObjectId] = None,
+                         purged_until: Optional[datetime] = None) -> Dict:
+        """Run the bounded index scan behind get_conversation_page"""
+        query = {"session_id": session_id}
+        bounds = []
+        if after is not None:
+            bounds.append(_keyset("$gt", after, after_id))
+            direction = 1
+        else:
+            if before is not None:
+                bounds.append(_keyset("$lt", before, before_id))
+            direction = -1
+        if purged_until is not None:
+            bounds.append({"timestamp": {"$gt": purged_until}})
+        if bounds:
+            query["$and"] = bounds
+        
+        # One extra document tells us whether another page exists
+        cursor = self.chats_collection.find(
+            query,
+            {"role": 1, "content": 1, "timestamp": 1}
+        ).sort([("timestamp", direction), ("_id", direction)]).limit(limit + 1)
+        messages = [_page_message(msg) for msg in await cursor.to_list(length=limit + 1)]
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if direction == -1:
+            messages.reverse()
+        
+        return {"messages": messages, "has_more": has_more}
+    
+    async def get_session_state(self, session_id: str) -> Dict:
+        """Read the session's maintained message counter and pending purge marker"""
+        try:
+            session = await self.sessions_collection.find_one(
+                {"session_id": session_id},
+                {"_id": 0, "message_count": 1, "purge_before": 1}
+            )
+            return session or {}
             
-            # Increment message count
-            self.sessions_collection.update_one(
+        except Exception as e:
+            return {}
+    
+    async def update_session_activity(self, session_id: str, user_id: str, message_count: int = 1,
+                                      last_message: Optional[Dict] = None) -> Optional[Dict]:
+        """Update or create session record in a single upsert; returns its new message_count and message_seq"""
+        try:
+            now = datetime.utcnow()
+            fields = {
+                "user_id": user_id,
+                "last_activity": now,
+                "updated_at": now
+            }
+            if last_message is not None:
+                fields["last_message"] = self._preview(last_message)
+            session = await self.sessions_collection.find_one_and_update(
                 {"session_id": session_id},
-                {"$inc": {"message_count": 1}}
+                {
+                    "$set": fields,
+                    "$setOnInsert": {
+                        "created_at": now
+                    },
+                    # A deleted session_id used again is a live session; its old messages are still purged
+                    "$unset": {"deleted_at": "", "archiving_at": ""},
+                    # $inc creates the counters on insert, so no separate round-trip.
+                    # message_seq counts every message the session has had and,
+                    # unlike message_count, is not reset when it is deleted
+                    "$inc": {"message_count": message_count, "message_seq": message_count}
+                },
+                projection={"_id": 0, "message_count": 1, "message_seq": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
+            # The first messages of a new (or deleted and reused) session
+            if session["message_count"] == message_count:
+                await self._count_sessions(user_id, 1)
+            return session
             
+        except Exception as e:
+            return None
+    
+    async def _count_sessions(self, user_id: str, delta: int):
+        """Keep the user's maintained session total in step with created and removed sessions"""
+        try:
+            await self.user_stats_collection.update_one(
+                {"user_id": user_id}, {"$inc": {"session_count": delta}}, upsert=True
+            )
         except Exception as e:
             pass
-    def get_user_sessions(self, user_id: str, limit: int = 10) -> List[Dict]:
-        """Get all sessions for a user"""
+    
+    async def get_session_total(self, user_id: str) -> int:
+        """Read the user's maintained session total (one indexed document, however many sessions)"""
         try:
-            sessions = list(self.sessions_collection.find(
-                {"user_id": user_id},
-                {"_id": 0, "session_id": 1, "created_at": 1, "last_activity": 1, "message_count": 1}
-            ).sort("last_activity", -1).limit(limit))
+            stats = await self.user_stats_collection.find_one({"user_id": user_id}, {"_id": 0, "session_count": 1})
+            return max(0, stats.get("session_count", 0)) if stats else 0
             
-            return sessions
+        except Exception as e:
+            return 0
+    
+    async def get_session_summary(self, session_id: str) -> Dict:
+        """Read the session's rolling summary and how far it reaches, with its pending purge marker"""
+        try:
+            session = await self.sessions_collection.find_one(
+                {"session_id": session_id},
+                {"_id": 0, "summary": 1, "summary_until": 1, "summarized_count": 1, "message_count": 1, "purge_before": 1}
+            )
+            return session or {}
             
         except Exception as e:
-            return []
+            return {}
     
-    def delete_session(self, session_id: str) -> bool:
-        """Delete a session and all its messages"""
+    async def get_messages_after(self, session_id: str, after: Optional[datetime], limit: int,
+                                 purged_until: Optional[datetime] = None) -> List[Dict]:
+        """Oldest-first messages newer than `after` (from the start when None)"""
+        page = await self._find_page(session_id, limit, after=after or datetime.min, purged_until=purged_until)
+        return page["messages"]
+    
+    async def save_session_summary(self, session_id: str, summary: str, summary_until: datetime,
+                                   summarized: int, previous_until: Optional[datetime]) -> bool:
+        """Store a new summary unless another worker advanced it first"""
+        result = await self.sessions_collection.update_one(
+            {"session_id": session_id, "summary_until": previous_until},
+            {
+                "$set": {"summary": summary, "summary_until": summary_until, "summary_updated_at": datetime.utcnow()},
+                "$inc": {"summarized_count": summarized}
+            }
+        )
+        return result.modified_count == 1
+    
+    def find_sessions_to_summarize(self, min_messages: int):
+        """Cursor over sessions with at least `min_messages` unsummarized messages"""
+        return self.sessions_collection.find(
+            {"$expr": {"$gte": [
+                {"$subtract": ["$message_count", {"$ifNull": ["$summarized_count", 0]}]}, min_messages
+            ]}},
+            {"_id": 0, "session_id": 1}
+        )
+    
+    async def get_user_sessions(self, user_id: str, limit: int = 20,
+                                after: Optional[Tuple[datetime, str]] = None) -> Dict:
+        """Get one page of a user's sessions, most recently active first
+        
+        `after` is the (last_activity, session_id) of the previous page's
+        last session. Pages are read off the (user_id, last_activity,
+        session_id) index, so every page costs the same however many
+        sessions the user has. Returns the sessions and the key of the next
+        page (None on the last one).
+        """
+        query = {"user_id": user_id, "deleted_at": {"$exists": False}}
+        if after is not None:
+            last_activity, session_id = after
+            query["$or"] = [
+                {"last_activity": {"$lt": last_activity}},
+                {"last_activity": last_activity, "session_id": {"$lt": session_id}}
+            ]
+        try:
+            # One extra document tells us whether another page exists
+            cursor = self.sessions_collection.find(
+                query,
+                {"_id": 0, "session_id": 1, "user_id": 1, "created_at": 1, "last_activity": 1, "message_count": 1, "last_message": 1}
+            ).sort([("last_activity", -1), ("session_id", -1)]).limit(limit + 1)
+            sessions = await cursor.to_list(length=limit + 1)
+            
+        except Exception as e:
+            return {"sessions": [], "next": None}
+        
+        next_key = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_key = (sessions[-1]["last_activity"], sessions[-1]["session_id"])
+        return {"sessions": sessions, "next": next_key}
+    
+    async def delete_session(self, session_id: str) -> bool:
+        """Hide a session at once and mark its messages for purge_session
+        
+        Messages up to now are removed later in batches; a session_id that is
+        used again afterwards starts empty and keeps its new messages.
+        """
         try:
-            # Delete all messages in the session
-            self.chats_collection.delete_many({"session_id": session_id})
+            now = datetime.utcnow()
+            session = await self.sessions_collection.find_one_and_update(
+                {"session_id": session_id, "deleted_at": {"$exists": False}},
+                {
+                    "$set": {"deleted_at": now, "purge_before": now, "message_count": 0, "updated_at": now},
+                    "$unset": {"summary": "", "summary_until": "", "summarized_count": "", "summary_updated_at": "", "last_message": ""}
+                },
+                projection={"_id": 0, "user_id": 1}
+            )
+            # Deleting an already deleted session is a no-op
+            if session is not None:
+                await self._count_sessions(session["user_id"], -1)
             
-            # Delete the session record
-            self.sessions_collection.delete_one({"session_id": session_id})
+            if self.history_cache is not None:
+                await self.history_cache.invalidate(session_id, deleted=True)
             
             return True
             
         except Exception as e:
             return False
     
+    async def purge_session(self, session_id: str) -> int:
+        """Remove the messages of a deleted session in batches; returns how many were removed"""
+        session = await self.sessions_collection.find_one(
+            {"session_id": session_id, "purge_before": {"$exists": True}},
+            {"_id": 0, "purge_before": 1}
+        )
+        if session is None:
+            return 0
+        
+        removed = await self.delete_messages(session_id, session["purge_before"])
+        # Drop the record unless the session was used again meanwhile
+        await self.sessions_collection.delete_one(
+            {"session_id": session_id, "purge_before": session["purge_before"], "deleted_at": {"$exists": True}}
+        )
+        await self.sessions_collection.update_one(
+            {"session_id": session_id, "purge_before": session["purge_before"]},
+            {"$unset": {"purge_before": ""}}
+        )
+        return removed
+    
+    def find_sessions_to_purge(self):
+        """Cursor over deleted sessions whose messages are not purged yet (e.g. after a restart)"""
+        return self.sessions_collection.find({"purge_before": {"$exists": True}}, {"_id": 0, "session_id": 1})
+    
+    async def delete_messages(self, session_id: str, until: datetime, batch_size: int = DELETE_BATCH_SIZE,
+                              pause_ms: float = DELETE_BATCH_PAUSE_MS) -> int:
+        """Delete a session's messages up to `until`, `batch_size` at a time with a pause in between
+        
+        Each batch is a short index scan plus a delete by _id, so other
+        requests are never stuck behind one long-running delete.
+        """
+        removed = 0
+        while True:
+            cursor = self.chats_collection.find(
+                {"session_id": session_id, "timestamp": {"$lte": until}}, {"_id": 1}
+            ).sort("timestamp", 1).limit(batch_size)
+            ids = [doc["_id"] async for doc in cursor]
+            if not ids:
+                return removed
+            result = await self.chats_collection.delete_many({"_id": {"$in": ids}})
+            removed += result.deleted_count
+            await asyncio.sleep(pause_ms / 1000)
+    
+    async def find_cold_sessions(self, idle_before: datetime, limit: int, stale_claim_before: datetime) -> List[Dict]:
+        """Sessions without activity since `idle_before` and not claimed by a live archiver, oldest first"""
+        cursor = self.sessions_collection.find(
+            {
+                "last_activity": {"$lt": idle_before},
+                "purge_before": {"$exists": False},
+                "$or": [{"archiving_at": {"$exists": False}}, {"archiving_at": {"$lt": stale_claim_before}}]
+            },
+            {"_id": 0, "session_id": 1}
+        ).sort("last_activity", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+    
+    async def claim_for_archive(self, session_id: str, idle_before: datetime, stale_claim_before: datetime,
+                                claimed_at: datetime) -> Optional[Dict]:
+        """Mark a cold session as being archived by this worker; None if it is active again or already claimed"""
+        return await self.sessions_collection.find_one_and_update(
+            {
+                "session_id": session_id,
+                "last_activity": {"$lt": idle_before},
+                "$or": [{"archiving_at": {"$exists": False}}, {"archiving_at": {"$lt": stale_claim_before}}]
+            },
+            {"$set": {"archiving_at": _bson_datetime(claimed_at)}},
+            # The record as it was, without the claim
+            projection={"_id": 0, "archiving_at": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+    
+    async def get_session_messages(self, session_id: str) -> List[Dict]:
+        """Every message of a session, oldest first, as chat_history documents without _id"""
+        cursor = self.chats_collection.find({"session_id": session_id}, {"_id": 0}).sort("timestamp", 1)
+        return await cursor.to_list(length=None)
+    
+    async def restore_session(self, session: Dict, messages: List[Dict]) -> bool:
+        """Put an archived session back; False if its session_id is in use again"""
+        try:
+            await self.sessions_collection.insert_one(dict(session))
+        except DuplicateKeyError:
+            return False
+        await self._count_sessions(session["user_id"], 1)
+        if messages:
+            await self._restore_messages(session, messages)
+        return True
+    
+    async def _restore_messages(self, session: Dict, messages: List[Dict]):
+        await self.chats_collection.insert_many(messages, ordered=False)
+    
+    async def remove_archived_session(self, session_id: str, last_activity: datetime, claimed_at: datetime) -> int:
+        """Delete an archived session from MongoDB unless it saw activity after being archived
+        
+        The record goes first, and only while it still carries this claim:
+        activity clears the claim, and a session that is in use again keeps
+        its history in MongoDB rather than only in an archive that restore
+        would skip.
+        """
+        session = await self.sessions_collection.find_one_and_delete(
+            {"session_id": session_id, "last_activity": last_activity, "archiving_at": _bson_datetime(claimed_at)},
+            projection={"_id": 0, "user_id": 1}
+        )
+        if session is None:
+            return 0
+        await self._count_sessions(session["user_id"], -1)
+        return await self.delete_messages(session_id, last_activity)
+    
     def close(self):
         """Close MongoDB connection"""
         if self.client:
             self.client.close()
 
+class BucketedMongoDBManager(MongoDBManager):
+    """MongoDBManager that stores messages in per-session bucket documents
+    
+    A chat_buckets document holds up to `bucket_size` consecutive messages
+    of one session, so a page of a conversation is one or two document
+    reads instead of one per message. A message's bucket follows from its
+    position in the session, which the session upsert's message_seq
+    increment hands out, so concurrent writers never pick the same slot.
+    message_seq survives a delete, so a reused session_id starts past the
+    buckets its purge has not removed yet.
+    """
+    def __init__(self, bucket_size: int = MESSAGE_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.buckets_collection = None
+        super().__init__()
+    
+    def connect(self):
+        super().connect()
+        self.buckets_collection = self.db[os.getenv("MONGODB_BUCKETS_COLLECTION", "chat_buckets")]
+    
+    async def save_message(self, session_id: str, user_id: str, role: str, content: str, metadata: Dict = None,
+                           message_id: Optional[ObjectId] = None, timestamp: Optional[datetime] = None) -> str:
+        """Save a single message to its session's bucket"""
+        ids = await self.save_turn(session_id, user_id, [
+            {"role": role, "content": content, "metadata": metadata, "message_id": message_id, "timestamp": timestamp}
+        ])
+        return ids[0] if ids else ""
+    
+    async def save_turn(self, session_id: str, user_id: str, messages: List[Dict]) -> List[str]:
+        """Save a turn with one session upsert and one bucket upsert (two when it crosses a bucket boundary)"""
+        try:
+            documents = self._turn_documents(session_id, user_id, messages)
+            for document in documents:
+                document.setdefault("_id", ObjectId())
+            
+            session = await self.update_session_activity(session_id, user_id, message_count=len(documents), last_message=documents[-1])
+            if session is None:
+                return []
+            await self._push(session_id, user_id, documents, session["message_seq"] - len(documents))
+            await self._cache_append(session_id, documents)
+            
+            return [str(document["_id"]) for document in documents]
+            
+        except Exception as e:
+            return []
+    
+    async def _push(self, session_id: str, user_id: str, documents: List[Dict], start: int):
+        """Append messages occupying positions start, start+1, ... to their buckets"""
+        positions = enumerate(documents, start)
+        for seq, group in groupby(positions, key=lambda item: item[0] // self.bucket_size):
+            entries = [
+                {
+                    # Archived messages come back without one
+                    "_id": document.get("_id") or ObjectId(),
+                    **{key: document[key] for key in ("role", "content", "timestamp", "metadata") if key in document}
+                }
+                for _, document in group
+            ]
+            timestamps = [entry["timestamp"] for entry in entries]
+            await self.buckets_collection.update_one(
+                {"session_id": session_id, "seq": seq},
+                {
+                    "$push": {"messages": {"$each": entries}},
+                    "$setOnInsert": {"user_id": user_id},
+                    "$min": {"first_ts": min(timestamps)},
+                    "$max": {"last_ts": max(timestamps)}
+                },
+                upsert=True
+            )
+    
+    async def _import_batch(self, batch: List[Dict]) -> int:
+        """Append one import batch session by session: one session upsert and the bucket upserts each"""
+        sessions: Dict[str, List[Dict]] = {}
+        for msg in sorted(batch, key=lambda msg: msg["timestamp"]):
+            sessions.setdefault(msg["session_id"], []).append(msg)
+        
+        inserted = 0
+        for session_id, msgs in sessions.items():
+            user_id = msgs[-1]["user_id"]
+            documents = [self._message_document(session_id, user_id, msg, msg["timestamp"]) for msg in msgs]
+            session = await self.sessions_collection.find_one_and_update(
+                {"session_id": session_id},
+                {
+                    "$set": {
+                        "user_id": user_id,
+                        "updated_at": datetime.utcnow(),
+                        "last_message": self._preview(documents[-1])
+                    },
+                    "$min": {"created_at": documents[0]["timestamp"]},
+                    "$max": {"last_activity": documents[-1]["timestamp"]},
+                    "$inc": {"message_count": len(documents), "message_seq": len(documents)}
+                },
+                projection={"_id": 0, "message_count": 1, "message_seq": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            if session["message_count"] == len(documents):
+                await self._count_sessions(user_id, 1)
+            await self._push(session_id, user_id, documents, session["message_seq"] - len(documents))
+            inserted += len(documents)
+        return inserted
+    
+    async def _find_page(self, session_id: str, limit: int,
+                         before: Optional[datetime] = None, after: Optional[datetime] = None,
+                         before_id: Optional[ObjectId] = None, after_id: Optional[ObjectId] = None,
+                         purged_until: Optional[datetime] = None) -> Dict:
+        """Read the page from the fewest buckets that can hold it
+        
+        The nearest bucket may contain a single matching message, so limit
+        messages plus the one that tells has_more need ceil(limit /
+        bucket_size) + 1 buckets: two for any page up to a bucket's size.
+        Further buckets are read only when those come up short.
+        """
+        query = {"session_id": session_id}
+        if after is not None:
+            # A bucket ending at the boundary timestamp may still hold messages past its id
+            query["last_ts"] = {"$gte" if after_id is not None else "$gt": after}
+            direction = 1
+        else:
+            if before is not None:
+                query["first_ts"] = {"$lte" if before_id is not None else "$lt": before}
+            direction = -1
+        if purged_until is not None:
+            last_ts = query.setdefault("last_ts", {})
+            last_ts["$gt"] = max(last_ts.get("$gt", purged_until), purged_until)
+        
+        def position(msg):
+            return msg["timestamp"], msg.get("_id") or ObjectId("0" * 24)
+        
+        def wanted(msg):
+            return (after is None or position(msg) > (after, after_id or ObjectId("f" * 24))) and \
+                (before is None or position(msg) < (before, before_id or ObjectId("0" * 24))) and \
+                (purged_until is None or msg["timestamp"] > purged_until)
+        
+        fetch = -(-limit // self.bucket_size) + 1
+        messages = []
+        while True:
+            cursor = self.buckets_collection.find(
+                query,
+                {"_id": 0, "seq": 1, "messages._id": 1, "messages.role": 1, "messages.content": 1, "messages.timestamp": 1}
+            ).sort("seq", direction).limit(fetch)
+            buckets = await cursor.to_list(length=fetch)
+            messages.extend(msg for bucket in buckets for msg in bucket["messages"] if wanted(msg))
+            # Usually done after the first read; buckets thinned by a purge, or a
+            # run of equal timestamps across buckets, can need more
+            if len(buckets) < fetch or len(messages) > limit:
+                break
+            query["seq"] = {"$gt" if direction == 1 else "$lt": buckets[-1]["seq"]}
+        
+        # Oldest first, in the same (timestamp, _id) order as the per-message layout
+        messages.sort(key=position)
+        messages = [_page_message(msg) for msg in messages]
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit] if direction == 1 else messages[-limit:]
+        
+        return {"messages": messages, "has_more": has_more}
+    
+    async def delete_messages(self, session_id: str, until: datetime, batch_size: int = DELETE_BATCH_SIZE,
+                              pause_ms: float = DELETE_BATCH_PAUSE_MS) -> int:
+        """Delete a session's messages up to `until`: whole buckets in batches, then the older part of one that straddles it"""
+        removed = 0
+        buckets_per_batch = max(1, batch_size // self.bucket_size)
+        while True:
+            cursor = self.buckets_collection.find(
+                {"session_id": session_id, "last_ts": {"$lte": until}}, {"_id": 1, "messages.timestamp": 1}
+            ).limit(buckets_per_batch)
+            buckets = await cursor.to_list(length=buckets_per_batch)
+            if not buckets:
+                break
+            await self.buckets_collection.delete_many({"_id": {"$in": [bucket["_id"] for bucket in buckets]}})
+            removed += sum(len(bucket["messages"]) for bucket in buckets)
+            await asyncio.sleep(pause_ms / 1000)
+        
+        cursor = self.buckets_collection.find(
+            {"session_id": session_id, "first_ts": {"$lte": until}}, {"_id": 1, "messages.timestamp": 1}
+        )
+        async for bucket in cursor:
+            removed += sum(1 for msg in bucket["messages"] if msg["timestamp"] <= until)
+            await self.buckets_collection.update_one(
+                {"_id": bucket["_id"]},
+                # first_ts stays a lower bound of what is left
+                {"$pull": {"messages": {"timestamp": {"$lte": until}}}, "$set": {"first_ts": until}}
+            )
+        return removed
+    
+    async def get_session_messages(self, session_id: str) -> List[Dict]:
+        """Every message of a session, oldest first, in chat_history's shape so archives work with either layout"""
+        cursor = self.buckets_collection.find({"session_id": session_id}, {"_id": 0}).sort("seq", 1)
+        messages = []
+        async for bucket in cursor:
+            for msg in sorted(bucket["messages"], key=lambda msg: msg["timestamp"]):
+                document = self._message_document(session_id, bucket["user_id"], msg, msg["timestamp"])
+                document.pop("_id", None)
+                messages.append(document)
+        return messages
+    
+    async def _restore_messages(self, session: Dict, messages: List[Dict]):
+        start = max(0, session.get("message_seq", session.get("message_count", len(messages))) - len(messages))
+        await self._push(session["session_id"], session["user_id"], messages, start)
+    
+    async def migrate_session(self, session_id: str, user_id: str) -> int:
+        """Copy a session's chat_history messages that its buckets do not hold yet; returns how many were copied
+        
+        Only messages newer than the latest bucket are copied, so running it
+        again picks up what was written since and copies nothing twice.
+        """
+        latest = await self.buckets_collection.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "seq": 1, "last_ts": 1, "messages.timestamp": 1},
+            sort=[("seq", -1)]
+        )
+        query = {"session_id": session_id}
+        start = 0
+        if latest is not None:
+            query["timestamp"] = {"$gt": latest["last_ts"]}
+            start = latest["seq"] * self.bucket_size + len(latest["messages"])
+        
+        cursor = self.chats_collection.find(query).sort("timestamp", 1)
+        documents = await cursor.to_list(length=None)
+        if not documents:
+            return 0
+        
+        await self._push(session_id, user_id, documents, start)
+        await self.sessions_collection.update_one(
+            {"session_id": session_id},
+            {
+                # New positions must start past the copied ones
+                "$max": {"message_seq": start + len(documents)},
+                "$set": {"last_message": self._preview(documents[-1])}
+            }
+        )
+        return len(documents)
+
 # Global MongoDB manager instance
-mongodb_manager = MongoDBManager()
\ No newline at end of file
+mongodb_manager = BucketedMongoDBManager() if MESSAGE_LAYOUT == "buckets" else MongoDBManager()
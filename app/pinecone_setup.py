@@ -1,12 +1,19 @@
 import os
+from functools import lru_cache
 from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
+from .config import EMBEDDING_DIMENSION, PINECONE_POOL_MAXSIZE
 
 load_dotenv()
 
+@lru_cache(maxsize=None)
+def get_pinecone_client() -> Pinecone:
+    """Process-wide Pinecone client"""
+    return Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+
 def initialize_pinecone():
     """Initialize Pinecone index for document storage"""
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    pc = get_pinecone_client()
     
     index_name = os.getenv("PINECONE_INDEX_NAME", "chill-panda-index")
     
@@ -15,7 +22,7 @@ def initialize_pinecone():
         # Create index if it doesn't exist
         pc.create_index(
             name=index_name,
-            dimension=1536,  # OpenAI ada-002 embedding dimension
+            dimension=EMBEDDING_DIMENSION,  # 1536 for OpenAI ada-002
             metric="cosine",
             spec=ServerlessSpec(
                 cloud="aws",
@@ -25,8 +32,13 @@ def initialize_pinecone():
     
     return pc.Index(index_name)
 
+@lru_cache(maxsize=None)
 def get_pinecone_index():
-    """Get Pinecone index instance"""
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    """Get the Pinecone index instance, created once per process
+    
+    The index keeps a pooled HTTP connection per retrieval thread, so
+    queries reuse warm connections instead of resolving the host and
+    handshaking each time.
+    """
     index_name = os.getenv("PINECONE_INDEX_NAME", "chill-panda-index")
-    return pc.Index(index_name)
\ No newline at end of file
+    return get_pinecone_client().Index(index_name, connection_pool_maxsize=PINECONE_POOL_MAXSIZE)
@@ -0,0 +1,178 @@
+import logging
+from typing import List, Dict, Optional, Tuple
+from .config import (
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_MAX_MESSAGE_TOKENS,
+    PROMPT_MAX_HISTORY_MESSAGES,
+    PROMPT_MIN_FRAGMENT_TOKENS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Chat formatting adds a few tokens around every message and before the reply
+TOKENS_PER_MESSAGE = 3
+REPLY_PRIMING_TOKENS = 3
+
+CONTEXT_HEADER = "Relevant wisdom from The Chill Panda book:\n\n"
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+CONTEXT_INSTRUCTION = "\n\nBased on the above wisdom from The Chill Panda book, and as the Chill Panda, respond to: "
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+class TokenCounter:
+    """tiktoken counts for one chat model
+
+    The encoding is loaded on first use (tiktoken downloads it once per
+    machine). If it cannot be loaded, counts fall back to an estimate of four
+    characters per token so requests keep working.
+    """
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+
+    @property
+    def encoding(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                import tiktoken
+
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model)
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.warning("tiktoken encoding for %s unavailable (%s), estimating token counts", self.model, e)
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return -(-len(text) // 4)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int, keep_tail: bool = False) -> str:
+        """Cut text down to max_tokens, keeping its start (or start and end)"""
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            tokens = text
+            limit = max_tokens * 4
+            join = "".join
+        else:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            limit = max_tokens
+            join = self.encoding.decode
+        if len(tokens) <= limit:
+            return text
+        # Leave room for the ellipsis marking the cut
+        limit = max(1, limit - (3 if self.encoding is None else 2) * (2 if keep_tail else 1))
+
+        if keep_tail:
+            # The question often comes at the end of a long message
+            head = limit // 2
+            return join(tokens[:head]) + " … " + join(tokens[len(tokens) - (limit - head):])
+        return join(tokens[:limit]) + " …"
+
+class PromptBuilder:
+    """Assembles the chat prompt within a token budget
+
+    Parts are admitted by priority: the system prompt, the current message
+    (cut to `max_message_tokens`), retrieved chunks in rank order, the
+    session summary, then history from the newest message back. The first part that does not fit
+    is truncated if at least `min_fragment_tokens` remain; everything after
+    it is dropped.
+    """
+    def __init__(self, system_prompt: str, model: str, budget: int = PROMPT_TOKEN_BUDGET,
+                 max_message_tokens: int = PROMPT_MAX_MESSAGE_TOKENS,
+                 max_history_messages: int = PROMPT_MAX_HISTORY_MESSAGES,
+                 min_fragment_tokens: int = PROMPT_MIN_FRAGMENT_TOKENS):
+        self.system_prompt = system_prompt
+        self.counter = TokenCounter(model)
+        self.budget = budget
+        self.max_message_tokens = max_message_tokens
+        self.max_history_messages = max_history_messages
+        self.min_fragment_tokens = min_fragment_tokens
+
+    def warm_up(self):
+        self.counter.count("warm up")
+
+    def _fit(self, text: str, remaining: int, overhead: int) -> Optional[Tuple[str, int]]:
+        """text (or a truncated fragment of it) and its token cost, if anything fits"""
+        cost = self.counter.count(text) + overhead
+        if cost <= remaining:
+            return text, cost
+        if remaining - overhead < self.min_fragment_tokens:
+            return None
+        fragment = self.counter.truncate(text, remaining - overhead)
+        return fragment, self.counter.count(fragment) + overhead
+
+    def build(self, user_message: str, chunks: List[str] = None, conversation_history: List[Dict] = None,
+              summary: str = "", history_limit: Optional[int] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        """OpenAI messages for this turn, plus the token count of each part
+
+        `history_limit` replaces max_history_messages for this turn, e.g. to
+        keep every message the summary does not cover yet.
+        """
+        if history_limit is None:
+            history_limit = self.max_history_messages
+        count = self.counter.count
+        message = self.counter.truncate(user_message, self.max_message_tokens, keep_tail=True)
+
+        tokens = {
+            "system": count(self.system_prompt) + TOKENS_PER_MESSAGE,
+            "message": count(message) + TOKENS_PER_MESSAGE,
+            "context": 0,
+            "summary": 0,
+            "history": 0,
+        }
+        remaining = self.budget - tokens["system"] - tokens["message"] - REPLY_PRIMING_TOKENS
+
+        context_parts = []
+        if chunks:
+            remaining -= count(CONTEXT_HEADER) + count(CONTEXT_INSTRUCTION)
+            for chunk in chunks:
+                fitted = self._fit(chunk, remaining, count(CONTEXT_SEPARATOR))
+                if fitted is None:
+                    break
+                context_parts.append(fitted[0])
+                remaining -= fitted[1]
+                if fitted[0] is not chunk:
+                    break
+
+        if context_parts:
+            content = f"{CONTEXT_HEADER}{CONTEXT_SEPARATOR.join(context_parts)}{CONTEXT_INSTRUCTION}{message}"
+            tokens["context"] = count(content) + TOKENS_PER_MESSAGE - tokens["message"]
+        else:
+            content = message
+
+        summary_message = None
+        if summary:
+            fitted = self._fit(f"{SUMMARY_HEADER}{summary}", remaining, TOKENS_PER_MESSAGE)
+            if fitted is not None:
+                summary_message = {"role": "system", "content": fitted[0]}
+                tokens["summary"] = fitted[1]
+                remaining -= fitted[1]
+
+        history_messages = []
+        recent = (conversation_history or [])[-history_limit:] if history_limit else []
+        for msg in reversed(recent):
+            fitted = self._fit(msg["content"], remaining, TOKENS_PER_MESSAGE)
+            if fitted is None:
+                break
+            history_messages.append({"role": msg["role"], "content": fitted[0]})
+            tokens["history"] += fitted[1]
+            remaining -= fitted[1]
+            if fitted[0] is not msg["content"]:
+                break
+        history_messages.reverse()
+
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if summary_message is not None:
+            messages.append(summary_message)
+        messages += history_messages
+        messages.append({"role": "user", "content": content})
+
+        tokens["total"] = sum(tokens.values()) + REPLY_PRIMING_TOKENS
+        tokens["chunks"] = len(context_parts)
+        tokens["history_messages"] = len(history_messages)
+        return messages, tokens
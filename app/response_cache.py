@@ -0,0 +1,204 @@
+import time
+import hashlib
+from collections import deque
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from .cache import get_cache_backend
+from .config import (
+    CACHE_BACKEND,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_THRESHOLD,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_HISTORY_MESSAGES,
+    RESPONSE_CACHE_PARTITION_ENTRIES,
+)
+from .embedding_cache import normalize_text
+
+class _Partition:
+    """Replies for one (scope, history fingerprint) pair in a slot-based matrix"""
+    def __init__(self, dimension: int):
+        self.vectors = np.zeros((16, dimension), dtype=np.float32)
+        self.expires_at = np.zeros(16, dtype=np.float64)  # 0 marks a free slot
+        self.entries: List[Optional[Dict]] = [None] * 16
+        self.free: List[int] = list(range(15, -1, -1))
+
+    def add(self, vector: np.ndarray, entry: Dict, expires_at: float) -> int:
+        if not self.free:
+            capacity = len(self.entries)
+            self.vectors = np.vstack([self.vectors, np.zeros_like(self.vectors)])
+            self.expires_at = np.concatenate([self.expires_at, np.zeros(capacity)])
+            self.entries.extend([None] * capacity)
+            self.free = list(range(2 * capacity - 1, capacity - 1, -1))
+        slot = self.free.pop()
+        self.vectors[slot] = vector
+        self.expires_at[slot] = expires_at
+        self.entries[slot] = entry
+        return slot
+
+    def remove(self, slot: int):
+        if self.entries[slot] is not None:
+            self.entries[slot] = None
+            self.expires_at[slot] = 0
+            self.free.append(slot)
+
+    def best_match(self, vector: np.ndarray, now: float) -> Tuple[Optional[Dict], float]:
+        scores = self.vectors @ vector
+        scores[self.expires_at <= now] = -np.inf
+        slot = int(np.argmax(scores))
+        if not np.isfinite(scores[slot]):
+            return None, 0.0
+        return self.entries[slot], float(scores[slot])
+
+    def is_empty(self) -> bool:
+        return len(self.free) == len(self.entries)
+
+class SemanticResponseCache:
+    """Stored replies served again for near-duplicate messages
+
+    A message matches a stored one when their embeddings reach the cosine
+    `threshold` and both arrived with the same scope (language plus any
+    retrieval filters) and the same recent history (the last `history_messages` messages). With the default
+    threshold only near-identical first-turn openers are served from cache.
+    """
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, history_messages: int = RESPONSE_CACHE_HISTORY_MESSAGES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.history_messages = history_messages
+        self._partitions: Dict[Tuple[str, str], _Partition] = {}
+        # Insertion order of (partition key, slot) for size-capped eviction
+        self._order: "deque[Tuple[Tuple[str, str], int]]" = deque()
+        self.hits = 0
+        self.misses = 0
+
+    def history_fingerprint(self, history: List[Dict]) -> str:
+        recent = history[-self.history_messages:] if history and self.history_messages else []
+        digest = hashlib.sha256()
+        for msg in recent:
+            digest.update(f"{msg['role']}\0{normalize_text(msg['content'])}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def lookup(self, embedding: List[float], scope: str, history: List[Dict]) -> Optional[Dict]:
+        """Return the stored {"reply", "context"} for a near-duplicate message, if any"""
+        partition = self._partitions.get((scope, self.history_fingerprint(history)))
+        entry, score = (None, 0.0)
+        if partition is not None:
+            entry, score = partition.best_match(self._unit(embedding), time.time())
+
+        if entry is None or score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def store(self, embedding: List[float], scope: str, history: List[Dict], reply: str, context: List[str]):
+        key = (scope, self.history_fingerprint(history))
+        vector = self._unit(embedding)
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(len(vector))
+
+        slot = partition.add(vector, {"reply": reply, "context": context}, time.time() + self.ttl_seconds)
+        self._order.append((key, slot))
+        self._evict()
+
+    def _evict(self):
+        """Drop the oldest entries beyond max_entries, and partitions left empty"""
+        while len(self._order) > self.max_entries:
+            key, slot = self._order.popleft()
+            partition = self._partitions.get(key)
+            if partition is None:
+                continue
+            partition.remove(slot)
+            if partition.is_empty():
+                del self._partitions[key]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._order),
+            "partitions": len(self._partitions),
+        }
+
+class SharedResponseCache(SemanticResponseCache):
+    """SemanticResponseCache kept in a cache backend, so every worker sees every stored reply
+
+    Each (scope, history) partition is one backend entry holding its newest
+    `partition_entries` replies; lookups fetch the partition and score it
+    locally. Concurrent stores to one partition may drop one of the replies,
+    which only costs a later miss.
+    """
+    def __init__(self, backend=None, partition_entries: int = RESPONSE_CACHE_PARTITION_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.partition_entries = partition_entries
+        self.backend = backend or get_cache_backend(
+            "responses", max_entries=self.max_entries, ttl_seconds=self.ttl_seconds
+        )
+
+    def _partition_key(self, scope: str, history: List[Dict]) -> str:
+        return hashlib.sha256(f"{scope}\0{self.history_fingerprint(history)}".encode("utf-8")).hexdigest()
+
+    async def _entries(self, key: str) -> List[Dict]:
+        try:
+            entries = await self.backend.get(key) or []
+        except Exception as e:
+            return []
+        now = time.time()
+        return [entry for entry in entries if entry["expires_at"] > now]
+
+    async def lookup(self, embedding: List[float], scope: str, history: List[Dict]) -> Optional[Dict]:
+        entries = await self._entries(self._partition_key(scope, history))
+        best, best_score = None, 0.0
+        if entries:
+            vectors = np.stack([np.frombuffer(entry["vector"], dtype=np.float32) for entry in entries])
+            scores = vectors @ self._unit(embedding)
+            slot = int(np.argmax(scores))
+            best, best_score = entries[slot], float(scores[slot])
+
+        if best is None or best_score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"reply": best["reply"], "context": best["context"]}
+
+    async def store(self, embedding: List[float], scope: str, history: List[Dict], reply: str, context: List[str]):
+        key = self._partition_key(scope, history)
+        entries = await self._entries(key)
+        entries.append({
+            "vector": self._unit(embedding).tobytes(),
+            "reply": reply,
+            "context": context,
+            "expires_at": time.time() + self.ttl_seconds,
+        })
+        try:
+            await self.backend.set(key, entries[-self.partition_entries:])
+        except Exception as e:
+            pass
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "partitions": self.backend.size(),
+        }
+
+# Opt-in; per worker, or shared by every worker with CACHE_BACKEND=redis
+if not RESPONSE_CACHE_ENABLED:
+    response_cache = None
+elif CACHE_BACKEND == "redis":
+    response_cache = SharedResponseCache()
+else:
+    response_cache = SemanticResponseCache()
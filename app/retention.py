@@ -0,0 +1,170 @@
+import os
+import gzip
+import json
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from .config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_PATH,
+    ARCHIVE_BATCH_SESSIONS,
+    ARCHIVE_CLAIM_TIMEOUT_SECONDS,
+    ARCHIVE_INTERVAL_SECONDS,
+)
+from .mongodb_manager import MongoDBManager, mongodb_manager
+
+logger = logging.getLogger(__name__)
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+def _decode(value: Dict):
+    if set(value) == {"$date"}:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+class SessionArchiver:
+    """Moves sessions idle for `after_days` out of MongoDB into gzip JSONL files
+
+    Each line of a file holds one session record and all of its messages.
+    A file is written under a temporary name, flushed to disk and renamed
+    before its sessions are removed from MongoDB, so a crash in between
+    only means those sessions are archived again by the next run. A
+    session that fails to archive keeps its claim, so the run moves on
+    and the session is retried once the claim is stale.
+    """
+    def __init__(self, manager: MongoDBManager = mongodb_manager, path: str = ARCHIVE_PATH,
+                 after_days: float = ARCHIVE_AFTER_DAYS, batch_sessions: int = ARCHIVE_BATCH_SESSIONS,
+                 claim_timeout_seconds: float = ARCHIVE_CLAIM_TIMEOUT_SECONDS):
+        self.manager = manager
+        self.path = path
+        self.after_days = after_days
+        self.batch_sessions = batch_sessions
+        self.claim_timeout = timedelta(seconds=claim_timeout_seconds)
+        self.sessions = 0
+        self.messages = 0
+        self.files = 0
+
+    async def run(self) -> int:
+        """Archive every session idle past the cutoff; returns how many were archived"""
+        if self.after_days <= 0:
+            return 0
+        total = 0
+        while True:
+            archived = await self.archive_batch()
+            # No unclaimed cold sessions left
+            if archived is None:
+                return total
+            total += archived
+
+    async def archive_batch(self) -> Optional[int]:
+        """Archive one batch; returns how many were archived, None when there were no candidates"""
+        now = datetime.utcnow()
+        idle_before = now - timedelta(days=self.after_days)
+        candidates = await self.manager.find_cold_sessions(idle_before, self.batch_sessions, now - self.claim_timeout)
+        if not candidates:
+            return None
+
+        os.makedirs(self.path, exist_ok=True)
+        target = os.path.join(self.path, f"sessions-{now:%Y%m%dT%H%M%S%f}-{os.getpid()}.jsonl.gz")
+        partial = target + ".partial"
+        archived = []
+        message_count = 0
+        with gzip.open(partial, "wt", encoding="utf-8") as archive:
+            for candidate in candidates:
+                session = await self.manager.claim_for_archive(
+                    candidate["session_id"], idle_before, now - self.claim_timeout, now
+                )
+                if session is None:
+                    continue
+                try:
+                    messages = await self.manager.get_session_messages(session["session_id"])
+                    line = json.dumps({"session": session, "messages": messages}, default=_encode)
+                    # Compression is CPU work; keep it off the event loop
+                    await asyncio.to_thread(archive.write, line + "\n")
+                except Exception as e:
+                    logger.warning("Archiving %s failed, skipping it: %r", session["session_id"], e)
+                    continue
+                archived.append(session)
+                message_count += len(messages)
+
+        if not archived:
+            os.remove(partial)
+            return 0
+        await asyncio.to_thread(_commit_file, partial, target)
+        self.files += 1
+
+        for session in archived:
+            await self.manager.remove_archived_session(session["session_id"], session["last_activity"], now)
+            if self.manager.history_cache is not None:
+                await self.manager.history_cache.invalidate(session["session_id"])
+        self.sessions += len(archived)
+        self.messages += message_count
+        logger.info("Archived %d sessions (%d messages) to %s", len(archived), message_count, target)
+        return len(archived)
+
+    def stats(self) -> Dict:
+        return {"sessions": self.sessions, "messages": self.messages, "files": self.files}
+
+def _commit_file(partial: str, target: str):
+    with open(partial, "rb") as written:
+        os.fsync(written.fileno())
+    os.replace(partial, target)
+
+async def purge_deleted(manager: MongoDBManager = mongodb_manager) -> int:
+    """Finish purging deleted sessions, e.g. ones whose purge a restart cut short; returns the messages removed"""
+    pending = await manager.find_sessions_to_purge().to_list(length=None)
+    removed = 0
+    for session in pending:
+        removed += await manager.purge_session(session["session_id"])
+    return removed
+
+async def restore(paths: Iterable[str], manager: MongoDBManager = mongodb_manager) -> int:
+    """Load archive files back into MongoDB; sessions whose id is in use again are skipped"""
+    restored = 0
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            for line in archive:
+                record = json.loads(line, object_hook=_decode)
+                if await manager.restore_session(record["session"], record["messages"]):
+                    restored += 1
+    return restored
+
+async def retention_loop(archiver: SessionArchiver, interval_seconds: float = ARCHIVE_INTERVAL_SECONDS):
+    """Archive cold sessions and finish pending purges every `interval_seconds`, for in-app scheduling"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await archiver.run()
+            await purge_deleted(archiver.manager)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Retention run failed, retrying in %.0fs: %r", interval_seconds, e)
+
+async def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Archive cold chat sessions and purge deleted ones")
+    parser.add_argument("command", nargs="?", choices=["run", "archive", "purge", "restore"], default="run")
+    parser.add_argument("files", nargs="*", help="archive files to restore")
+    args = parser.parse_args(argv)
+
+    await mongodb_manager.ping()
+    if args.command == "restore":
+        logger.info("Restored %d sessions", await restore(args.files))
+        return
+    if args.command in ("run", "archive"):
+        archiver = SessionArchiver()
+        await archiver.run()
+        logger.info("Archive: %s", archiver.stats())
+    if args.command in ("run", "purge"):
+        logger.info("Purged %d messages of deleted sessions", await purge_deleted())
+
+# Run from cron when ARCHIVE_INTERVAL_SECONDS is 0: python -m app.retention
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    asyncio.run(main())
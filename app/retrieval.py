@@ -0,0 +1,200 @@
+import os
+import re
+import math
+import json
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from .config import (
+    CHUNK_STORE_PATH,
+    BM25_K1,
+    BM25_B,
+    BM25_MIN_SCORE,
+    HYBRID_CANDIDATES,
+    RRF_K,
+    RERANK_ENABLED,
+    RERANK_MODEL,
+    RERANK_BUDGET_MS,
+    RERANK_MIN_SCORE,
+)
+from .corpus import metadata_matches
+
+# CJK text has no spaces, so each ideograph is its own term
+TOKEN_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[^\W\u3400-\u9fff\uf900-\ufaff]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "for", "from", "i", "i'm", "im",
+    "in", "is", "it", "me", "my", "of", "on", "or", "so", "that", "the", "this", "to", "was",
+    "what", "with", "you", "your",
+}
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class ChunkStore:
+    """Text and metadata of every ingested chunk, keyed by chunk id
+
+    Written by ingestion next to the vector index so lexical search works
+    for either vector backend.
+    """
+    def __init__(self, path: str = CHUNK_STORE_PATH):
+        self.path = path
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.chunks = json.load(file)
+
+    def put(self, chunk_id: str, text: str, metadata: Dict[str, Any]):
+        self.chunks[chunk_id] = {"text": text, "metadata": metadata}
+
+    def remove(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            self.chunks.pop(chunk_id, None)
+
+    def replace_all(self, records: Dict[str, Dict[str, Any]]):
+        self.chunks = dict(records)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.chunks, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring"""
+    def __init__(self, texts: List[str], metadatas: List[Dict[str, Any]], k1: float = BM25_K1, b: float = BM25_B):
+        self.texts = texts
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings.setdefault(term, []).append((doc_id, frequency))
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(texts) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    @classmethod
+    def from_chunk_store(cls, store: ChunkStore):
+        records = list(store.chunks.values())
+        return cls([record["text"] for record in records], [record["metadata"] for record in records])
+
+    def search(self, query: str, k: int, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """Top-k (text, score) pairs; only documents sharing a query term are touched"""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / self.average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_id, score in ranked:
+            if filter and not metadata_matches(self.metadatas[doc_id], filter):
+                continue
+            results.append((self.texts[doc_id], score))
+            if len(results) == k:
+                break
+        return results
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    """Merge ranked lists of chunk texts by summed 1 / (k + rank)"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, text in enumerate(ranking, start=1):
+            fused[text] = fused.get(text, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
+
+class CrossEncoderReranker:
+    """Local cross-encoder that rescores (query, chunk) pairs on the CPU"""
+    def __init__(self, model_name: str = RERANK_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._busy = False
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def warm_up(self):
+        self.model.predict([("warm up", "warm up")])
+
+    def _score(self, query: str, texts: List[str]) -> List[float]:
+        return [float(score) for score in self.model.predict([(query, text) for text in texts])]
+
+    async def rerank(self, query: str, texts: List[str], budget_ms: float = RERANK_BUDGET_MS) -> Optional[List[Tuple[str, float]]]:
+        """Texts ordered by cross-encoder score, or None if the budget ran out"""
+        if self._busy:
+            # A timed-out call still holds the model thread; queueing behind it would blow the budget
+            return None
+
+        loop = asyncio.get_running_loop()
+        self._busy = True
+        future = loop.run_in_executor(self._executor, self._score, query, texts)
+        future.add_done_callback(self._release)
+        try:
+            scores = await asyncio.wait_for(asyncio.shield(future), timeout=budget_ms / 1000)
+        except asyncio.TimeoutError:
+            return None
+        return sorted(zip(texts, scores), key=lambda item: item[1], reverse=True)
+
+    def _release(self, future):
+        self._busy = False
+        # Retrieve any exception so it is not reported as never retrieved
+        if not future.cancelled():
+            future.exception()
+
+class HybridRetriever:
+    """Vector and BM25 candidates fused with RRF, optionally reranked"""
+    def __init__(self, bm25: BM25Index, reranker: Optional[CrossEncoderReranker] = None):
+        self.bm25 = bm25
+        self.reranker = reranker
+        self.reranks = 0
+        self.rerank_timeouts = 0
+
+    @classmethod
+    def from_config(cls):
+        reranker = CrossEncoderReranker() if RERANK_ENABLED else None
+        return cls(BM25Index.from_chunk_store(ChunkStore()), reranker)
+
+    def warm_up(self):
+        if self.reranker is not None:
+            self.reranker.warm_up()
+
+    def stats(self) -> Dict:
+        return {"documents": len(self.bm25.texts), "reranks": self.reranks, "rerank_timeouts": self.rerank_timeouts}
+
+    async def fuse(self, query: str, vector_hits: List[str], k: int, filter: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Combine thresholded vector hits with lexical hits for the same filter"""
+        lexical_hits = [
+            text for text, score in self.bm25.search(query, HYBRID_CANDIDATES, filter)
+            if score >= BM25_MIN_SCORE
+        ]
+        fused = reciprocal_rank_fusion([vector_hits, lexical_hits])
+        if self.reranker is None or len(fused) <= 1:
+            return fused[:k]
+
+        self.reranks += 1
+        reranked = await self.reranker.rerank(query, fused[:HYBRID_CANDIDATES])
+        if reranked is None:
+            # Over budget: the fused order is still a good answer
+            self.rerank_timeouts += 1
+            return fused[:k]
+        return [text for text, score in reranked if score >= RERANK_MIN_SCORE][:k]
@@ -7,14 +7,21 @@ class ChatRequest(BaseModel):
     user_id: str
     input_text: str
     language: str = "en"
+    # Optional narrowing of retrieval to corpus sources / sections (see app/data/corpus.json)
+    sources: Optional[List[str]] = None
+    sections: Optional[List[str]] = None
+    # Client-chosen id of this submission; a retry with the same key gets the first reply back
+    idempotency_key: Optional[str] = Field(None, max_length=128)
 
 class ChatResponse(BaseModel):
     reply: str
     session_id: str
     message_id: Optional[str] = None
     used_rag: bool = False
+    cached: bool = False
 
 class Message(BaseModel):
+    message_id: Optional[str] = None
     role: str
     content: str
     timestamp: datetime
@@ -25,8 +32,17 @@ class SessionInfo(BaseModel):
     created_at: datetime
     last_activity: datetime
     message_count: int
+    last_message: Optional[Message] = None
+
+class SessionPage(BaseModel):
+    sessions: List[SessionInfo]
+    # Pass as `cursor` to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
 
 class ConversationHistory(BaseModel):
     session_id: str
     messages: List[Message]
-    total_messages: int
\ No newline at end of file
+    total_messages: int
+    # Page further with ?before=<first message timestamp> or ?after=<last message timestamp>
+    has_more: bool = False
\ No newline at end of file
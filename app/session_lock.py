@@ -0,0 +1,164 @@
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+from .config import (
+    SESSION_LOCK_DISTRIBUTED,
+    SESSION_LOCK_WAIT_MS,
+    SESSION_LOCK_LEASE_MS,
+)
+from .cache import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+class SessionBusy(Exception):
+    """The session's lock could not be taken within the wait"""
+
+class LocalSessionLocks:
+    """Leased per-session locks for the coroutines of one worker
+
+    A lease that is never released (its request died before the release
+    ran) lapses after `lease_seconds`, like the distributed lock's.
+    Waiters are woken in arrival order when the holder releases.
+    """
+    def __init__(self):
+        # session_id -> (token, lease expiry on the monotonic clock)
+        self._holders: Dict[str, Tuple[str, float]] = {}
+        self._released: Dict[str, asyncio.Event] = {}
+
+    async def acquire(self, session_id: str, lease_seconds: float, wait_seconds: float) -> Optional[str]:
+        """Take the lock; returns its token, or None if it stayed held for `wait_seconds`"""
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            now = time.monotonic()
+            holder = self._holders.get(session_id)
+            if holder is None or holder[1] <= now:
+                token = uuid.uuid4().hex
+                self._holders[session_id] = (token, now + lease_seconds)
+                return token
+            if now >= deadline:
+                return None
+
+            released = self._released.setdefault(session_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(released.wait(), min(deadline, holder[1]) - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, session_id: str, token: str):
+        holder = self._holders.get(session_id)
+        if holder is not None and holder[0] == token:
+            del self._holders[session_id]
+            released = self._released.pop(session_id, None)
+            if released is not None:
+                released.set()
+
+# Delete the lock only if we still own it; a lapsed lease may belong to someone else now
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class RedisSessionLocks:
+    """Leased per-session locks shared by every worker (SET NX PX, polled while held)"""
+    def __init__(self, client=None, poll_ms: float = 25, max_poll_ms: float = 200):
+        self.client = client or get_redis_client()
+        self._release = self.client.register_script(RELEASE_SCRIPT)
+        self.poll = poll_ms / 1000
+        self.max_poll = max_poll_ms / 1000
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"chillpanda:session_lock:{session_id}"
+
+    async def acquire(self, session_id: str, lease_seconds: float, wait_seconds: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait_seconds
+        delay = self.poll
+        while True:
+            if await self.client.set(self._key(session_id), token, nx=True, px=int(lease_seconds * 1000)):
+                return token
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.max_poll)
+
+    async def release(self, session_id: str, token: str):
+        await self._release(keys=[self._key(session_id)], args=[token])
+
+class SessionGuard:
+    """A held session lock; release() is idempotent and never raises"""
+    def __init__(self, locks: "SessionLocks", session_id: str, local_token: str, shared_token: Optional[str]):
+        self._locks = locks
+        self.session_id = session_id
+        self._local_token = local_token
+        self._shared_token = shared_token
+        self._released = False
+
+    async def release(self):
+        if self._released:
+            return
+        self._released = True
+        if self._shared_token is not None:
+            try:
+                await self._locks.shared.release(self.session_id, self._shared_token)
+            except Exception as e:
+                # The lease lapses on its own
+                logger.warning("Releasing the distributed lock of %s failed: %r", self.session_id, e)
+        self._locks.local.release(self.session_id, self._local_token)
+
+class SessionLocks:
+    """Serializes chat turns per session
+
+    The in-process lock orders turns handled by one worker; with
+    SESSION_LOCK_DISTRIBUTED the Redis lock orders them across workers and
+    nodes as well. A turn holds the lock from reading history until it is
+    persisted.
+    """
+    def __init__(self, distributed: bool = SESSION_LOCK_DISTRIBUTED, wait_ms: float = SESSION_LOCK_WAIT_MS,
+                 lease_ms: float = SESSION_LOCK_LEASE_MS):
+        self.local = LocalSessionLocks()
+        self.shared = RedisSessionLocks() if distributed else None
+        self.wait = wait_ms / 1000
+        self.lease = lease_ms / 1000
+        self.acquired = 0
+        self.contended = 0
+        self.busy = 0
+
+    async def hold(self, session_id: str) -> SessionGuard:
+        """Take the session's lock(s); raises SessionBusy if they stay held for the whole wait"""
+        started = time.monotonic()
+        local_token = await self.local.acquire(session_id, self.lease, self.wait)
+        if local_token is None:
+            self.busy += 1
+            raise SessionBusy(session_id)
+
+        shared_token = None
+        if self.shared is not None:
+            try:
+                shared_token = await self.shared.acquire(
+                    session_id, self.lease, max(0.0, self.wait - (time.monotonic() - started))
+                )
+                timed_out = shared_token is None
+            except Exception as e:
+                # Without Redis, fall back to ordering within this worker
+                logger.warning("Distributed session lock unavailable, using the local one: %r", e)
+                timed_out = False
+            if timed_out:
+                self.local.release(session_id, local_token)
+                self.busy += 1
+                raise SessionBusy(session_id)
+
+        self.acquired += 1
+        if time.monotonic() - started > 0.001:
+            self.contended += 1
+        return SessionGuard(self, session_id, local_token, shared_token)
+
+    def stats(self) -> Dict:
+        return {"acquired": self.acquired, "contended": self.contended, "busy": self.busy}
+
+session_locks = SessionLocks()
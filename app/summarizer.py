@@ -0,0 +1,145 @@
+import os
+import asyncio
+import argparse
+import logging
+from typing import List, Dict, Set
+from .admission import llm_admission
+from .config import (
+    SUMMARY_MODEL,
+    SUMMARY_EVERY_MESSAGES,
+    SUMMARY_BATCH_MESSAGES,
+    SUMMARY_MAX_TOKENS,
+    SUMMARY_BACKFILL_CONCURRENCY,
+    PROMPT_MAX_HISTORY_MESSAGES,
+)
+from .upstream import openai_client, summary_upstream
+from .mongodb_manager import mongodb_manager
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and Chill Panda, a mental health companion.
+Update the summary with the new messages. Keep what matters for later turns: the user's situation, feelings,
+goals, names they mentioned, advice already given and how they responded. Write in the third person, in the
+user's language, in at most 150 words. Reply with the summary only.
+"""
+
+class ConversationSummarizer:
+    """Keeps a rolling summary of each session on its user_sessions document
+
+    Every message after the summary is sent verbatim with the prompt. Once
+    `every_messages` of them are older than the newest `recent_messages`
+    they are folded into the summary, at most `batch_messages` per model
+    call, so a prompt carries at most `window` messages besides it.
+    """
+    def __init__(self, recent_messages: int = PROMPT_MAX_HISTORY_MESSAGES, every_messages: int = SUMMARY_EVERY_MESSAGES,
+                 batch_messages: int = SUMMARY_BATCH_MESSAGES):
+        self.recent_messages = recent_messages
+        self.every_messages = every_messages
+        self.batch_messages = batch_messages
+        # Sessions being summarized by this worker
+        self._running: Set[str] = set()
+
+    @property
+    def window(self) -> int:
+        """Most messages the summary leaves uncovered while it keeps up"""
+        return self.recent_messages + self.every_messages - 1
+
+    @staticmethod
+    def unsummarized(session: Dict, history: List[Dict]) -> List[Dict]:
+        """The messages of `history` that the session summary does not cover"""
+        until = session.get("summary_until")
+        if until is None:
+            return history
+        return [msg for msg in history if msg["timestamp"] > until]
+
+    async def summarize(self, summary: str, messages: List[Dict]) -> str:
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        # Shares the worker's LLM slots with chat turns, so it is shed with them under load
+        async with await llm_admission.acquire():
+            response = await summary_upstream.call(lambda: openai_client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+                ],
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS,
+            ))
+        return response.choices[0].message.content.strip()
+
+    async def update(self, session_id: str) -> int:
+        """Fold every pending message into the session summary; returns how many were folded"""
+        if session_id in self._running:
+            return 0
+        self._running.add(session_id)
+        folded = 0
+        try:
+            while True:
+                session = await mongodb_manager.get_session_summary(session_id)
+                pending = session.get("message_count", 0) - session.get("summarized_count", 0) - self.recent_messages
+                if pending < self.every_messages:
+                    return folded
+
+                messages = await mongodb_manager.get_messages_after(
+                    session_id, session.get("summary_until"), min(pending, self.batch_messages),
+                    session.get("purge_before")
+                )
+                if not messages:
+                    return folded
+
+                summary = await self.summarize(session.get("summary", ""), messages)
+                saved = await mongodb_manager.save_session_summary(
+                    session_id, summary, messages[-1]["timestamp"], len(messages), session.get("summary_until")
+                )
+                if not saved:
+                    # Another worker got there first
+                    return folded
+                folded += len(messages)
+        finally:
+            self._running.discard(session_id)
+
+    async def maybe_update(self, session_id: str):
+        """Background hook after a turn is saved; failures only cost freshness"""
+        try:
+            await self.update(session_id)
+        except Exception as e:
+            logger.warning("Summary update for %s failed: %s", session_id, e)
+
+    async def backfill(self, concurrency: int = SUMMARY_BACKFILL_CONCURRENCY) -> int:
+        """Summarize existing sessions that are long enough to need it"""
+        semaphore = asyncio.Semaphore(concurrency)
+        sessions = 0
+
+        async def run(session_id: str):
+            async with semaphore:
+                try:
+                    if await self.update(session_id):
+                        logger.info("Summarized %s", session_id)
+                except Exception as e:
+                    logger.warning("Summary backfill for %s failed: %s", session_id, e)
+
+        tasks = set()
+        async for session in mongodb_manager.find_sessions_to_summarize(self.recent_messages + self.every_messages):
+            sessions += 1
+            task = asyncio.create_task(run(session["session_id"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if len(tasks) >= concurrency * 2:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if tasks:
+            await asyncio.wait(tasks)
+        return sessions
+
+conversation_summarizer = ConversationSummarizer()
+
+# Summarize existing sessions: python -m app.summarizer
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+    parser = argparse.ArgumentParser(description="Backfill rolling summaries for existing sessions")
+    parser.add_argument("--concurrency", type=int, default=SUMMARY_BACKFILL_CONCURRENCY)
+    args = parser.parse_args()
+
+    count = asyncio.run(conversation_summarizer.backfill(args.concurrency))
+    logger.info("Checked %d sessions", count)
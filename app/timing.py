@@ -0,0 +1,46 @@
+import time
+import logging
+from typing import Awaitable, Dict, TypeVar
+from .config import REQUEST_BUDGET_MS
+from .metrics import record_stages, span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class StageTimer:
+    """Wall-clock timings of the named stages of one request"""
+    def __init__(self, budget_ms: float = REQUEST_BUDGET_MS):
+        self.started = time.perf_counter()
+        # Upstream calls of this request must finish by then (time.perf_counter() scale)
+        self.deadline = self.started + budget_ms / 1000
+        self.stages: Dict[str, float] = {}
+        # Prompt token counts (and chunks / history messages kept), set when the prompt is built
+        self.tokens: Dict[str, int] = {}
+
+    async def measure(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await a stage and record its duration in milliseconds"""
+        start = time.perf_counter()
+        try:
+            with span(stage):
+                return await awaitable
+        finally:
+            self.stages[stage] = (time.perf_counter() - start) * 1000
+
+    def total_ms(self) -> float:
+        """Elapsed time since the timer was created"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Render the stages as a Server-Timing header value"""
+        entries = [f"{stage};dur={duration:.1f}" for stage, duration in self.stages.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+    def log(self, route: str):
+        """Log the stage breakdown for this request and feed it to the metrics"""
+        record_stages(route, self.stages, self.tokens)
+        stages = " ".join(f"{stage}={duration:.1f}ms" for stage, duration in self.stages.items())
+        if self.tokens:
+            stages += " prompt " + " ".join(f"{part}={count}" for part, count in self.tokens.items())
+        logger.info("%s total=%.1fms %s", route, self.total_ms(), stages)
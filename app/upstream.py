@@ -0,0 +1,247 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from .config import (
+    OPENAI_TIMEOUT_SECONDS,
+    OPENAI_CONNECT_TIMEOUT_SECONDS,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    EMBEDDING_TIMEOUT_SECONDS,
+    PINECONE_TIMEOUT_SECONDS,
+    UPSTREAM_MAX_RETRIES,
+    UPSTREAM_BACKOFF_BASE_MS,
+    UPSTREAM_BACKOFF_MAX_MS,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+    HEDGE_AFTER_MS,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling the upstream: its circuit is open or the request budget is spent"""
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, connection failures, throttling and 5xx; never other 4xx"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, httpx.TransportError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS or status >= 500
+    try:
+        # The Pinecone client raises urllib3 errors for connection problems
+        from urllib3.exceptions import HTTPError
+    except ImportError:
+        return False
+    return isinstance(error, HTTPError)
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the upstream asked us to wait in a Retry-After header, if it sent one"""
+    response = getattr(error, "response", None)
+    # OpenAI errors carry the httpx response, Pinecone errors the headers themselves
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    value = headers.get("retry-after") if headers else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    """Stops calling an upstream after consecutive failures
+
+    After `failure_threshold` retryable failures in a row the circuit opens
+    and calls fail fast. Once `reset_seconds` have passed a single probe is
+    let through; its success closes the circuit, its failure re-opens it.
+    Non-retryable errors count as neither.
+    """
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self._probe_started is not None else "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        # One probe at a time; a probe that never reported back is replaced
+        if self._probe_started is not None and now - self._probe_started < self.reset_seconds:
+            return False
+        self._probe_started = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def release_probe(self):
+        """End a probe without a verdict; the circuit stays as it is and the next call probes"""
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_started is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+class Upstream:
+    """Calls to one external service with deadlines, retries, a circuit breaker and optional hedging
+
+    Every call ends in one outcome counter: success, error, timeout,
+    circuit_open or budget_exhausted; retries, hedges and hedges that won
+    are counted as they happen.
+    """
+    def __init__(self, name: str, timeout_seconds: float, max_retries: int = UPSTREAM_MAX_RETRIES,
+                 hedge_after_ms: float = 0, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after_ms / 1000
+        self.breaker = breaker or CircuitBreaker()
+        self.outcomes: Counter = Counter()
+        upstreams[name] = self
+
+    def count(self, outcome: str):
+        self.outcomes[outcome] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff in seconds"""
+        ceiling = min(UPSTREAM_BACKOFF_MAX_MS, UPSTREAM_BACKOFF_BASE_MS * 2 ** attempt)
+        return random.uniform(0, ceiling) / 1000
+
+    async def call(self, make_call: Callable[[], Awaitable[T]], deadline: Optional[float] = None,
+                   hedge: bool = True) -> T:
+        """Run make_call() until it succeeds, fails for good or `deadline` (time.perf_counter()) passes"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.count("circuit_open")
+                raise UpstreamUnavailable(f"{self.name} circuit is open")
+
+            timeout = self.timeout_seconds
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.perf_counter())
+                if timeout <= 0:
+                    self.count("budget_exhausted")
+                    raise UpstreamUnavailable(f"{self.name}: request budget exhausted")
+
+            try:
+                result = await asyncio.wait_for(self._attempt(make_call, hedge), timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The request itself was bad, which says nothing about the service's health
+                    self.breaker.release_probe()
+                    self.count("error")
+                    raise
+                self.breaker.record_failure()
+
+                delay = self.backoff(attempt)
+                out_of_time = deadline is not None and time.perf_counter() + delay >= deadline
+                if attempt >= self.max_retries or out_of_time:
+                    self.count("timeout" if isinstance(e, (asyncio.TimeoutError, openai.APITimeoutError)) else "error")
+                    raise
+                self.count("retry")
+                logger.info("%s call failed (%r), retry %d in %.0fms", self.name, e, attempt + 1, delay * 1000)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self.count("success")
+            return result
+
+    async def _attempt(self, make_call: Callable[[], Awaitable[T]], hedge: bool) -> T:
+        """One attempt; with hedging a second identical call races a slow first one"""
+        if not hedge or not self.hedge_after:
+            return await make_call()
+
+        first = asyncio.ensure_future(make_call())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            self.count("hedged")
+            second = asyncio.ensure_future(make_call())
+            tasks.add(second)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.count("hedge_won")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        return {"state": self.breaker.state, "outcomes": dict(self.outcomes)}
+
+# name -> Upstream, for metrics
+upstreams: Dict[str, Upstream] = {}
+
+def upstream_stats() -> Dict[str, Dict]:
+    return {name: upstream.stats() for name, upstream in upstreams.items()}
+
+# One keep-alive connection pool shared by every OpenAI client in the process
+openai_http_client = DefaultAsyncHttpxClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    ),
+)
+
+# Timeouts belong on the SDK client, which passes them with every request;
+# retries are done by Upstream.call, so the SDK's own are off
+openai_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=openai_http_client,
+    timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+    max_retries=0,
+)
+
+# Completions are never hedged: a duplicate generation doubles the cost
+chat_upstream = Upstream("openai_chat", OPENAI_TIMEOUT_SECONDS)
+# Summaries are background work; their failures must not open the chat circuit
+summary_upstream = Upstream("openai_summary", OPENAI_TIMEOUT_SECONDS)
+embedding_upstream = Upstream("embeddings", EMBEDDING_TIMEOUT_SECONDS, hedge_after_ms=HEDGE_AFTER_MS)
+vector_upstream = Upstream("vector_store", PINECONE_TIMEOUT_SECONDS, hedge_after_ms=HEDGE_AFTER_MS)
@@ -0,0 +1,135 @@
+import os
+import json
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from .config import (
+    VECTOR_STORE_BACKEND,
+    FAISS_INDEX_PATH,
+    FAISS_INDEX_TYPE,
+    FAISS_HNSW_M,
+    FAISS_HNSW_EF_SEARCH,
+)
+from .corpus import metadata_matches
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.json"
+
+class FaissVectorStore:
+    """Corpus chunks in an in-process FAISS index
+
+    Vectors are L2-normalized and searched by inner product, so scores are
+    cosine similarities on the same scale as the Pinecone cosine index and
+    RAG_SIMILARITY_THRESHOLD keeps its meaning.
+    """
+    # Searches finish in well under a millisecond; no need for a worker thread
+    runs_in_process = True
+
+    def __init__(self, index, texts: List[str], metadatas: List[Dict[str, Any]], embedding: Optional[Embeddings] = None):
+        self.index = index
+        self.texts = texts
+        self.metadatas = metadatas
+        self.embedding = embedding
+        # Ids matching each filter seen so far; requests reuse a handful of filters
+        self._filtered: Dict[str, np.ndarray] = {}
+
+    def _matching_ids(self, filter: Dict[str, Any]) -> np.ndarray:
+        """Ids whose metadata satisfies a filter from build_filter"""
+        key = json.dumps(filter, sort_keys=True)
+        if key not in self._filtered:
+            self._filtered[key] = np.fromiter(
+                (i for i, metadata in enumerate(self.metadatas) if metadata_matches(metadata, filter)), dtype=np.int64
+            )
+        return self._filtered[key]
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @classmethod
+    def from_embeddings(cls, texts: List[str], vectors: List[List[float]], metadatas: List[Dict[str, Any]] = None,
+                        embedding: Optional[Embeddings] = None, index_type: str = FAISS_INDEX_TYPE):
+        """Build a new index ("flat" for exact search, "hnsw" for approximate)"""
+        import faiss
+
+        matrix = cls._normalize(vectors)
+        dimension = matrix.shape[1]
+        if index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+        else:
+            index = faiss.IndexFlatIP(dimension)
+        index.add(matrix)
+
+        return cls(index, list(texts), metadatas or [{} for _ in texts], embedding)
+
+    @classmethod
+    def load(cls, path: str = FAISS_INDEX_PATH, embedding: Optional[Embeddings] = None, mmap: bool = True):
+        """Open a saved index; with mmap the vectors stay in the OS page cache"""
+        import faiss
+
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(os.path.join(path, INDEX_FILE), flags)
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+
+        with open(os.path.join(path, DOCSTORE_FILE), "r", encoding="utf-8") as file:
+            docstore = json.load(file)
+
+        return cls(index, docstore["texts"], docstore["metadatas"], embedding)
+
+    def save(self, path: str = FAISS_INDEX_PATH):
+        import faiss
+
+        os.makedirs(path, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(path, INDEX_FILE))
+        with open(os.path.join(path, DOCSTORE_FILE), "w", encoding="utf-8") as file:
+            json.dump({"texts": self.texts, "metadatas": self.metadatas}, file, ensure_ascii=False)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[Tuple[Document, float]]:
+        if self.index.ntotal == 0:
+            return []
+
+        params = None
+        if filter:
+            import faiss
+
+            allowed = self._matching_ids(filter)
+            if len(allowed) == 0:
+                return []
+            # Only the selected ids are scored, so narrow filters search a small candidate set
+            selector = faiss.IDSelectorBatch(allowed)
+            if hasattr(self.index, "hnsw"):
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=FAISS_HNSW_EF_SEARCH)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            k = min(k, len(allowed))
+
+        scores, ids = self.index.search(self._normalize(embedding), min(k, self.index.ntotal), params=params)
+
+        results = []
+        for score, i in zip(scores[0], ids[0]):
+            if i < 0:
+                continue
+            results.append((Document(page_content=self.texts[i], metadata=dict(self.metadatas[i])), float(score)))
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k=k, **kwargs)
+
+def get_vector_store(embeddings: Embeddings):
+    """Open the configured vector store backend ("pinecone" or "faiss")"""
+    if VECTOR_STORE_BACKEND == "faiss":
+        return FaissVectorStore.load(FAISS_INDEX_PATH, embedding=embeddings)
+
+    from langchain_pinecone import PineconeVectorStore
+    from .pinecone_setup import get_pinecone_index
+
+    return PineconeVectorStore(index=get_pinecone_index(), embedding=embeddings, text_key="text")
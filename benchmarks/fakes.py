@@ -0,0 +1,170 @@
+"""
+Local stand-ins for the backend's upstreams, so benchmarks run without network access.
+
+- fake_openai_app: an ASGI app speaking the OpenAI chat completions (plain and
+  streamed) and embeddings APIs, with configurable latency
+- InMemoryPineconeIndex: the subset of the Pinecone Index API the backend uses
+- hashed_embedding: deterministic bag-of-words vectors, so texts sharing words
+  are close and retrieval returns sensible chunks
+"""
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "breathe calm panda bamboo stress anxious exams sleep friends family worry focus gentle "
+    "mountain river patience kindness moment feeling tired lonely hope practice slowly rest "
+    "school work change fear courage smile walk listen quiet garden morning evening balance"
+).split()
+
+def hashed_embedding(text: str, dimension: int) -> List[float]:
+    """Unit vector from hashed word counts"""
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in text.lower().split():
+        digest = hashlib.blake2b(word.strip(".,!?;:").encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest, "little") % dimension] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+def matches(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    """Pinecone {"field": {"$eq" | "$in": ...}} filter (kept free of app imports, which read the environment)"""
+    for field, condition in filter.items():
+        if isinstance(condition, dict):
+            values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+        else:
+            values = [condition]
+        if metadata.get(field) not in values:
+            return False
+    return True
+
+def synthetic_text(rng: np.random.Generator, words: int) -> str:
+    return " ".join(rng.choice(WORDS, size=words))
+
+def fake_openai_app(dimension: int, ttft_ms: float = 300, token_ms: float = 20, reply_tokens: int = 60,
+                    embed_latency_ms: float = 30) -> FastAPI:
+    """OpenAI-compatible endpoints with simulated model latency
+
+    A completion takes ttft_ms until its first token and token_ms per
+    further token; streamed completions send each token as it is "generated".
+    """
+    app = FastAPI()
+    reply = ["Breathe", " slowly", ",", " little", " one", "."] * (reply_tokens // 6 + 1)
+    reply = reply[:reply_tokens]
+
+    def chunk(model: str, delta: Dict, finish_reason: Optional[str] = None) -> str:
+        payload = {
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        prompt_chars = sum(len(message.get("content") or "") for message in body["messages"])
+
+        if body.get("stream"):
+            async def stream():
+                await asyncio.sleep(ttft_ms / 1000)
+                yield chunk(model, {"role": "assistant", "content": reply[0]})
+                for token in reply[1:]:
+                    await asyncio.sleep(token_ms / 1000)
+                    yield chunk(model, {"content": token})
+                yield chunk(model, {}, "stop")
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        await asyncio.sleep((ttft_ms + token_ms * (len(reply) - 1)) / 1000)
+        return JSONResponse({
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(reply)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(reply),
+                      "total_tokens": prompt_chars // 4 + len(reply)},
+        })
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(embed_latency_ms / 1000)
+        return JSONResponse({
+            "object": "list", "model": body.get("model", "text-embedding-ada-002"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": hashed_embedding(str(text), dimension)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    return app
+
+class InMemoryPineconeIndex:
+    """Brute-force cosine index behind the Pinecone query / upsert / delete calls
+
+    latency_ms is slept on the calling thread, as a network round-trip would be.
+    """
+    def __init__(self, dimension: int, latency_ms: float = 0):
+        self.dimension = dimension
+        self.latency = latency_ms / 1000
+        self.config = SimpleNamespace(host="in-memory", api_key="bench")
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._matrix = np.zeros((0, dimension), dtype=np.float32)
+
+    def upsert(self, vectors: List[Dict], **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+            rows = []
+            for record in vectors:
+                vector = np.asarray(record["values"], dtype=np.float32)
+                vector /= np.linalg.norm(vector) or 1.0
+                if record["id"] in positions:
+                    self._matrix[positions[record["id"]]] = vector
+                    self._metadata[positions[record["id"]]] = dict(record.get("metadata") or {})
+                else:
+                    self._ids.append(record["id"])
+                    self._metadata.append(dict(record.get("metadata") or {}))
+                    rows.append(vector)
+            if rows:
+                self._matrix = np.vstack([self._matrix, np.stack(rows)])
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids: List[str], **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            drop = set(ids)
+            keep = [i for i, vector_id in enumerate(self._ids) if vector_id not in drop]
+            self._ids = [self._ids[i] for i in keep]
+            self._metadata = [self._metadata[i] for i in keep]
+            self._matrix = self._matrix[keep]
+
+    def query(self, vector: List[float], top_k: int = 4, include_metadata: bool = True,
+              filter: Optional[Dict] = None, **kwargs) -> Dict:
+        time.sleep(self.latency)
+        with self._lock:
+            matrix, ids, metadata = self._matrix, self._ids, self._metadata
+        if not ids:
+            return {"matches": []}
+
+        scores = matrix @ np.asarray(vector, dtype=np.float32)
+        if filter:
+            allowed = np.array([matches(tags, filter) for tags in metadata])
+            scores = np.where(allowed, scores, -np.inf)
+        top = np.argsort(-scores)[:top_k]
+        return {"matches": [
+            {"id": ids[i], "score": float(scores[i]), "metadata": dict(metadata[i])}
+            for i in top if np.isfinite(scores[i])
+        ]}
+
+    def describe_index_stats(self, **kwargs) -> Dict:
+        return {"dimension": self.dimension, "total_vector_count": len(self._ids)}
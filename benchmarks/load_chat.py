@@ -0,0 +1,94 @@
+"""
+Concurrency sweep against /api/v1/chat.
+
+Fires batches of chat requests at increasing concurrency levels and reports
+throughput and latency for each level. With a non-blocking request path the
+throughput should grow roughly with concurrency until the upstream (OpenAI)
+becomes the limit; a blocking path stays flat at ~1 request per LLM latency.
+
+Usage:
+    python -m benchmarks.load_chat --url http://localhost:8000 --levels 1,10,50,100,200
+"""
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from typing import List
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+async def send_chat(client: httpx.AsyncClient, url: str, headers: dict, latencies: List[float]) -> bool:
+    """Send one chat turn on a fresh session and record its latency"""
+    payload = {
+        "session_id": str(uuid.uuid4()),
+        "user_id": f"load_{uuid.uuid4().hex[:8]}",
+        "input_text": "I feel a bit anxious today",
+        "language": "en"
+    }
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json=payload, headers=headers)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    latencies.append(time.perf_counter() - start)
+    return ok
+
+async def run_level(base_url: str, api_key: str, concurrency: int, requests_per_worker: int) -> dict:
+    """Run `concurrency` workers that each send `requests_per_worker` sequential requests"""
+    url = f"{base_url.rstrip('/')}/api/v1/chat"
+    headers = {"x-api-key": api_key}
+    latencies: List[float] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker():
+            results = []
+            for _ in range(requests_per_worker):
+                results.append(await send_chat(client, url, headers, latencies))
+            return results
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    succeeded = sum(ok for results in outcomes for ok in results)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(latencies) - succeeded,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+async def main(args):
+    levels = [int(level) for level in args.levels.split(",")]
+    print(f"{'conc':>6} {'reqs':>6} {'errs':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for concurrency in levels:
+        result = await run_level(args.url, args.api_key, concurrency, args.requests_per_worker)
+        print(
+            f"{result['concurrency']:>6} {result['requests']:>6} {result['errors']:>5} "
+            f"{result['throughput_rps']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat endpoint concurrency sweep")
+    parser.add_argument("--url", default=os.getenv("BACKEND_URL", "http://localhost:8000"))
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY", ""))
+    parser.add_argument("--levels", default="1,10,50,100,200")
+    parser.add_argument("--requests-per-worker", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
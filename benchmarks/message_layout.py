@@ -0,0 +1,131 @@
+"""
+Message layout benchmark: one document per message vs bucketed messages.
+
+Seeds the same conversations into both layouts (separate collections of one
+database) and times turn writes, the newest page and an older page for
+each. Uses mongomock unless --mongo-uri points at a real mongod; only the
+latter says anything about server-side cost.
+
+Usage:
+    python -m benchmarks.message_layout --sessions 100 --turns 50 --output results/layout.json
+    python -m benchmarks.message_layout --mongo-uri mongodb://localhost:27017
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Dict
+import numpy as np
+from bson import ObjectId
+from .fakes import synthetic_text
+from .suite import summarize
+
+LAYOUTS = ["documents", "buckets"]
+
+def configure_environment(args):
+    """Must happen before anything under app/ is imported"""
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("PINECONE_API_KEY", "bench")
+    # Measure MongoDB, not the history cache in front of it
+    os.environ["HISTORY_CACHE_ENABLED"] = "false"
+    os.environ["MESSAGE_BUCKET_SIZE"] = str(args.bucket_size)
+    os.environ["MONGODB_DATABASE"] = f"chillpanda_bench_{uuid.uuid4().hex[:8]}"
+    if args.mongo_uri:
+        os.environ["MONGODB_URI"] = args.mongo_uri
+    else:
+        import mongomock_motor
+        import motor.motor_asyncio
+
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+def build_manager(layout: str):
+    """A manager of the given layout on its own collections"""
+    from app.mongodb_manager import BucketedMongoDBManager, MongoDBManager
+
+    os.environ["MONGODB_CHATS_COLLECTION"] = f"{layout}_chat_history"
+    os.environ["MONGODB_SESSIONS_COLLECTION"] = f"{layout}_user_sessions"
+    os.environ["MONGODB_BUCKETS_COLLECTION"] = f"{layout}_chat_buckets"
+    return BucketedMongoDBManager() if layout == "buckets" else MongoDBManager()
+
+async def bench_layout(layout: str, args) -> Dict:
+    from app.migrate import migrate
+
+    manager = build_manager(layout)
+    await migrate(manager)
+    rng = np.random.default_rng(13)
+    sessions = [f"bench-session-{i}" for i in range(args.sessions)]
+
+    writes = []
+    for _ in range(args.turns):
+        for session_id in sessions:
+            started = time.perf_counter()
+            await manager.save_turn(session_id, "bench-user", [
+                {"role": "user", "content": synthetic_text(rng, 20)},
+                {"role": "assistant", "content": synthetic_text(rng, 60)},
+            ])
+            writes.append((time.perf_counter() - started) * 1000)
+
+    picker = random.Random(17)
+    tail, older = [], []
+    for _ in range(args.reads):
+        session_id = picker.choice(sessions)
+        started = time.perf_counter()
+        page = await manager.get_conversation_page(session_id, limit=args.page)
+        tail.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        oldest = page["messages"][0]
+        await manager.get_conversation_page(
+            session_id, limit=args.page, before=oldest["timestamp"], before_id=ObjectId(oldest["message_id"])
+        )
+        older.append((time.perf_counter() - started) * 1000)
+
+    collection = manager.buckets_collection if layout == "buckets" else manager.chats_collection
+    result = {
+        "documents": await collection.count_documents({}),
+        "write_turn_ms": summarize(writes),
+        "tail_page_ms": summarize(tail),
+        "older_page_ms": summarize(older),
+    }
+    manager.close()
+    return result
+
+def print_result(layout: str, result: Dict):
+    print(f"{layout:>10} {result['documents']:>9}", end="")
+    for name in ("write_turn_ms", "tail_page_ms", "older_page_ms"):
+        print(f" {result[name]['p50']:>9.2f} {result[name]['p95']:>9.2f}", end="")
+    print()
+
+async def run(args) -> Dict:
+    results = {
+        "meta": {"mongo": "mongod" if args.mongo_uri else "mongomock", "args": vars(args)},
+        "layouts": {},
+    }
+    print(f"{'layout':>10} {'docs':>9} {'write p50':>9} {'p95':>9} {'tail p50':>9} {'p95':>9} {'older p50':>9} {'p95':>9}")
+    for layout in args.layouts.split(","):
+        results["layouts"][layout] = await bench_layout(layout, args)
+        print_result(layout, results["layouts"][layout])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-message vs bucketed message layout")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS))
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=50, help="turns (two messages each) per session")
+    parser.add_argument("--reads", type=int, default=500, help="pages read per layout")
+    parser.add_argument("--page", type=int, default=50, help="messages per page")
+    parser.add_argument("--bucket-size", type=int, default=50)
+    parser.add_argument("--mongo-uri", help="use this mongod instead of mongomock")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    results = asyncio.run(run(args))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"results written to {args.output}")
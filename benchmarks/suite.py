@@ -0,0 +1,428 @@
+"""
+Offline benchmark suite for the chat backend.
+
+Runs the real FastAPI app under uvicorn on loopback with local stand-ins for
+every upstream: a fake OpenAI server (configurable latency, streaming), an
+in-memory Pinecone index and mongomock (or a local mongod via --mongo-uri).
+Each scenario is swept over the concurrency levels; results hold throughput,
+client-side p50/p95/p99 latency and, for /chat, per-stage percentiles from the
+Server-Timing header. Results are written as JSON so runs can be compared.
+
+Usage:
+    python -m benchmarks.suite run --levels 1,10,50 --output results/baseline.json
+    python -m benchmarks.suite run --set RESPONSE_CACHE_ENABLED=true --output results/cache.json
+    python -m benchmarks.suite compare results/baseline.json results/cache.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+from datetime import datetime
+from typing import List, Dict, Optional
+import httpx
+import numpy as np
+import uvicorn
+from .load_chat import percentile
+from .fakes import InMemoryPineconeIndex, fake_openai_app, hashed_embedding, synthetic_text
+
+SCENARIOS = ["chat", "chat_stream", "conversation", "sessions", "ingest"]
+API_KEY = "bench-key"
+
+class ServerThread:
+    """An ASGI app served by uvicorn on a loopback port, on its own thread and event loop"""
+    def __init__(self, app, lifespan: str = "on"):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan=lifespan))
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.serve())
+
+    def start(self) -> str:
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("server failed to start")
+            time.sleep(0.05)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    def run(self, coroutine):
+        """Run a coroutine on the server's loop (where its clients live) and wait for it"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": statistics.fmean(values) if values else 0.0,
+    }
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    stages = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+def configure_environment(args, fake_url: str, workdir: str):
+    """Point the app at the fakes; must happen before anything under app/ is imported"""
+    os.environ.update({
+        "OPENAI_API_KEY": API_KEY,
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "PINECONE_API_KEY": "bench",
+        "VECTOR_STORE_BACKEND": "pinecone",
+        "EMBEDDING_PROVIDER": "openai",
+        # Synthetic chunks score low against synthetic queries; keep the top-k regardless
+        "RAG_SIMILARITY_THRESHOLD": "0",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.db"),
+        "INGEST_CHECKPOINT_PATH": os.path.join(workdir, "ingest_checkpoint.json"),
+        "CHUNK_STORE_PATH": os.path.join(workdir, "chunk_store.json"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        # Measure capacity, not the per-user limits; --set RATE_LIMIT_ENABLED=true to include them
+        "RATE_LIMIT_ENABLED": "false",
+    })
+    for setting in args.set or []:
+        key, _, value = setting.partition("=")
+        os.environ[key] = value
+    if args.mongo_uri:
+        os.environ["MONGODB_URI"] = args.mongo_uri
+        os.environ["MONGODB_DATABASE"] = f"chillpanda_bench_{uuid.uuid4().hex[:8]}"
+
+def install_fakes(args, fake_url: str, index: InMemoryPineconeIndex):
+    """Swap the Pinecone index, Mongo client and embedding client for local ones"""
+    if not args.mongo_uri:
+        import mongomock_motor
+        import motor.motor_asyncio
+
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+    import app.pinecone_setup
+    import app.embeddings
+    from langchain_openai import OpenAIEmbeddings
+    from app.config import EMBEDDING_MODEL
+    from app.upstream import openai_http_client
+
+    app.pinecone_setup.get_pinecone_index = lambda: index
+
+    def get_embeddings(provider: str = "openai"):
+        # Skips the client-side tiktoken length check, which would download the encoding
+        return OpenAIEmbeddings(
+            openai_api_key=API_KEY, model=EMBEDDING_MODEL, base_url=f"{fake_url}/v1",
+            http_async_client=openai_http_client, max_retries=0, check_embedding_ctx_length=False
+        )
+
+    app.embeddings.get_embeddings = get_embeddings
+
+def seed_corpus(index: InMemoryPineconeIndex, chunks: int, dimension: int):
+    rng = np.random.default_rng(7)
+    records = []
+    for i in range(chunks):
+        text = synthetic_text(rng, 150)
+        records.append({
+            "id": f"seed-{i}",
+            "values": hashed_embedding(text, dimension),
+            "metadata": {"source": "chill-panda-book", "language": "en", "kind": "book", "chunk_id": i, "text": text},
+        })
+    index.upsert(records)
+
+async def seed_conversations(sessions: int, turns: int) -> List[Dict[str, str]]:
+    """Sessions with history for the read scenarios, spread over a few users"""
+    from app.mongodb_manager import mongodb_manager
+
+    rng = np.random.default_rng(11)
+    seeded = []
+    for i in range(sessions):
+        session = {"session_id": f"bench-session-{i}", "user_id": f"bench-user-{i % max(1, sessions // 5)}"}
+        for _ in range(turns):
+            await mongodb_manager.save_turn(session["session_id"], session["user_id"], [
+                {"role": "user", "content": synthetic_text(rng, 20)},
+                {"role": "assistant", "content": synthetic_text(rng, 60)},
+            ])
+        seeded.append(session)
+    return seeded
+
+async def drive(concurrency: int, requests: int, send) -> Dict:
+    """Run `requests` calls of send(client, i) with `concurrency` in flight"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = []
+    counter = iter(range(requests))
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker():
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    sample = await send(client, i)
+                except httpx.HTTPError:
+                    sample = {"ok": False}
+                sample["latency_ms"] = (time.perf_counter() - started) * 1000
+                results.append(sample)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    level = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(not sample["ok"] for sample in results),
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize([sample["latency_ms"] for sample in results]),
+    }
+    stage_names = {name for sample in results for name in sample.get("stages", {})}
+    if stage_names:
+        level["stages_ms"] = {
+            name: summarize([sample["stages"][name] for sample in results if name in sample.get("stages", {})])
+            for name in sorted(stage_names)
+        }
+    for extra in ("first_token_ms", "prompt_tokens"):
+        values = [sample[extra] for sample in results if extra in sample]
+        if values:
+            level[extra] = summarize(values)
+    return level
+
+def chat_sender(base_url: str, stream: bool, run_id: str):
+    headers = {"x-api-key": API_KEY}
+    url = f"{base_url}/api/v1/chat/stream" if stream else f"{base_url}/api/v1/chat"
+    rng = np.random.default_rng(3)
+    messages = [synthetic_text(rng, 12) for _ in range(64)]
+
+    async def send(client: httpx.AsyncClient, i: int) -> Dict:
+        # A handful of turns per session, so history and summaries are exercised
+        payload = {
+            "session_id": f"{run_id}-{i // 4}",
+            "user_id": f"{run_id}-user-{i % 20}",
+            "input_text": messages[i % len(messages)],
+            "language": "en",
+        }
+        if not stream:
+            response = await client.post(url, json=payload, headers=headers)
+            sample = {"ok": response.status_code == 200}
+            if "server-timing" in response.headers:
+                sample["stages"] = parse_server_timing(response.headers["server-timing"])
+            if "x-prompt-tokens" in response.headers:
+                sample["prompt_tokens"] = float(response.headers["x-prompt-tokens"])
+            return sample
+
+        started = time.perf_counter()
+        sample = {"ok": False}
+        async with client.stream("POST", url, json=payload, headers=headers) as response:
+            if "x-prompt-tokens" in response.headers:
+                sample["prompt_tokens"] = float(response.headers["x-prompt-tokens"])
+            async for line in response.aiter_lines():
+                if line.startswith("data:") and "first_token_ms" not in sample:
+                    sample["first_token_ms"] = (time.perf_counter() - started) * 1000
+                if line.startswith("event: done"):
+                    sample["ok"] = response.status_code == 200
+        return sample
+
+    return send
+
+def read_sender(base_url: str, sessions: List[Dict[str, str]], kind: str):
+    headers = {"x-api-key": API_KEY}
+
+    async def send(client: httpx.AsyncClient, i: int) -> Dict:
+        session = sessions[i % len(sessions)]
+        if kind == "conversation":
+            url = f"{base_url}/api/v1/conversation/{session['session_id']}?limit=50"
+        else:
+            url = f"{base_url}/api/v1/sessions/{session['user_id']}"
+        response = await client.get(url, headers=headers)
+        return {"ok": response.status_code == 200}
+
+    return send
+
+async def run_ingest(chunks: int) -> Dict:
+    """Embed and upsert synthetic chunks through DocumentProcessor's pipeline"""
+    from app.document_processor import DocumentProcessor
+
+    rng = np.random.default_rng(5)
+    texts = [synthetic_text(rng, 150) for _ in range(chunks)]
+    metadata = [{"source": "bench-ingest", "language": "en", "kind": "book", "chunk_id": i} for i in range(chunks)]
+
+    processor = DocumentProcessor()
+    started = time.perf_counter()
+    await processor.ingest_to_pinecone(texts, metadata, f"bench-ingest-{uuid.uuid4().hex[:8]}")
+    elapsed = time.perf_counter() - started
+    return {"chunks": chunks, "seconds": elapsed, "chunks_per_second": chunks / elapsed if elapsed else 0.0}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def print_level(scenario: str, level: Dict):
+    latency = level["latency_ms"]
+    print(
+        f"{scenario:>13} {level['concurrency']:>5} {level['requests']:>6} {level['errors']:>5} "
+        f"{level['throughput_rps']:>9.1f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f}"
+    )
+    for name, stage in level.get("stages_ms", {}).items():
+        print(f"{'':>13} {name:>19} {'':>15} {stage['p50']:>9.1f} {stage['p95']:>9.1f} {stage['p99']:>9.1f}")
+
+def run(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="chillpanda-bench-")
+    dimension = args.dimension
+
+    fake = ServerThread(fake_openai_app(
+        dimension, ttft_ms=args.llm_ttft_ms, token_ms=args.llm_token_ms,
+        reply_tokens=args.reply_tokens, embed_latency_ms=args.embed_latency_ms
+    ), lifespan="off")
+    fake_url = fake.start()
+
+    os.environ["EMBEDDING_DIMENSION"] = str(dimension)
+    configure_environment(args, fake_url, workdir)
+    index = InMemoryPineconeIndex(dimension, latency_ms=args.pinecone_latency_ms)
+    seed_corpus(index, args.corpus_chunks, dimension)
+    install_fakes(args, fake_url, index)
+
+    import main
+
+    backend = ServerThread(main.app)
+    base_url = backend.start()
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    levels = [int(level) for level in args.levels.split(",")]
+    run_id = uuid.uuid4().hex[:8]
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "mongo": "mongod" if args.mongo_uri else "mongomock",
+            "settings": dict(setting.partition("=")[::2] for setting in args.set or []),
+            "args": {key: value for key, value in vars(args).items() if key not in ("func", "set", "output")},
+        },
+        "scenarios": {},
+    }
+
+    print(f"{'scenario':>13} {'conc':>5} {'reqs':>6} {'errs':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    try:
+        sessions = []
+        if {"conversation", "sessions"} & set(scenarios):
+            sessions = backend.run(seed_conversations(args.seed_sessions, args.seed_turns))
+
+        for scenario in scenarios:
+            if scenario == "ingest":
+                # An import error is a broken ingest pipeline, not a reason to skip it
+                result = backend.run(run_ingest(args.ingest_chunks))
+                results["scenarios"]["ingest"] = result
+                print(f"{'ingest':>13} {result['chunks']:>12} chunks {result['seconds']:>9.2f}s {result['chunks_per_second']:>9.1f} chunks/s")
+                continue
+
+            if scenario in ("chat", "chat_stream"):
+                send = chat_sender(base_url, scenario == "chat_stream", f"{run_id}-{scenario}")
+            else:
+                send = read_sender(base_url, sessions, scenario)
+
+            results["scenarios"][scenario] = []
+            for concurrency in levels:
+                requests = max(concurrency, args.requests)
+                level = asyncio.run(drive(concurrency, requests, send))
+                results["scenarios"][scenario].append(level)
+                print_level(scenario, level)
+    finally:
+        backend.stop()
+        fake.stop()
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"results written to {args.output}")
+    return results
+
+def compare(args) -> int:
+    """Print current-vs-baseline deltas; non-zero exit if anything regressed past the tolerance"""
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.current, "r", encoding="utf-8") as file:
+        current = json.load(file)
+
+    def change(old: float, new: float) -> float:
+        return (new - old) / old if old else 0.0
+
+    regressions = []
+    print(f"{'scenario':>13} {'conc':>5} {'req/s':>17} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17}")
+    for scenario, levels in current["scenarios"].items():
+        old_levels = baseline["scenarios"].get(scenario)
+        if old_levels is None:
+            continue
+        if scenario == "ingest":
+            delta = change(old_levels["chunks_per_second"], levels["chunks_per_second"])
+            print(f"{'ingest':>13} chunks/s {old_levels['chunks_per_second']:.1f} -> {levels['chunks_per_second']:.1f} ({delta:+.0%})")
+            if delta < -args.tolerance:
+                regressions.append("ingest chunks/s")
+            continue
+
+        old_by_concurrency = {level["concurrency"]: level for level in old_levels}
+        for level in levels:
+            old = old_by_concurrency.get(level["concurrency"])
+            if old is None:
+                continue
+            cells = [f"{change(old['throughput_rps'], level['throughput_rps']):+17.0%}"]
+            for pct in ("p50", "p95", "p99"):
+                cells.append(f"{change(old['latency_ms'][pct], level['latency_ms'][pct]):+17.0%}")
+            print(f"{scenario:>13} {level['concurrency']:>5} " + " ".join(cells))
+
+            if change(old["throughput_rps"], level["throughput_rps"]) < -args.tolerance:
+                regressions.append(f"{scenario}@{level['concurrency']} throughput")
+            if change(old["latency_ms"]["p95"], level["latency_ms"]["p95"]) > args.tolerance:
+                regressions.append(f"{scenario}@{level['concurrency']} p95")
+
+    if regressions:
+        print("regressions: " + ", ".join(regressions))
+        return 1
+    print("no regressions")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the scenarios against local fakes")
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    run_parser.add_argument("--levels", default="1,10,50")
+    run_parser.add_argument("--requests", type=int, default=100, help="requests per level (at least the concurrency)")
+    run_parser.add_argument("--llm-ttft-ms", type=float, default=300)
+    run_parser.add_argument("--llm-token-ms", type=float, default=20)
+    run_parser.add_argument("--reply-tokens", type=int, default=60)
+    run_parser.add_argument("--embed-latency-ms", type=float, default=30)
+    run_parser.add_argument("--pinecone-latency-ms", type=float, default=20)
+    run_parser.add_argument("--dimension", type=int, default=1536)
+    run_parser.add_argument("--corpus-chunks", type=int, default=500)
+    run_parser.add_argument("--seed-sessions", type=int, default=50)
+    run_parser.add_argument("--seed-turns", type=int, default=20)
+    run_parser.add_argument("--ingest-chunks", type=int, default=1000)
+    run_parser.add_argument("--mongo-uri", help="use this mongod instead of mongomock")
+    run_parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="backend setting for this run")
+    run_parser.add_argument("--output", help="write results JSON here")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    outcome = args.func(args)
+    sys.exit(outcome if isinstance(outcome, int) else 0)
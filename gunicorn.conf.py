@@ -0,0 +1,68 @@
+"""
+Multi-worker deployment: gunicorn -c gunicorn.conf.py main:app
+
+Every worker is a separate process with its own event loop, MongoDB,
+OpenAI and Pinecone clients, so the app is not preloaded: clients are
+never shared across a fork. Per-process pool sizes default to the
+single-process defaults split between the workers, so a host opens about
+as many upstream connections as one large process would. Set any of them
+explicitly to override.
+"""
+import os
+import shutil
+import logging
+import tempfile
+import multiprocessing
+
+logger = logging.getLogger("gunicorn.error")
+
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+preload_app = False
+
+# Streams can run for as long as the request budget allows
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recycle workers now and then, staggered so they never restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+# Single-process default and per-worker floor of each pool
+POOLS = {
+    "MONGODB_MAX_POOL_SIZE": (100, 10),
+    "OPENAI_MAX_CONNECTIONS": (200, 20),
+    "OPENAI_MAX_KEEPALIVE_CONNECTIONS": (50, 10),
+    # Also sizes the Pinecone connection pool
+    "RETRIEVAL_THREADS": (64, 8),
+    # LLM admission control is per worker too
+    "LLM_MAX_CONCURRENCY": (64, 4),
+    "LLM_MAX_QUEUE": (128, 8),
+}
+for name, (total, floor) in POOLS.items():
+    os.environ.setdefault(name, str(max(floor, total // workers)))
+
+# Local embedding and rerank models: one core's worth of threads per worker instead of every core each
+cpu_threads = str(max(1, multiprocessing.cpu_count() // workers))
+os.environ.setdefault("OMP_NUM_THREADS", cpu_threads)
+os.environ.setdefault("MKL_NUM_THREADS", cpu_threads)
+
+# Prometheus metrics summed over workers; must be set before any worker imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "chillpanda-metrics"))
+
+if workers > 1 and os.getenv("CACHE_BACKEND", "memory") != "redis":
+    # A per-worker history cache misses turns written by other workers
+    os.environ.setdefault("HISTORY_CACHE_ENABLED", "false")
+    logger.warning("CACHE_BACKEND is not redis: history cache off unless enabled explicitly, other caches per worker")
+
+def on_starting(server):
+    # Start from empty metric files; stale ones would be summed in
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,13 +1,80 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api import router
 from app.mongodb_manager import mongodb_manager
+from app.chat import get_rag_chat
+from app.config import STARTUP_RETRY_SECONDS, READINESS_TIMEOUT_MS, ARCHIVE_INTERVAL_SECONDS
+from app.upstream import openai_http_client, upstream_stats
+from app.response_cache import response_cache
+from app.admission import llm_admission, request_limits
+from app.session_lock import session_locks
+from app.idempotency import idempotency_store
+from app.retention import SessionArchiver, purge_deleted, retention_loop
+from app.metrics import MetricsMiddleware, register_stats, register_upstream_stats, scrape
+from prometheus_client import CONTENT_TYPE_LATEST
+import asyncio
 import os
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="ChillPanda - Mental Health Companion with RAG")
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
+logger = logging.getLogger(__name__)
+
+async def warm_up(app: FastAPI):
+    """Build and warm the chat pipeline in the background, retrying until it succeeds
+    
+    The server accepts connections meanwhile; /ready reports when it is done.
+    """
+    while True:
+        try:
+            rag_chat = await get_rag_chat()
+            await asyncio.to_thread(rag_chat.warm_up)
+            break
+        except Exception as e:
+            logger.warning("Chat pipeline not ready, retrying in %.0fs: %r", STARTUP_RETRY_SECONDS, e)
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+    
+    if hasattr(rag_chat.embeddings, "cache"):
+        register_stats("embedding_cache", rag_chat.embeddings.cache.stats)
+    if rag_chat.retriever is not None:
+        register_stats("hybrid_retriever", rag_chat.retriever.stats)
+    app.state.warmed_up = True
+    logger.info("Chat pipeline ready")
+
+async def finish_purges():
+    """Purge the messages of sessions whose delete a restart cut short
+    
+    Readers already skip them; this frees the space without waiting for
+    the retention loop, which is off by default.
+    """
+    try:
+        removed = await purge_deleted(mongodb_manager)
+        if removed:
+            logger.info("Purged %d messages of deleted sessions", removed)
+    except Exception as e:
+        logger.warning("Purging deleted sessions failed: %r", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing here blocks startup; indexes are created by `python -m app.migrate`
+    app.state.warmed_up = False
+    tasks = [asyncio.create_task(warm_up(app)), asyncio.create_task(finish_purges())]
+    if ARCHIVE_INTERVAL_SECONDS > 0:
+        archiver = SessionArchiver()
+        register_stats("archive", archiver.stats)
+        tasks.append(asyncio.create_task(retention_loop(archiver)))
+    yield
+    for task in tasks:
+        task.cancel()
+    mongodb_manager.close()
+    await openai_http_client.aclose()
+
+app = FastAPI(title="ChillPanda - Mental Health Companion with RAG", lifespan=lifespan)
 
 # CORS configuration
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:8501").split(",")
@@ -20,8 +87,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router)
 
+# Cache hit ratios and retriever counters, read on every scrape (the chat pipeline's once it is built)
+if mongodb_manager.history_cache is not None:
+    register_stats("history_cache", mongodb_manager.history_cache.stats)
+if response_cache is not None:
+    register_stats("response_cache", response_cache.stats)
+register_stats("llm_admission", llm_admission.stats)
+if request_limits is not None:
+    register_stats("rate_limits", request_limits.stats)
+register_stats("session_locks", session_locks.stats)
+register_stats("idempotency", idempotency_store.stats)
+register_upstream_stats(upstream_stats)
+
 @app.get('/')
 def home():
     return {
@@ -30,24 +111,44 @@ def home():
         'features': ['RAG', 'MongoDB', 'Pinecone', 'Chat History']
     }
 
+@app.get('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(scrape(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get('/live')
+def liveness():
+    """The process is up and serving; never checks dependencies"""
+    return {'status': 'alive'}
+
+@app.get('/ready')
+async def readiness():
+    """200 once the chat pipeline is warm and MongoDB answers, 503 otherwise"""
+    checks = {'chat': 'ready' if app.state.warmed_up else 'starting'}
+    try:
+        await asyncio.wait_for(mongodb_manager.ping(), READINESS_TIMEOUT_MS / 1000)
+        checks['database'] = 'connected'
+    except Exception as e:
+        checks['database'] = f'unavailable: {e!r}'
+    
+    ready = checks['chat'] == 'ready' and checks['database'] == 'connected'
+    return JSONResponse({'status': 'ready' if ready else 'not_ready', **checks}, status_code=200 if ready else 503)
+
 @app.get('/health')
-def health_check():
+async def health_check():
     try:
         # Check MongoDB connection
-        mongodb_manager.client.admin.command('ping')
+        await mongodb_manager.ping()
         return {
             'status': 'healthy',
             'database': 'connected',
-            'service': 'Chill Panda API'
+            'service': 'Chill Panda API',
+            'upstreams': upstream_stats()
         }
     except Exception as e:
         return {
             'status': 'unhealthy',
             'database': 'disconnected',
-            'error': str(e)
+            'error': str(e),
+            'upstreams': upstream_stats()
         }
-
-@app.on_event("shutdown")
-def shutdown_event():
-    """Cleanup on shutdown"""
-    mongodb_manager.close()
\ No newline at end of file
@@ -1,3 +1,6 @@
+// Indexes for a fresh container; existing deployments get the same ones from
+// `python -m app.migrate` (app/migrate.py). Keep the two in step.
+
 // Initialize MongoDB with collections
 db = db.getSiblingDB('chillpanda_db');
 
@@ -6,8 +9,12 @@ db.createCollection('chat_history');
 db.createCollection('user_sessions');
 
 // Create indexes
-db.chat_history.createIndex({ session_id: 1, timestamp: -1 });
+db.chat_history.createIndex({ session_id: 1, timestamp: -1, _id: -1 });
 db.chat_history.createIndex({ user_id: 1 });
 db.user_sessions.createIndex({ session_id: 1 }, { unique: true });
-db.user_sessions.createIndex({ user_id: 1 });
+db.user_sessions.createIndex({ user_id: 1, last_activity: -1, session_id: -1 });
 db.user_sessions.createIndex({ last_activity: -1 });
+db.user_sessions.createIndex({ purge_before: 1 }, { sparse: true });
+db.user_stats.createIndex({ user_id: 1 }, { unique: true });
+// Only used with MESSAGE_LAYOUT=buckets
+db.chat_buckets.createIndex({ session_id: 1, seq: 1 }, { unique: true });